@@ -6,6 +6,47 @@ block_cipher = None
 # Get the current directory where the spec file is located
 spec_root = os.path.abspath(SPECPATH)
 
+# Build profile (set FILECHECKER_BUILD_PROFILE or pass it to build.bat):
+#   onefile - single FileChecker.exe, unpacked to a temp folder at each launch
+#   slim    - FileChecker folder (dist\FileChecker\FileChecker.exe) without UPX,
+#             nothing to unpack at launch so it starts much faster
+build_profile = os.environ.get('FILECHECKER_BUILD_PROFILE', 'onefile').lower()
+slim = build_profile == 'slim'
+
+# Optional dependencies pandas/openpyxl/Flask can pull in but the app never uses
+excludes = [
+    'tkinter',
+    'matplotlib',
+    'scipy',
+    'IPython',
+    'jupyter_client',
+    'notebook',
+    'pytest',
+    'pandas.tests',
+    'numpy.tests',
+    'pyarrow',
+    'numba',
+    'numexpr',
+    'bottleneck',
+    'tables',
+    'sqlalchemy',
+    'psycopg2',
+    'pymysql',
+    'lxml',
+    'bs4',
+    'html5lib',
+    'xlrd',
+    'xlsxwriter',
+    'odf',
+    'pyxlsb',
+    'fsspec',
+    's3fs',
+    'gcsfs',
+    'botocore',
+    'PIL',
+    'dotenv',
+]
+
 a = Analysis(
     ['app.py'],
     pathex=[spec_root],
@@ -14,6 +55,8 @@ a = Analysis(
         (os.path.join(spec_root, 'templates'), 'templates'),
         (os.path.join(spec_root, 'assets'), 'assets'),
     ],
+    # pandas/openpyxl and smbclient (share backend 'smb') are imported lazily
+    # (importlib), so they must be listed here
     hiddenimports=[
         'flask',
         'pandas',
@@ -24,12 +67,14 @@ a = Analysis(
         'itsdangerous',
         'markupsafe',
         'flask.json.provider',
-        'werkzeug.security'
+        'werkzeug.security',
+        'waitress',
+        'smbclient'
     ],
     hookspath=[],
     hooksconfig={},
     runtime_hooks=[],
-    excludes=[],
+    excludes=excludes,
     win_no_prefer_redirects=False,
     win_private_assemblies=False,
     cipher=block_cipher,
@@ -38,25 +83,55 @@ a = Analysis(
 
 pyz = PYZ(a.pure, a.zipped_data, cipher=block_cipher)
 
-exe = EXE(
-    pyz,
-    a.scripts,
-    a.binaries,
-    a.zipfiles,
-    a.datas,
-    [],
-    name='FileChecker',
-    debug=False,
-    bootloader_ignore_signals=False,
-    strip=False,
-    upx=True,
-    upx_exclude=[],
-    runtime_tmpdir=None,
-    console=False,
-    disable_windowed_traceback=False,
-    argv_emulation=False,
-    target_arch=None,
-    codesign_identity=None,
-    entitlements_file=None,
-    icon=None
-)
+if slim:
+    exe = EXE(
+        pyz,
+        a.scripts,
+        [],
+        exclude_binaries=True,
+        name='FileChecker',
+        debug=False,
+        bootloader_ignore_signals=False,
+        strip=False,
+        upx=False,
+        console=False,
+        disable_windowed_traceback=False,
+        argv_emulation=False,
+        target_arch=None,
+        codesign_identity=None,
+        entitlements_file=None,
+        icon=None
+    )
+
+    coll = COLLECT(
+        exe,
+        a.binaries,
+        a.zipfiles,
+        a.datas,
+        strip=False,
+        upx=False,
+        name='FileChecker'
+    )
+else:
+    exe = EXE(
+        pyz,
+        a.scripts,
+        a.binaries,
+        a.zipfiles,
+        a.datas,
+        [],
+        name='FileChecker',
+        debug=False,
+        bootloader_ignore_signals=False,
+        strip=False,
+        upx=True,
+        upx_exclude=[],
+        runtime_tmpdir=None,
+        console=False,
+        disable_windowed_traceback=False,
+        argv_emulation=False,
+        target_arch=None,
+        codesign_identity=None,
+        entitlements_file=None,
+        icon=None
+    )
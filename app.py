@@ -4,13 +4,40 @@ import threading
 import webbrowser
 from flask import Flask, render_template, request, jsonify, send_file
 from werkzeug.utils import secure_filename
-import pandas as pd
+import importlib
 from datetime import datetime
 import logging
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, Future, as_completed
+from concurrent.futures.process import BrokenProcessPool
+import multiprocessing
+import ipaddress
+import urllib.request
+import urllib.error
 import socket
 import traceback
 import subprocess
+import shutil
+import argparse
+import hashlib
+import json
+import time
+import gzip
+import asyncio
+import contextvars
+import cProfile
+import pstats
+import io
+import queue
+import atexit
+import uuid
+import heapq
+import functools
+import hmac
+import errno
+from contextlib import contextmanager, asynccontextmanager, closing
+from collections import OrderedDict, Counter, namedtuple, deque
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 
 # ===== DEFAULT CREDENTIALS CONFIGURATION =====
 # Set your default Windows credentials here
@@ -19,29 +46,182 @@ DEFAULT_PASSWORD = "trf"  # Your network password
 USE_DEFAULT_CREDENTIALS = True  # Set to False to disable auto-authentication
 # =============================================
 
+# ===== SERVER CONFIGURATION =====
+# 'production' serves with waitress (threaded WSGI server), 'development'
+# with the Werkzeug development server. Both can be overridden on the command line.
+SERVER_HOST = '127.0.0.1'
+SERVER_PORT = 5001
+SERVER_MODE = 'production'
+SERVER_THREADS = 16  # Concurrent requests (long checks/transfers each hold one)
+SERVER_CONNECTION_LIMIT = 100
+SERVER_CHANNEL_TIMEOUT = 900  # Seconds an idle connection is kept; requests in progress are never cut
+SERVER_UNLIMITED_BODY_SIZE = 1024 ** 5  # Body limit given to waitress when MAX_CONTENT_LENGTH is None (its default is 1GB)
+# ================================
+
+# ===== LOGGING CONFIGURATION =====
+# Level can also be set with the FILECHECKER_LOG_LEVEL environment variable or --log-level
+LOG_LEVEL = os.environ.get('FILECHECKER_LOG_LEVEL', 'INFO')
+LOG_MAX_BYTES = 10 * 1024 * 1024  # Size of one log file before rotation
+LOG_BACKUP_COUNT = 5  # Rotated log files kept
+# =================================
+
 # Determine if we're running as a PyInstaller bundle
 if getattr(sys, 'frozen', False):
     # Running as compiled executable
     application_path = sys._MEIPASS
     base_path = os.path.dirname(sys.executable)
-    print(f"Running as EXE - Application path: {application_path}")
-    print(f"Running as EXE - Base path: {base_path}")
+    run_mode = 'EXE'
 else:
     # Running as script
     application_path = os.path.dirname(os.path.abspath(__file__))
     base_path = application_path
-    print(f"Running as script - Application path: {application_path}")
-    print(f"Running as script - Base path: {base_path}")
+    run_mode = 'script'
+
+class LazyModule:
+    """
+    Module imported on first attribute access: pandas and openpyxl add about a
+    second to startup (more from the EXE) and are only needed for inventories
+    and reports, so the server starts without them (see prewarm_heavy_modules)
+    """
+
+    def __init__(self, name):
+        self._name = name
+        self._module = None
+
+    def load(self):
+        if self._module is None:
+            self._module = importlib.import_module(self._name)
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self.load(), attr)
+
+
+pd = LazyModule('pandas')
+openpyxl = LazyModule('openpyxl')
+HEAVY_MODULES = ('pandas', 'openpyxl')
+
+
+def prewarm_heavy_modules():
+    """
+    Import the heavy modules in the background once the server is up, so the
+    first inventory or report does not pay for the import
+    """
+    def prewarm():
+        started = time.perf_counter()
+        for name in HEAVY_MODULES:
+            try:
+                importlib.import_module(name)
+            except ImportError as e:
+                logger.warning(f"Could not preload {name}: {str(e)}")
+        pd.load()
+        logger.debug(f"Heavy modules loaded in {time.perf_counter() - started:.2f}s")
+
+    threading.Thread(target=prewarm, name='prewarm', daemon=True).start()
+
+
+# Job currently running in this context (see INSTRUMENTATION)
+current_job_timings = contextvars.ContextVar('current_job_timings', default=None)
+# Priority lane of the work running in this context (see PRIORITY LANES)
+current_lane = contextvars.ContextVar('current_lane', default='interactive')
+
+
+class JsonLogFormatter(logging.Formatter):
+    """
+    One JSON object per line, with the job/store/stage context when present
+    """
+    CONTEXT_FIELDS = ('job_id', 'store', 'stage', 'duration_ms')
+
+    def format(self, record):
+        entry = {
+            'time': self.formatTime(record, '%Y-%m-%d %H:%M:%S'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage()
+        }
+        for field in self.CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                entry[field] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class JobContextFilter(logging.Filter):
+    """
+    Tag records with the id of the job running in the calling context
+    """
+
+    def filter(self, record):
+        if getattr(record, 'job_id', None) is None:
+            timings = current_job_timings.get()
+            record.job_id = timings.job_id if timings else None
+        return True
+
+
+def create_console_log_handler():
+    console_handler = logging.StreamHandler()
+    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    return console_handler
+
+
+def setup_logging(level):
+    """
+    Route all logging through a queue: callers only enqueue records, a
+    background listener writes them to the console and to rotating JSON
+    log files in the logs folder next to the executable
+    Worker processes (see SHARDED EXECUTION) do not open the log files: their
+    records go to the coordinator, and an open handle would block the rollover
+    on Windows
+    """
+    handlers = []
+    if multiprocessing.parent_process() is None:
+        log_folder = os.path.join(base_path, 'logs')
+        os.makedirs(log_folder, exist_ok=True)
+
+        file_handler = RotatingFileHandler(
+            os.path.join(log_folder, 'filechecker.log'),
+            maxBytes=LOG_MAX_BYTES,
+            backupCount=LOG_BACKUP_COUNT,
+            encoding='utf-8'
+        )
+        file_handler.setFormatter(JsonLogFormatter())
+        handlers.append(file_handler)
+
+    # No console when the EXE is built without one (see attach_cli_stdio)
+    if sys.stderr is not None:
+        handlers.append(create_console_log_handler())
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(JobContextFilter())
+
+    root_logger = logging.getLogger()
+    root_logger.handlers = [queue_handler]
+    root_logger.setLevel(level.upper())
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+    return listener
+
+
+log_listener = setup_logging(LOG_LEVEL)
+logger = logging.getLogger(__name__)
+
+logger.debug(f"Running as {run_mode} - Application path: {application_path}")
+logger.debug(f"Running as {run_mode} - Base path: {base_path}")
 
 # Set up Flask with correct paths
 template_folder = os.path.join(application_path, 'templates')
 static_folder = os.path.join(application_path, 'assets')
-print(f"Template folder: {template_folder}")
-print(f"Template folder exists: {os.path.exists(template_folder)}")
-print(f"Static folder: {static_folder}")
+logger.debug(f"Template folder: {template_folder}")
+logger.debug(f"Template folder exists: {os.path.exists(template_folder)}")
+logger.debug(f"Static folder: {static_folder}")
 
-if os.path.exists(template_folder):
-    print(f"Contents of template folder: {os.listdir(template_folder)}")
+if logger.isEnabledFor(logging.DEBUG) and os.path.exists(template_folder):
+    logger.debug(f"Contents of template folder: {os.listdir(template_folder)}")
 
 app = Flask(__name__, template_folder=template_folder, static_folder=static_folder, static_url_path='/assets')
 
@@ -49,26 +229,440 @@ app = Flask(__name__, template_folder=template_folder, static_folder=static_fold
 app.config['UPLOAD_FOLDER'] = os.path.join(base_path, 'uploads')
 app.config['REPORT_FOLDER'] = os.path.join(base_path, 'reports')
 app.config['DATA_FOLDER'] = os.path.join(base_path, 'data')
-app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+app.config['SNAPSHOT_FOLDER'] = os.path.join(base_path, 'snapshots')
+app.config['SCHEDULE_FOLDER'] = os.path.join(base_path, 'schedules')
+app.config['RESULTS_FOLDER'] = os.path.join(base_path, 'results')
+app.config['MAX_CONTENT_LENGTH'] = None  # No size cap (waitress gets the same limit, see run_server)
+app.config['UPLOAD_CHUNK_SIZE'] = 1024 * 1024  # Bytes read per chunk when streaming uploads
+app.config['STAGING_FOLDER'] = os.path.join(app.config['UPLOAD_FOLDER'], 'staging')
+app.config['STAGING_MAX_BYTES'] = 10 * 1024 * 1024 * 1024  # Staged uploads kept for reuse (10GB)
 
 # Create necessary folders
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+os.makedirs(app.config['STAGING_FOLDER'], exist_ok=True)
 os.makedirs(app.config['REPORT_FOLDER'], exist_ok=True)
 os.makedirs(app.config['DATA_FOLDER'], exist_ok=True)
+os.makedirs(app.config['SNAPSHOT_FOLDER'], exist_ok=True)
+os.makedirs(app.config['SCHEDULE_FOLDER'], exist_ok=True)
+os.makedirs(app.config['RESULTS_FOLDER'], exist_ok=True)
 
-print(f"Upload folder: {app.config['UPLOAD_FOLDER']}")
-print(f"Report folder: {app.config['REPORT_FOLDER']}")
-
-# Configure logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-logger = logging.getLogger(__name__)
+logger.debug(f"Upload folder: {app.config['UPLOAD_FOLDER']}")
+logger.debug(f"Report folder: {app.config['REPORT_FOLDER']}")
 
 # Store active network connections
 active_connections = {}
 
+# Profile every job (otherwise only jobs requested with ?profile=wall|cpu)
+PROFILE_ALL_JOBS = False
+
+# Relay distribution: values of the inventory "Seed" column marking a seed store
+SEED_VALUES = ('1', 'true', 'yes', 'oui', 'x', 'seed')
+
+# Wave rollout (distribution 'waves'): canary stores first (inventory column Canary,
+# same values as Seed, otherwise ROLLOUT_CANARY_STORES spread over the regions), then
+# waves ROLLOUT_WAVE_GROWTH times larger, until a wave fails too often
+ROLLOUT_CANARY_STORES = 5
+ROLLOUT_WAVE_GROWTH = 4
+ROLLOUT_WAVE_WORKERS = 16       # Stores of a wave copied at the same time
+ROLLOUT_MAX_FAILURE_RATE = 0.1  # Share of a wave's stores allowed to fail before halting
+ROLLOUT_WAVE_PAUSE_SECONDS = 0  # Wait after each wave (e.g. to watch the canaries)
+
+# Bandwidth caps for transfers in KB/s (0 = unlimited). The global cap is shared
+# by all transfers in progress, the per-host cap applies to each store link.
+BANDWIDTH_GLOBAL_KBPS = 0
+BANDWIDTH_PER_HOST_KBPS = 0
+# Optional time-of-day profile overriding the caps above, e.g. during store hours:
+# [{'start': '08:00', 'end': '20:00', 'global_kbps': 4096, 'per_host_kbps': 256}]
+BANDWIDTH_PROFILE = []
+
+# Compressed transfers: files with these extensions are gzipped once centrally
+# and sent to an incoming subfolder with an extraction manifest
+COMPRESSIBLE_EXTENSIONS = ('.xml', '.csv', '.txt', '.json', '.log')
+COMPRESSION_MIN_RATIO = 1.2  # Below this the file is sent raw
+INCOMING_FOLDER_NAME = '_incoming'
+PENDING_EXTRACTION_STATUS = 'Pending extraction'  # Archive sent, the file lands once extracted on the store
+
+# Store open streamed transfer sessions
+transfer_sessions = {}
+transfer_sessions_lock = threading.Lock()
+session_expiry_thread = None
+TRANSFER_SESSION_TTL_SECONDS = 6 * 3600  # Idle sessions never completed are closed after this
+TRANSFER_SESSION_EXPIRY_CHECK_SECONDS = 300  # How often idle sessions are looked for
+
+# Number of completed runs whose results are kept for paginated browsing
+MAX_STORED_RUNS = 20
+
+# Share backend (see SHARE BACKENDS): 'netuse' maps the shares with net use and reads
+# and writes through the Windows redirector, 'smb' talks SMB from this process
+# (pip install smbprotocol), 'local' stands in for the stores with local folders
+SHARE_BACKEND = os.environ.get('FILECHECKER_SHARE_BACKEND', 'netuse')
+SHARE_BACKENDS = ('netuse', 'smb', 'local')
+SHARE_LOCAL_ROOT = os.environ.get('FILECHECKER_SHARE_ROOT', '')  # 'local': folder holding one folder per store (default: shares)
+SHARE_LOCAL_LATENCY_MS = float(os.environ.get('FILECHECKER_SHARE_LATENCY_MS', 0))  # 'local': simulated WAN round trip per operation
+SMB_CONNECTION_TIMEOUT = 10        # Seconds to open an SMB session
+SMB_COPY_CHUNK_SIZE = 1024 * 1024  # Bytes per SMB write
+
+# Store I/O engine used by default for checks, transfers and bulk tests:
+# 'sync' handles one store at a time, 'async' multiplexes stores on an asyncio loop,
+# 'sharded' splits the inventory across worker processes (see SHARDED EXECUTION),
+# 'agents' hands stores to the remote agents of their region/subnet (see AGENT MODE)
+STORE_IO_ENGINE = 'sync'
+STORE_IO_ENGINES = ('sync', 'async', 'sharded', 'agents')
+ASYNC_MAX_IN_FLIGHT = 500   # Stores handled concurrently by the async engine
+ASYNC_FS_WORKERS = 64       # Threads for blocking filesystem calls (stat, copy)
+SHARD_SIZE = 250            # Stores per shard
+SHARD_WORKERS = min(8, os.cpu_count() or 1)  # Worker processes
+SHARD_ENGINE = 'async'      # Engine each worker uses for its shard
+SHARD_MAX_ATTEMPTS = 2      # Runs of a shard lost with a crashed worker process
+
+# Priority lanes (see PRIORITY LANES): every connect, stat, listing and copy on a
+# store takes one of STORE_IO_SLOTS slots; the reserved ones are for interactive work
+PRIORITY_LANES = ('interactive', 'bulk', 'scheduled')
+LANE_WEIGHTS = {'interactive': 8, 'bulk': 2, 'scheduled': 1}  # Share of freed slots when lanes compete
+STORE_IO_SLOTS = 256                 # Store operations in progress, all jobs together
+STORE_IO_SLOTS_PER_HOST = 4          # Store operations in progress on one store
+INTERACTIVE_RESERVED_SLOTS = 32      # Slots bulk and scheduled work never take
+INTERACTIVE_RESERVED_HOST_SLOTS = 1  # Same, on each store
+INTERACTIVE_MAX_STORES = 50          # Checks of more stores run in the bulk lane
+JOB_LANES = {'check': 'interactive', 'scheduled_check': 'scheduled'}  # Other jobs run in the bulk lane
+
+# Check-and-transfer pipeline: threads checking stores, and threads copying to the
+# stores the checks found missing or different
+PIPELINE_CHECK_WORKERS = 16
+PIPELINE_TRANSFER_WORKERS = 4
+PIPELINE_COMPARE_MODES = ('size', 'hash')
+
+# Remote metadata cache for existence checks (opt-in per check, see METADATA CACHE)
+METADATA_CACHE_MODE = 'off'          # Default mode: off, on, missing or refresh
+METADATA_CACHE_MODES = ('off', 'on', 'missing', 'refresh')
+METADATA_CACHE_TTL_SECONDS = 60      # 'on': any cached result younger than this is reused
+METADATA_CACHE_FOUND_TTL_SECONDS = 900  # 'missing': files found are trusted this long
+METADATA_CACHE_MAX_ENTRIES = 50000
+
+# Agent mode: shared secret agents must send (X-Agent-Token header). Without one,
+# only agents on this machine (loopback) are accepted. Remote agents need the main
+# instance to listen on the network (--host 0.0.0.0) and a token on both sides
+AGENT_TOKEN = os.environ.get('FILECHECKER_AGENT_TOKEN', '')
+AGENT_POLL_SECONDS = 2         # Idle agents ask for work this often
+AGENT_HEARTBEAT_SECONDS = 15   # Busy agents report they are alive this often
+AGENT_STALE_SECONDS = 60       # Agents silent for longer get no work, their tasks run locally
+AGENT_CLAIM_TIMEOUT = 60       # Tasks not picked up by their agent in time run locally
+AGENT_TASK_TIMEOUT = 3600      # Tasks still running after this are taken back
+
+# Scheduler settings
+SCHEDULER_TICK_SECONDS = 30  # How often the scheduler looks for due jobs
+
+
+# ===== INSTRUMENTATION =====
+# Every job (check, transfer, snapshot...) records how long each stage takes
+# per store: inventory_load, connect, stat, list, copy and report_write. The
+# per-job summary is returned in the JSON responses, and the same timings feed
+# the Prometheus metrics served on /metrics.
+
+STAGE_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+
+
+class MetricsRegistry:
+    """
+    Minimal thread-safe counters and histograms in Prometheus text format
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.help = {}
+        self.counters = {}  # name -> {labels: value}
+        self.histograms = {}  # name -> {labels: [bucket counts, sum, count]}
+
+    def describe(self, name, kind, help_text):
+        self.help[name] = (kind, help_text)
+
+    def inc(self, name, amount=1, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.counters.setdefault(name, {})
+            series[key] = series.get(key, 0) + amount
+
+    def observe(self, name, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            series = self.histograms.setdefault(name, {})
+            if key not in series:
+                series[key] = [[0] * len(STAGE_BUCKETS), 0.0, 0]
+            histogram = series[key]
+            for index, bound in enumerate(STAGE_BUCKETS):
+                if value <= bound:
+                    histogram[0][index] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    @staticmethod
+    def format_labels(labels, extra=None):
+        items = list(labels) + ([extra] if extra else [])
+        if not items:
+            return ''
+        return '{' + ','.join(f'{key}="{str(value)}"' for key, value in items) + '}'
+
+    def render(self):
+        lines = []
+        with self.lock:
+            for name, series in sorted(self.counters.items()):
+                kind, help_text = self.help.get(name, ('counter', name))
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} counter")
+                for labels, value in sorted(series.items()):
+                    lines.append(f"{name}{self.format_labels(labels)} {value}")
+            for name, series in sorted(self.histograms.items()):
+                kind, help_text = self.help.get(name, ('histogram', name))
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} histogram")
+                for labels, (buckets, total, count) in sorted(series.items()):
+                    for bound, bucket_count in zip(STAGE_BUCKETS, buckets):
+                        lines.append(f"{name}_bucket{self.format_labels(labels, ('le', bound))} {bucket_count}")
+                    lines.append(f"{name}_bucket{self.format_labels(labels, ('le', '+Inf'))} {count}")
+                    lines.append(f"{name}_sum{self.format_labels(labels)} {total}")
+                    lines.append(f"{name}_count{self.format_labels(labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+
+metrics = MetricsRegistry()
+metrics.describe('filechecker_jobs_total', 'counter', 'Jobs run, by kind')
+metrics.describe('filechecker_job_duration_seconds', 'histogram', 'Wall-clock duration of jobs, by kind')
+metrics.describe('filechecker_stage_duration_seconds', 'histogram', 'Duration of job stages, by stage')
+metrics.describe('filechecker_stage_errors_total', 'counter', 'Stages that raised an error, by stage')
+metrics.describe('filechecker_bytes_copied_total', 'counter', 'Bytes copied to stores')
+metrics.describe('filechecker_slot_wait_seconds', 'histogram', 'Wait for a store I/O slot, by lane')
+
+
+class JobTimings:
+    """
+    Per-stage and per-store durations collected during one job
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.job_id = f"{kind}-{uuid.uuid4().hex[:12]}"
+        self.started = time.perf_counter()
+        self.lock = threading.Lock()
+        self.stages = {}  # stage -> [count, total, max]
+        self.stores = {}  # store -> total seconds
+        self.profile = None  # Links to the profile files when the job is profiled
+
+    def record(self, stage, duration, store=None):
+        with self.lock:
+            stats = self.stages.setdefault(stage, [0, 0.0, 0.0])
+            stats[0] += 1
+            stats[1] += duration
+            stats[2] = max(stats[2], duration)
+            if store:
+                self.stores[store] = self.stores.get(store, 0.0) + duration
+
+    def export(self):
+        """
+        Raw stage/store totals, to be merged into the timings of another process
+        """
+        with self.lock:
+            return {'stages': {stage: list(stats) for stage, stats in self.stages.items()},
+                    'stores': dict(self.stores)}
+
+    def merge(self, exported):
+        with self.lock:
+            for stage, (count, total, maximum) in exported['stages'].items():
+                stats = self.stages.setdefault(stage, [0, 0.0, 0.0])
+                stats[0] += count
+                stats[1] += total
+                stats[2] = max(stats[2], maximum)
+            for store, seconds in exported['stores'].items():
+                self.stores[store] = self.stores.get(store, 0.0) + seconds
+
+    def summary(self, slowest=5):
+        with self.lock:
+            return {
+                'job_id': self.job_id,
+                'total_seconds': round(time.perf_counter() - self.started, 3),
+                'stages': {
+                    stage: {
+                        'count': count,
+                        'total_seconds': round(total, 3),
+                        'avg_ms': round(total / count * 1000, 1),
+                        'max_ms': round(maximum * 1000, 1)
+                    }
+                    for stage, (count, total, maximum) in self.stages.items()
+                },
+                'profile': self.profile,
+                'slowest_stores': [
+                    {'store': store, 'seconds': round(seconds, 3)}
+                    for store, seconds in sorted(self.stores.items(), key=lambda item: item[1], reverse=True)[:slowest]
+                ]
+            }
+
+
+@contextmanager
+def track_job(kind, timings=None, profile=None, lane=None):
+    """
+    Make a JobTimings current for the enclosed code (and the stages it runs)
+    profile='wall' or 'cpu' also records a cProfile of the job (see JobProfiler)
+    lane overrides the priority lane of the job kind (see PRIORITY LANES)
+    """
+    timings = timings or JobTimings(kind)
+    token = current_job_timings.set(timings)
+    lane_token = current_lane.set(lane or JOB_LANES.get(kind, 'bulk'))
+    metrics.inc('filechecker_jobs_total', kind=kind)
+    profiler = JobProfiler.start(timings, profile) if profile else None
+    try:
+        yield timings
+    finally:
+        if profiler:
+            profiler.stop()
+        current_lane.reset(lane_token)
+        current_job_timings.reset(token)
+        metrics.observe('filechecker_job_duration_seconds', time.perf_counter() - timings.started, kind=kind)
+
+
+class JobProfiler:
+    """
+    cProfile of one job, saved next to the reports as profile_<job_id>.prof
+    (for snakeviz/pstats) and profile_<job_id>.txt (readable summary)
+    'wall' measures elapsed time, including waits on the network; 'cpu' only
+    the CPU time of the thread. Only the thread running the job is profiled: the
+    work done by other threads (async engine loop, parallel copies, check-and-transfer
+    workers) or by shard processes only shows as the time the job thread waits for it.
+    One job is profiled at a time (cProfile is process-wide from Python 3.12), the
+    profiling of the others is skipped.
+    """
+    active_lock = threading.Lock()
+
+    @classmethod
+    def start(cls, timings, mode):
+        """
+        Profile a job, or return None when another job is already being profiled
+        """
+        if not cls.active_lock.acquire(blocking=False):
+            logger.warning(f"Another job is being profiled, {timings.job_id} is not")
+            timings.profile = {'mode': mode, 'skipped': 'Another job is being profiled'}
+            return None
+        try:
+            return cls(timings, mode)
+        except ValueError as e:
+            # Another profiling tool (debugger, coverage) holds the process-wide hooks
+            cls.active_lock.release()
+            logger.warning(f"Cannot profile {timings.job_id}: {str(e)}")
+            timings.profile = {'mode': mode, 'skipped': str(e)}
+            return None
+
+    def __init__(self, timings, mode):
+        self.timings = timings
+        self.mode = mode
+        self.wall_started = time.perf_counter()
+        self.cpu_started = time.thread_time()
+        self.prof_filename = f"profile_{timings.job_id}.prof"
+        self.text_filename = f"profile_{timings.job_id}.txt"
+        timings.profile = {
+            'mode': mode,
+            'download': f"/download/{self.prof_filename}",
+            'summary': f"/download/{self.text_filename}"
+        }
+        self.profiler = cProfile.Profile(time.thread_time if mode == 'cpu' else time.perf_counter)
+        self.profiler.enable()
+
+    def stop(self):
+        self.profiler.disable()
+        JobProfiler.active_lock.release()
+        try:
+            wall_seconds = time.perf_counter() - self.wall_started
+            cpu_seconds = time.thread_time() - self.cpu_started
+            report_folder = app.config['REPORT_FOLDER']
+            self.profiler.dump_stats(os.path.join(report_folder, self.prof_filename))
+
+            text = io.StringIO()
+            text.write(f"Job: {self.timings.job_id}\n")
+            text.write(f"Mode: {self.mode}\n")
+            text.write(f"Wall time: {wall_seconds:.3f}s\n")
+            text.write(f"CPU time (job thread): {cpu_seconds:.3f}s\n\n")
+            stats = pstats.Stats(self.profiler, stream=text)
+            stats.sort_stats('cumulative').print_stats(40)
+            stats.sort_stats('tottime').print_stats(20)
+            with open(os.path.join(report_folder, self.text_filename), 'w', encoding='utf-8') as f:
+                f.write(text.getvalue())
+
+            logger.info(f"Profile of {self.timings.job_id} saved to {self.prof_filename}")
+        except Exception as e:
+            logger.error(f"Error saving profile of {self.timings.job_id}: {str(e)}")
+
+
+def get_profile_mode():
+    """
+    Profiling requested for the current request: 'wall', 'cpu' or None
+    """
+    value = request.args.get('profile') or request.form.get('profile')
+    if value is None and request.is_json:
+        value = (request.get_json(silent=True) or {}).get('profile')
+    value = str(value).lower() if value not in (None, False) else ''
+    if value == 'cpu':
+        return 'cpu'
+    if value in ('1', 'true', 'yes', 'wall'):
+        return 'wall'
+    return 'wall' if PROFILE_ALL_JOBS else None
+
+
+def get_priority_lane():
+    """
+    Priority lane requested for the current request (?priority=), or None for the default
+    """
+    value = request.args.get('priority') or request.form.get('priority')
+    if value is None and request.is_json:
+        value = (request.get_json(silent=True) or {}).get('priority')
+    return value if value in PRIORITY_LANES else None
+
+
+def job_route(kind):
+    """
+    Route decorator: run the view as a job of this kind (see track_job), with the
+    profiling and priority lane asked by the request; the view reads its timings
+    from current_job_timings
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            with track_job(kind, profile=get_profile_mode(), lane=get_priority_lane()):
+                return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def timed_stage(stage, store=None):
+    """
+    Time a stage of the current job, optionally attributing it to a store
+    """
+    started = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        metrics.inc('filechecker_stage_errors_total', stage=stage)
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        metrics.observe('filechecker_stage_duration_seconds', duration, stage=stage)
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Stage %s took %.1f ms", stage, duration * 1000,
+                         extra={'stage': stage, 'store': store, 'duration_ms': round(duration * 1000, 1)})
+        timings = current_job_timings.get()
+        if timings is not None:
+            timings.record(stage, duration, store)
+
+
+def submit_with_context(executor, fn, *args):
+    """
+    Submit to an executor so the task sees the current job timings
+    """
+    return executor.submit(contextvars.copy_context().run, fn, *args)
+
+
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus metrics"""
+    return app.response_class(metrics.render(), mimetype='text/plain; version=0.0.4')
+
 
 def get_credentials(username=None, password=None):
     """
@@ -78,15 +672,26 @@ def get_credentials(username=None, password=None):
     if username and password:
         return username, password
     elif USE_DEFAULT_CREDENTIALS:
-        logger.info("Using default credentials")
+        logger.debug("Using default credentials")
         return DEFAULT_USERNAME, DEFAULT_PASSWORD
     else:
         return None, None
 
 
+def get_network_path(ip_address, *parts):
+    """
+    Build a normalized UNC path for a store IP and path components
+    """
+    if ip_address.startswith('\\\\'):
+        root = ip_address
+    else:
+        root = f'\\\\{ip_address}'
+    return os.path.normpath(os.path.join(root, *parts))
+
+
 def connect_to_network_share(ip_address, username=None, password=None):
     """
-    Establish a network connection using net use command
+    Establish a network connection with the share backend (net use by default)
     Uses default credentials if none provided and USE_DEFAULT_CREDENTIALS is True
     Returns: dict with success status and message
     """
@@ -103,51 +708,50 @@ def connect_to_network_share(ip_address, username=None, password=None):
         # Check if already connected
         connection_key = f"{ip_address}_{username}" if username else ip_address
         if connection_key in active_connections:
-            logger.info(f"Already connected to {network_path}")
+            logger.debug("Already connected to %s", network_path, extra={'store': ip_address, 'stage': 'connect'})
             return {'success': True, 'message': 'Déjà connecté'}
         
-        # Disconnect first if there's an existing connection (without credentials)
-        disconnect_cmd = f'net use {network_path} /delete /y'
-        subprocess.run(disconnect_cmd, shell=True, capture_output=True, text=True)
-        
-        # Build the net use command
-        if username and password:
-            connect_cmd = f'net use {network_path} /user:{username} {password}'
-            logger.info(f"Connecting to {network_path} with user: {username}")
-        else:
-            connect_cmd = f'net use {network_path}'
-            logger.info(f"Connecting to {network_path} without credentials")
-        
-        # Execute the command
-        result = subprocess.run(
-            connect_cmd, 
-            shell=True, 
-            capture_output=True, 
-            text=True,
-            timeout=10
-        )
+        with store_slot(ip_address), timed_stage('connect', ip_address):
+            if username and password:
+                logger.info("Connecting to %s with user: %s", network_path, username,
+                            extra={'store': ip_address, 'stage': 'connect'})
+            else:
+                logger.info("Connecting to %s without credentials", network_path,
+                            extra={'store': ip_address, 'stage': 'connect'})
+            
+            returncode, stdout, stderr = get_share_backend().connect(network_path, username, password)
         
-        if result.returncode == 0:
-            active_connections[connection_key] = {
-                'ip': ip_address,
-                'username': username or 'default',
-                'connected_at': datetime.now()
-            }
-            logger.info(f"Successfully connected to {network_path}")
-            return {'success': True, 'message': 'Connexion réussie'}
-        else:
-            error_msg = result.stderr.strip() or result.stdout.strip()
-            logger.error(f"Failed to connect to {network_path}: {error_msg}")
-            return {'success': False, 'message': f'Échec de connexion: {error_msg}'}
+        return record_connection_result(ip_address, username, connection_key, network_path,
+                                        returncode, stdout, stderr)
     
     except subprocess.TimeoutExpired:
-        logger.error(f"Connection timeout for {ip_address}")
+        logger.error("Connection timeout for %s", ip_address, extra={'store': ip_address, 'stage': 'connect'})
         return {'success': False, 'message': 'Délai de connexion dépassé'}
     except Exception as e:
-        logger.error(f"Error connecting to {ip_address}: {str(e)}")
+        logger.error("Error connecting to %s: %s", ip_address, e, extra={'store': ip_address, 'stage': 'connect'})
         return {'success': False, 'message': str(e)}
 
 
+def record_connection_result(ip_address, username, connection_key, network_path, returncode, stdout, stderr):
+    """
+    Register a successful net use connection, or build the failure message
+    Returns: dict with success status and message
+    """
+    if returncode == 0:
+        active_connections[connection_key] = {
+            'ip': ip_address,
+            'username': username or 'default',
+            'connected_at': datetime.now()
+        }
+        logger.info("Successfully connected to %s", network_path, extra={'store': ip_address, 'stage': 'connect'})
+        return {'success': True, 'message': 'Connexion réussie'}
+    else:
+        error_msg = stderr.strip() or stdout.strip()
+        logger.error("Failed to connect to %s: %s", network_path, error_msg,
+                     extra={'store': ip_address, 'stage': 'connect'})
+        return {'success': False, 'message': f'Échec de connexion: {error_msg}'}
+
+
 def disconnect_from_network_share(ip_address):
     """
     Disconnect from a network share
@@ -158,13 +762,12 @@ def disconnect_from_network_share(ip_address):
         else:
             network_path = f'\\\\{ip_address}'
         
-        disconnect_cmd = f'net use {network_path} /delete /y'
-        subprocess.run(disconnect_cmd, shell=True, capture_output=True, text=True)
+        get_share_backend().disconnect(network_path)
         
         # Remove from active connections
-        keys_to_remove = [k for k in active_connections if active_connections[k]['ip'] == ip_address]
+        keys_to_remove = [k for k, conn in list(active_connections.items()) if conn['ip'] == ip_address]
         for key in keys_to_remove:
-            del active_connections[key]
+            active_connections.pop(key, None)
         
         logger.info(f"Disconnected from {network_path}")
         return True
@@ -180,6 +783,11 @@ def check_file_exists(ip_address, directory_path, filename, username=None, passw
     Returns: dict with status and details
     """
     try:
+        # Recent result of the same check, when the metadata cache is enabled
+        cached = get_cached_file_metadata(ip_address, directory_path, filename)
+        if cached is not None:
+            return cached
+        
         # Get credentials (use defaults if not provided)
         username, password = get_credentials(username, password)
         
@@ -196,40 +804,53 @@ def check_file_exists(ip_address, directory_path, filename, username=None, passw
                     'error': f"Échec de connexion: {connection_result['message']}"
                 }
         
+        return stat_network_file(ip_address, directory_path, filename)
+    except Exception as e:
+        logger.error("Error checking %s/%s/%s: %s", ip_address, directory_path, filename, e,
+                     extra={'store': ip_address, 'stage': 'stat'})
+        return {
+            'exists': False,
+            'path': f'\\\\{ip_address}\\{directory_path}\\{filename}',
+            'size': None,
+            'modified': None,
+            'error': str(e)
+        }
+
+
+def stat_network_file(ip_address, directory_path, filename):
+    """
+    Look up a file on a store share (the share must already be reachable)
+    Returns: dict with status and details
+    """
+    try:
         # Construct the network path
-        if ip_address.startswith('\\\\'):
-            network_path = os.path.join(ip_address, directory_path, filename)
-        else:
-            network_path = os.path.join(f'\\\\{ip_address}', directory_path, filename)
-        
-        # Normalize the path
-        network_path = os.path.normpath(network_path)
+        network_path = get_network_path(ip_address, directory_path, filename)
         
         # Check if file exists
-        exists = os.path.exists(network_path)
+        with store_slot(ip_address), timed_stage('stat', ip_address):
+            stat = get_share_backend().stat_or_none(network_path)
         
-        if exists:
-            # Get file size
-            size = os.path.getsize(network_path)
-            modified_time = datetime.fromtimestamp(os.path.getmtime(network_path))
-            
-            return {
+        if stat is not None:
+            result = {
                 'exists': True,
                 'path': network_path,
-                'size': size,
-                'modified': modified_time.strftime('%Y-%m-%d %H:%M:%S'),
+                'size': stat.st_size,
+                'modified': datetime.fromtimestamp(stat.st_mtime).strftime('%Y-%m-%d %H:%M:%S'),
                 'error': None
             }
         else:
-            return {
+            result = {
                 'exists': False,
                 'path': network_path,
                 'size': None,
                 'modified': None,
                 'error': 'File not found'
             }
+        cache_file_metadata(ip_address, directory_path, filename, result)
+        return result
     except Exception as e:
-        logger.error(f"Error checking {ip_address}/{directory_path}/{filename}: {str(e)}")
+        logger.error("Error checking %s/%s/%s: %s", ip_address, directory_path, filename, e,
+                     extra={'store': ip_address, 'stage': 'stat'})
         return {
             'exists': False,
             'path': f'\\\\{ip_address}\\{directory_path}\\{filename}',
@@ -239,53 +860,126 @@ def check_file_exists(ip_address, directory_path, filename, username=None, passw
         }
 
 
-def process_excel(file_path, filename_to_check, directory_path, username=None, password=None):
+def process_excel(file_path, filename_to_check, directory_path, username=None, password=None, engine='sync',
+                  cache_mode='off', sink=None):
     """
     Process the uploaded Excel file and check for file existence
     Uses default credentials if none provided
+    engine='async' checks the stores concurrently (see ASYNC STORE ENGINE),
+    engine='sharded' spreads them over worker processes (see SHARDED EXECUTION),
+    engine='agents' hands them to the agents of their region/subnet (see AGENT MODE)
+    cache_mode reuses recent results of the same checks (see METADATA CACHE, sync/async engines)
+    sink (e.g. a ResultStream) receives the rows as they are produced instead of a list
     """
+    cache_token = current_cache_mode.set(cache_mode)
+    lane_token = None
     try:
         # Read Excel file
-        df = pd.read_excel(file_path)
+        with timed_stage('inventory_load'):
+            df = pd.read_excel(file_path)
         
         # Validate required columns
         if 'CodeMag' not in df.columns or 'ipaddress' not in df.columns:
             return {'error': 'Excel must contain "CodeMag" and "ipaddress" columns'}
         
-        results = []
-        total = len(df)
+        stores = [(str(row['CodeMag']), str(row['ipaddress'])) for _, row in df.iterrows()]
+        results = sink if sink is not None else []
+        lane_token = demote_large_job(len(stores))
         
-        for index, row in df.iterrows():
-            code_mag = str(row['CodeMag'])
-            ip_address = str(row['ipaddress'])
+        if engine == 'async':
+            results.extend(run_async_engine(check_stores_async(stores, directory_path, filename_to_check,
+                                                               username, password)))
+            return {'success': True, 'results': results}
+        
+        if engine in ('sharded', 'agents'):
+            def failed_row(store, error):
+                return build_check_row(store[0], store[1], filename_to_check, {
+                    'exists': False,
+                    'path': get_network_path(store[1], directory_path, filename_to_check),
+                    'size': None,
+                    'modified': None,
+                    'error': error
+                })
             
+            if engine == 'agents':
+                regions = df['Region'].tolist() if 'Region' in df.columns else [None] * len(stores)
+                locations = [(ip_address, region) for (code_mag, ip_address), region in zip(stores, regions)]
+                args = (directory_path, filename_to_check, username, password)
+                agent_args = [directory_path, filename_to_check, *get_agent_credentials(username, password)]
+                results.extend(run_on_agents('check', stores, locations, args, agent_args, failed_row))
+            else:
+                results.extend(run_sharded('check', stores, (directory_path, filename_to_check, username, password),
+                                           failed_row))
+            return {'success': True, 'results': results}
+        
+        total = len(stores)
+        
+        for index, (code_mag, ip_address) in enumerate(stores):
             # Check file existence (will use default credentials if none provided)
             result = check_file_exists(ip_address, directory_path, filename_to_check, username, password)
             
-            results.append({
-                'CodeMag': code_mag,
-                'IPAddress': ip_address,
-                'FileName': filename_to_check,
-                'Exists': 'Yes' if result['exists'] else 'No',
-                'FilePath': result['path'],
-                'FileSize': result['size'],
-                'LastModified': result['modified'],
-                'Error': result['error']
-            })
+            results.append(build_check_row(code_mag, ip_address, filename_to_check, result))
             
             # Log progress
-            logger.info(f"Processed {index + 1}/{total}: {code_mag} - {ip_address}")
+            logger.info("Processed %d/%d: %s - %s", index + 1, total, code_mag, ip_address,
+                        extra={'store': ip_address})
         
         return {'success': True, 'results': results}
         
     except Exception as e:
         logger.error(f"Error processing Excel: {str(e)}")
         return {'error': str(e)}
+    finally:
+        if lane_token is not None:
+            current_lane.reset(lane_token)
+        current_cache_mode.reset(cache_token)
+
+
+def build_check_row(code_mag, ip_address, filename, result):
+    """
+    Report row for one store from a check_file_exists result
+    """
+    return {
+        'CodeMag': code_mag,
+        'IPAddress': ip_address,
+        'FileName': filename,
+        'Exists': 'Yes' if result['exists'] else 'No',
+        'FilePath': result['path'],
+        'FileSize': result['size'],
+        'LastModified': result['modified'],
+        'Error': result['error']
+    }
+
+
+def write_excel_report(results, report_path, sheet_name):
+    """
+    Write result rows to an Excel report with auto-adjusted column widths
+    """
+    with timed_stage('report_write'):
+        df_report = pd.DataFrame(results)
+
+        with pd.ExcelWriter(report_path, engine='openpyxl') as writer:
+            df_report.to_excel(writer, sheet_name=sheet_name, index=False)
+            worksheet = writer.sheets[sheet_name]
+
+            # Auto-adjust column widths
+            for column in worksheet.columns:
+                max_length = 0
+                column = [cell for cell in column]
+                for cell in column:
+                    try:
+                        if len(str(cell.value)) > max_length:
+                            max_length = len(cell.value)
+                    except:
+                        pass
+                adjusted_width = min(max_length + 2, 50)
+                worksheet.column_dimensions[column[0].column_letter].width = adjusted_width
 
 
 def get_excel_files_from_data():
     """
     Get list of Excel files from the data folder
+    Only .xlsx: the EXE does not ship xlrd, which pandas needs for .xls
     """
     try:
         data_folder = app.config['DATA_FOLDER']
@@ -293,7 +987,7 @@ def get_excel_files_from_data():
         
         if os.path.exists(data_folder):
             for file in os.listdir(data_folder):
-                if file.endswith(('.xlsx', '.xls')):
+                if file.endswith('.xlsx'):
                     excel_files.append(file)
         
         return excel_files
@@ -342,21 +1036,15 @@ def transfer_file_to_servers(file_path, servers_excel, directory_path, username=
                     continue
             
             # Construct destination path
-            if ip_address.startswith('\\\\'):
-                dest_path = os.path.join(ip_address, directory_path, filename)
-            else:
-                dest_path = os.path.join(f'\\\\{ip_address}', directory_path, filename)
-            
-            dest_path = os.path.normpath(dest_path)
+            dest_path = get_network_path(ip_address, directory_path, filename)
             
             try:
                 # Create directory if it doesn't exist
                 dest_dir = os.path.dirname(dest_path)
-                os.makedirs(dest_dir, exist_ok=True)
+                get_share_backend().makedirs(dest_dir)
                 
                 # Copy file
-                import shutil
-                shutil.copy2(file_path, dest_path)
+                get_share_backend().copy(file_path, dest_path)
                 
                 results.append({
                     'CodeMag': code_mag,
@@ -440,6 +1128,7 @@ def handle_exception(e):
 
 
 @app.route('/upload', methods=['POST'])
+@job_route('check')
 def upload_file():
     """Legacy route - kept for backwards compatibility"""
     try:
@@ -475,29 +1164,8 @@ def upload_file():
         report_filename = f"report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
         report_path = os.path.join(app.config['REPORT_FOLDER'], report_filename)
         
-        # Create DataFrame from results
-        df_report = pd.DataFrame(result['results'])
-        
-        # Save to Excel with formatting
-        with pd.ExcelWriter(report_path, engine='openpyxl') as writer:
-            df_report.to_excel(writer, sheet_name='Results', index=False)
-            
-            # Get workbook and worksheet
-            workbook = writer.book
-            worksheet = writer.sheets['Results']
-            
-            # Auto-adjust column widths
-            for column in worksheet.columns:
-                max_length = 0
-                column = [cell for cell in column]
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(cell.value)
-                    except:
-                        pass
-                adjusted_width = min(max_length + 2, 50)
-                worksheet.column_dimensions[column[0].column_letter].width = adjusted_width
+        # Save results to Excel with formatting
+        write_excel_report(result['results'], report_path, 'Results')
         
         # Calculate summary
         total_checked = len(result['results'])
@@ -506,6 +1174,7 @@ def upload_file():
         
         return jsonify({
             'success': True,
+            'timings': current_job_timings.get().summary(),
             'report_file': report_filename,
             'summary': {
                 'total': total_checked,
@@ -521,12 +1190,15 @@ def upload_file():
 
 
 @app.route('/check-files', methods=['POST'])
+@job_route('check')
 def check_files():
     """New route that uses Excel files from data folder"""
     try:
         excel_filename = request.form.get('excel_file')
         filename_to_check = request.form.get('filename')
         directory_path = request.form.get('directory_path')
+        engine = request.form.get('engine', STORE_IO_ENGINE)
+        cache_mode = request.form.get('cache', METADATA_CACHE_MODE)
         
         if not excel_filename:
             return jsonify({'error': 'Veuillez sélectionner un fichier Excel'}), 400
@@ -537,60 +1209,53 @@ def check_files():
         if not directory_path:
             return jsonify({'error': 'Veuillez spécifier le chemin du répertoire'}), 400
         
+        if engine not in STORE_IO_ENGINES:
+            return jsonify({'error': f'Moteur inconnu: {engine}'}), 400
+        
+        if cache_mode not in METADATA_CACHE_MODES:
+            return jsonify({'error': f'Mode de cache inconnu: {cache_mode}'}), 400
+        
         # Get Excel file path from data folder
         excel_path = os.path.join(app.config['DATA_FOLDER'], excel_filename)
         
         if not os.path.exists(excel_path):
             return jsonify({'error': f'Fichier Excel non trouvé: {excel_filename}'}), 400
         
-        # Process the Excel file (will use default credentials)
-        result = process_excel(excel_path, filename_to_check, directory_path)
+        # Process the Excel file (will use default credentials), rows go straight
+        # to the run's result stream which the page then reads on demand
+        stream = ResultStream.create('check', 'Exists')
+        try:
+            result = process_excel(excel_path, filename_to_check, directory_path, engine=engine,
+                                   cache_mode=cache_mode, sink=stream)
+        finally:
+            stream.close()
         
         if 'error' in result:
+            stream.discard()
             return jsonify({'error': result['error']}), 400
         
         # Generate report
         report_filename = f"report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
         report_path = os.path.join(app.config['REPORT_FOLDER'], report_filename)
         
-        # Create DataFrame from results
-        df_report = pd.DataFrame(result['results'])
-        
-        # Save to Excel with formatting
-        with pd.ExcelWriter(report_path, engine='openpyxl') as writer:
-            df_report.to_excel(writer, sheet_name='Results', index=False)
-            
-            # Get workbook and worksheet
-            workbook = writer.book
-            worksheet = writer.sheets['Results']
-            
-            # Auto-adjust column widths
-            for column in worksheet.columns:
-                max_length = 0
-                column = [cell for cell in column]
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(cell.value)
-                    except:
-                        pass
-                adjusted_width = min(max_length + 2, 50)
-                worksheet.column_dimensions[column[0].column_letter].width = adjusted_width
+        # Save results to Excel with formatting
+        write_stream_report(stream, report_path, 'Results')
         
         # Calculate summary
-        total_checked = len(result['results'])
-        found = sum(1 for r in result['results'] if r['Exists'] == 'Yes')
+        total_checked = len(stream)
+        found = stream.count('Exists', 'Yes')
         not_found = total_checked - found
         
         return jsonify({
             'success': True,
+            'timings': current_job_timings.get().summary(),
             'report_file': report_filename,
+            'run_id': stream.run_id,
             'summary': {
                 'total': total_checked,
                 'found': found,
                 'not_found': not_found
-            },
-            'results': result['results']
+            }
         })
         
     except Exception as e:
@@ -608,6 +1273,7 @@ def download_report(filename):
         return jsonify({'error': str(e)}), 404
 
 @app.route('/transfer-files', methods=['POST'])
+@job_route('transfer')
 def transfer_files():
     """Transfer multiple files to servers"""
     try:
@@ -618,6 +1284,9 @@ def transfer_files():
         files = request.files.getlist('files_to_transfer')
         excel_filename = request.form.get('excel_file')
         directory_path = request.form.get('directory_path')
+        distribution = request.form.get('distribution', 'direct')
+        compression = request.form.get('compression', 'none')
+        engine = request.form.get('engine', STORE_IO_ENGINE)
         
         # Validate files
         valid_files = []
@@ -634,79 +1303,81 @@ def transfer_files():
         if not directory_path:
             return jsonify({'error': 'Please specify the directory path'}), 400
         
+        if engine not in STORE_IO_ENGINES:
+            return jsonify({'error': f'Unknown engine: {engine}'}), 400
+        
+        options_error = get_transfer_options_error(distribution, compression, engine)
+        if options_error:
+            return jsonify({'error': options_error}), 400
+        
         # Get Excel file path from data folder
         excel_path = os.path.join(app.config['DATA_FOLDER'], excel_filename)
         
         if not os.path.exists(excel_path):
             return jsonify({'error': f'Excel file not found: {excel_filename}'}), 400
         
-        # Save uploaded files temporarily
-        temp_filepaths = []
-        for file in valid_files:
-            filename = secure_filename(file.filename)
-            temp_filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-            file.save(temp_filepath)
-            temp_filepaths.append(temp_filepath)
-        
-        # Transfer all files (will use default credentials)
-        all_results = []
-        for temp_filepath in temp_filepaths:
-            result = transfer_files_to_servers(temp_filepath, excel_path, directory_path)
-            if 'error' not in result:
-                all_results.extend(result['results'])
-            else:
-                # If one file fails, log it but continue with others
-                logger.error(f"Error transferring file {temp_filepath}: {result['error']}")
+        # Stage uploaded files by content hash (identical uploads share one copy)
+        staged_files = []
+        stream = None
+        compression_stats = {'original_bytes': 0, 'sent_bytes': 0, 'ratio': None}
+        rollouts = []
+        try:
+            # A failed upload releases the files staged before it
+            for file in valid_files:
+                filename = secure_filename(file.filename)
+                sha256, size = stage_upload_stream(file.stream)
+                staged_files.append((sha256, filename))
+            
+            # Transfer all files (will use default credentials), each file's rows are
+            # appended to the run's result stream as soon as it is done
+            stream = ResultStream.create('transfer', 'Status')
+            for sha256, filename in staged_files:
+                result = transfer_files_to_servers(get_staged_path(sha256), excel_path, directory_path,
+                                                   dest_filename=filename, distribution=distribution,
+                                                   compression=compression, engine=engine)
+                if 'error' not in result:
+                    stream.extend(result['results'])
+                    merge_compression_stats(compression_stats, result.get('compression'))
+                    if 'rollout' in result:
+                        rollouts.append({'file': filename, **result['rollout']})
+                else:
+                    # If one file fails, log it but continue with others
+                    logger.error(f"Error transferring file {filename}: {result['error']}")
+        finally:
+            if stream is not None:
+                stream.close()
+            # Release staged files (kept for reuse until evicted)
+            for sha256, filename in staged_files:
+                release_staged_file(sha256)
         
         # Generate report
         report_filename = f"transfer_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
         report_path = os.path.join(app.config['REPORT_FOLDER'], report_filename)
         
-        # Create DataFrame from all results
-        df_report = pd.DataFrame(all_results)
-        
-        # Save to Excel with formatting
-        with pd.ExcelWriter(report_path, engine='openpyxl') as writer:
-            df_report.to_excel(writer, sheet_name='Transfer Results', index=False)
-            
-            # Get workbook and worksheet
-            workbook = writer.book
-            worksheet = writer.sheets['Transfer Results']
-            
-            # Auto-adjust column widths
-            for column in worksheet.columns:
-                max_length = 0
-                column = [cell for cell in column]
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(cell.value)
-                    except:
-                        pass
-                adjusted_width = min(max_length + 2, 50)
-                worksheet.column_dimensions[column[0].column_letter].width = adjusted_width
+        # Save results to Excel with formatting
+        write_stream_report(stream, report_path, 'Transfer Results')
         
         # Calculate summary
-        total_transfers = len(all_results)
-        successful = sum(1 for r in all_results if r['Status'] == 'Success')
-        failed = total_transfers - successful
-        
-        # Clean up temporary files
-        for temp_filepath in temp_filepaths:
-            try:
-                os.remove(temp_filepath)
-            except:
-                pass
+        total_transfers = len(stream)
+        successful = stream.count('Status', 'Success')
+        halted = stream.count('Status', 'Halted')
+        pending = stream.count('Status', PENDING_EXTRACTION_STATUS)
+        failed = total_transfers - successful - halted - pending
         
         return jsonify({
             'success': True,
+            'timings': current_job_timings.get().summary(),
             'report_file': report_filename,
+            'run_id': stream.run_id,
             'summary': {
                 'total': total_transfers,
                 'successful': successful,
-                'failed': failed
+                'failed': failed,
+                'halted': halted,
+                'pending_extraction': pending
             },
-            'results': all_results
+            'compression': compression_stats,
+            'rollouts': rollouts
         })
         
     except Exception as e:
@@ -714,85 +1385,186 @@ def transfer_files():
         return jsonify({'error': str(e)}), 500
 
 
-def transfer_files_to_servers(file_path, servers_excel, directory_path, username=None, password=None):
+def transfer_file_to_store(source_path, code_mag, ip_address, directory_path, filename, username=None, password=None,
+                           source='Central'):
+    """
+    Copy a file to one store's share
+    Credentials must already be resolved (see get_credentials)
+    Returns: dict with the transfer result row
+    """
+    # Connect to the network share first if credentials available
+    if username and password:
+        connection_result = connect_to_network_share(ip_address, username, password)
+        
+        if not connection_result['success']:
+            return {
+                'CodeMag': code_mag,
+                'IPAddress': ip_address,
+                'FileName': filename,
+                'Status': 'Failed',
+                'DestinationPath': f'\\\\{ip_address}\\{directory_path}\\{filename}',
+                'Source': source,
+                'Error': f"Échec de connexion: {connection_result['message']}"
+            }
+    
+    return copy_file_to_store(source_path, code_mag, ip_address, directory_path, filename, source)
+
+
+def copy_file_to_store(source_path, code_mag, ip_address, directory_path, filename, source='Central'):
+    """
+    Copy a file to a store share (the share must already be reachable)
+    Returns: dict with the transfer result row
+    """
+    # Construct destination path
+    dest_path = get_network_path(ip_address, directory_path, filename)
+    
+    try:
+        # Create directory if it doesn't exist
+        dest_dir = os.path.dirname(dest_path)
+        get_share_backend().makedirs(dest_dir)
+        
+        # Copy file (rate limited when bandwidth caps are active)
+        copy_file_with_limits(source_path, dest_path, ip_address)
+        
+        return {
+            'CodeMag': code_mag,
+            'IPAddress': ip_address,
+            'FileName': filename,
+            'Status': 'Success',
+            'DestinationPath': dest_path,
+            'Source': source,
+            'Error': None
+        }
+        
+    except Exception as e:
+        logger.error("Error transferring %s to %s: %s", filename, ip_address, e,
+                     extra={'store': ip_address, 'stage': 'copy'})
+        return {
+            'CodeMag': code_mag,
+            'IPAddress': ip_address,
+            'FileName': filename,
+            'Status': 'Failed',
+            'DestinationPath': dest_path,
+            'Source': source,
+            'Error': str(e)
+        }
+
+
+def get_transfer_options_error(distribution, compression, engine):
+    """
+    Error message for a distribution/compression/engine combination that cannot be honoured, else None
+    Relay and wave rollouts copy the file as is, and archives are sent store by store:
+    compression only applies to direct transfers with the sync engine
+    """
+    if compression == 'archive' and distribution != 'direct':
+        return f'Compression is only supported with direct distribution, not {distribution}'
+    if compression == 'archive' and engine != 'sync':
+        return f'Compression is only supported with the sync engine, not {engine}'
+    return None
+
+
+def transfer_files_to_servers(file_path, servers_excel, directory_path, username=None, password=None,
+                              dest_filename=None, distribution='direct', compression='none', engine='sync',
+                              sink=None):
     """
     Transfer a file to multiple servers based on Excel file
     Uses default credentials if none provided
+    dest_filename overrides the name the file gets on the servers (defaults to its local name)
+    distribution='relay' pushes to the seed stores of each region first (see transfer_file_relay),
+    distribution='waves' rolls out to canary stores then growing waves (see transfer_file_waves)
+    compression='archive' sends compressible files gzipped with an extraction manifest
+    (see transfer_file_compressed)
+    engine='async' copies to the stores concurrently, engine='sharded' spreads them over
+    worker processes, engine='agents' has the agents of each region/subnet copy the file
+    to their stores (direct distribution only)
+    sink (e.g. a ResultStream) receives the rows as they are produced instead of a list
     """
     try:
+        options_error = get_transfer_options_error(distribution, compression, engine)
+        if options_error:
+            return {'error': options_error}
+        
         # Get credentials (use defaults if not provided)
         username, password = get_credentials(username, password)
         
         # Read Excel file
-        df = pd.read_excel(servers_excel)
+        inventory = load_stores_from_excel(servers_excel)
         
-        # Validate required columns
-        if 'CodeMag' not in df.columns or 'ipaddress' not in df.columns:
-            return {'error': 'Excel must contain "CodeMag" and "ipaddress" columns'}
+        if 'error' in inventory:
+            return {'error': inventory['error']}
         
-        results = []
-        total = len(df)
-        filename = os.path.basename(file_path)
+        stores = inventory['stores']
+        filename = dest_filename or os.path.basename(file_path)
+        results = sink if sink is not None else []
         
-        for index, row in df.iterrows():
-            code_mag = str(row['CodeMag'])
-            ip_address = str(row['ipaddress'])
-            
-            # Connect to the network share first if credentials available
-            if username and password:
-                connection_result = connect_to_network_share(ip_address, username, password)
-                
-                if not connection_result['success']:
-                    results.append({
-                        'CodeMag': code_mag,
-                        'IPAddress': ip_address,
-                        'FileName': filename,
-                        'Status': 'Failed',
-                        'DestinationPath': f'\\\\{ip_address}\\{directory_path}\\{filename}',
-                        'Error': f"Échec de connexion: {connection_result['message']}"
-                    })
-                    continue
+        if distribution == 'relay':
+            results.extend(transfer_file_relay(file_path, stores, directory_path, filename, username, password))
+            return {'success': True, 'results': results}
+        
+        if distribution == 'waves':
+            wave_results, rollout = transfer_file_waves(file_path, stores, directory_path, filename,
+                                                        username, password)
+            results.extend(wave_results)
+            return {'success': True, 'results': results, 'rollout': rollout}
+        
+        if compression == 'archive' and filename.lower().endswith(COMPRESSIBLE_EXTENSIONS):
+            compressed = transfer_file_compressed(file_path, stores, directory_path, filename, username, password)
+            results.extend(compressed.pop('results', []))
+            return dict(compressed, results=results)
+        
+        def direct_result():
+            if compression == 'archive':
+                return {'success': True, 'results': rows.rows, 'compression': rows.stats()}
+            return {'success': True, 'results': rows}
+        
+        # Files not worth compressing are sent raw, and still count in the compression stats
+        rows = RawTransferCounter(results, os.path.getsize(file_path)) if compression == 'archive' else results
+        
+        if engine == 'async':
+            rows.extend(run_async_engine(transfer_stores_async(file_path, stores, directory_path, filename,
+                                                                  username, password)))
+            return direct_result()
+        
+        if engine in ('sharded', 'agents'):
+            def failed_row(store, error):
+                return {
+                    'CodeMag': store['CodeMag'],
+                    'IPAddress': store['ipaddress'],
+                    'FileName': filename,
+                    'Status': 'Failed',
+                    'DestinationPath': get_network_path(store['ipaddress'], directory_path, filename),
+                    'Source': 'Central',
+                    'Error': error
+                }
             
-            # Construct destination path
-            if ip_address.startswith('\\\\'):
-                dest_path = os.path.join(ip_address, directory_path, filename)
+            args = (file_path, directory_path, filename, username, password)
+            if engine == 'agents':
+                locations = [(store['ipaddress'], store['Region']) for store in stores]
+                sha256 = compute_file_hash(file_path)
+                agent_args = [sha256, directory_path, filename, *get_agent_credentials(username, password)]
+                with agent_files_lock:
+                    agent_files[sha256] = file_path
+                try:
+                    rows.extend(run_on_agents('transfer', stores, locations, args, agent_args, failed_row))
+                finally:
+                    with agent_files_lock:
+                        agent_files.pop(sha256, None)
             else:
-                dest_path = os.path.join(f'\\\\{ip_address}', directory_path, filename)
-            
-            dest_path = os.path.normpath(dest_path)
+                rows.extend(run_sharded('transfer', stores, args, failed_row))
+            return direct_result()
+        
+        total = len(stores)
+        
+        for index, store in enumerate(stores):
+            result = transfer_file_to_store(file_path, store['CodeMag'], store['ipaddress'], directory_path,
+                                            filename, username, password)
+            rows.append(result)
             
-            try:
-                # Create directory if it doesn't exist
-                dest_dir = os.path.dirname(dest_path)
-                os.makedirs(dest_dir, exist_ok=True)
-                
-                # Copy file
-                import shutil
-                shutil.copy2(file_path, dest_path)
-                
-                results.append({
-                    'CodeMag': code_mag,
-                    'IPAddress': ip_address,
-                    'FileName': filename,
-                    'Status': 'Success',
-                    'DestinationPath': dest_path,
-                    'Error': None
-                })
-                
-                logger.info(f"Transferred {index + 1}/{total}: {code_mag} - {ip_address} - {filename}")
-                
-            except Exception as e:
-                logger.error(f"Error transferring {filename} to {ip_address}: {str(e)}")
-                results.append({
-                    'CodeMag': code_mag,
-                    'IPAddress': ip_address,
-                    'FileName': filename,
-                    'Status': 'Failed',
-                    'DestinationPath': dest_path,
-                    'Error': str(e)
-                })
+            if result['Status'] == 'Success':
+                logger.info("Transferred %d/%d: %s - %s - %s", index + 1, total, store['CodeMag'],
+                            store['ipaddress'], filename, extra={'store': store['ipaddress']})
         
-        return {'success': True, 'results': results}
+        return direct_result()
         
     except Exception as e:
         logger.error(f"Error in file transfer: {str(e)}")
@@ -854,9 +1626,8 @@ def disconnect_all():
     """Disconnect all network shares"""
     try:
         count = len(active_connections)
-        for connection_key in list(active_connections.keys()):
-            ip = active_connections[connection_key]['ip']
-            disconnect_from_network_share(ip)
+        for connection_key, conn in list(active_connections.items()):
+            disconnect_from_network_share(conn['ip'])
         
         return jsonify({
             'success': True,
@@ -868,7 +1639,44 @@ def disconnect_all():
         return jsonify({'error': str(e)}), 500
 
 
+def test_connections(ip_list, username=None, password=None, engine='sync'):
+    """
+    Connect to every IP with the given engine
+    Returns: connect results in the order of ip_list (yielded one by one with the sync engine)
+    """
+    if engine == 'async':
+        return run_async_engine(connect_stores_async(ip_list, username, password))
+    if engine == 'sharded':
+        return run_sharded('connect', ip_list, (username, password),
+                           lambda ip_str, error: {'success': False, 'message': error})
+    if engine == 'agents':
+        return run_on_agents('connect', ip_list, [(ip_str, None) for ip_str in ip_list],
+                             (username, password), list(get_agent_credentials(username, password)),
+                             lambda ip_str, error: {'success': False, 'message': error})
+    return (connect_to_network_share(ip_str, username, password) for ip_str in ip_list)
+
+
+def find_ip_column(df):
+    """
+    IP address column of a bulk test inventory (flexible matching), or None
+    """
+    for col in df.columns:
+        col_lower = str(col).lower()
+        if ('ip' in col_lower and 'address' in col_lower) or col_lower == 'ip' or col_lower == 'ip address' or col_lower == 'adresse ip':
+            return col
+    return None
+
+
+def get_ip_list(df, ip_column):
+    """
+    Unique, non-empty IP addresses of an inventory column
+    """
+    ip_list = [str(ip_address).strip() for ip_address in df[ip_column].dropna().unique().tolist()]
+    return [ip_str for ip_str in ip_list if ip_str and ip_str.lower() not in ['nan', 'none', '']]
+
+
 @app.route('/test-bulk-connections', methods=['POST'])
+@job_route('bulk_test')
 def test_bulk_connections():
     """Test multiple network connections from Excel file"""
     try:
@@ -876,13 +1684,21 @@ def test_bulk_connections():
         excel_filename = data.get('excel_file', '')
         username = data.get('username', '').strip()
         password = data.get('password', '')
+        engine = data.get('engine', STORE_IO_ENGINE)
         
         if not excel_filename:
             return jsonify({'error': 'Fichier Excel requis'}), 400
         
+        if engine not in STORE_IO_ENGINES:
+            return jsonify({'error': f'Moteur inconnu: {engine}'}), 400
+        
         if not username or not password:
             return jsonify({'error': 'Nom d\'utilisateur et mot de passe requis'}), 400
         
+        if engine == 'agents' and not uses_default_credentials(username, password):
+            return jsonify({'error': 'Les agents se connectent avec leurs propres identifiants : '
+                                     'moteur "agents" impossible avec d\'autres identifiants'}), 400
+        
         # Get Excel file path from data folder
         excel_path = os.path.join(app.config['DATA_FOLDER'], excel_filename)
         
@@ -891,15 +1707,11 @@ def test_bulk_connections():
         
         # Read Excel file
         logger.info(f"Reading Excel file: {excel_path}")
-        df = pd.read_excel(excel_path)
+        with timed_stage('inventory_load'):
+            df = pd.read_excel(excel_path)
         
         # Find the IP address column (flexible matching)
-        ip_column = None
-        for col in df.columns:
-            col_lower = str(col).lower()
-            if ('ip' in col_lower and 'address' in col_lower) or col_lower == 'ip' or col_lower == 'ip address' or col_lower == 'adresse ip':
-                ip_column = col
-                break
+        ip_column = find_ip_column(df)
         
         if ip_column is None:
             # List available columns for debugging
@@ -907,26 +1719,21 @@ def test_bulk_connections():
             return jsonify({'error': f'Aucune colonne "IP Address" trouvée. Colonnes disponibles: {available_columns}'}), 400
         
         # Get unique IP addresses
-        ip_addresses = df[ip_column].dropna().unique().tolist()
+        ip_list = get_ip_list(df, ip_column)
         
-        if len(ip_addresses) == 0:
+        if len(ip_list) == 0:
             return jsonify({'error': 'Aucune adresse IP trouvée dans le fichier Excel'}), 400
         
-        logger.info(f"Found {len(ip_addresses)} IP addresses to test")
+        logger.info(f"Found {len(ip_list)} IP addresses to test ({engine} engine)")
         
         # Test each connection
         results = []
         successful = 0
         failed = 0
         
-        for ip_address in ip_addresses:
-            ip_str = str(ip_address).strip()
-            if not ip_str or ip_str.lower() in ['nan', 'none', '']:
-                continue
-                
-            logger.info(f"Testing connection to {ip_str}")
-            result = connect_to_network_share(ip_str, username, password)
-            
+        connection_results = test_connections(ip_list, username, password, engine)
+        
+        for ip_str, result in zip(ip_list, connection_results):
             if result['success']:
                 successful += 1
                 status = 'Success'
@@ -935,7 +1742,7 @@ def test_bulk_connections():
                 failed += 1
                 status = 'Failed'
                 message = result['message']
-            
+        
             results.append({
                 'ip_address': ip_str,
                 'status': status,
@@ -946,6 +1753,7 @@ def test_bulk_connections():
         
         return jsonify({
             'success': True,
+            'timings': current_job_timings.get().summary(),
             'summary': {
                 'total': len(results),
                 'successful': successful,
@@ -965,7 +1773,7 @@ def get_active_connections():
     """Get list of active connections"""
     try:
         connections = []
-        for key, conn in active_connections.items():
+        for key, conn in list(active_connections.items()):
             connections.append({
                 'ip': conn['ip'],
                 'username': conn['username'],
@@ -1052,29 +1860,8 @@ def transfer_file():
         report_filename = f"transfer_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
         report_path = os.path.join(app.config['REPORT_FOLDER'], report_filename)
         
-        # Create DataFrame from results
-        df_report = pd.DataFrame(result['results'])
-        
-        # Save to Excel with formatting
-        with pd.ExcelWriter(report_path, engine='openpyxl') as writer:
-            df_report.to_excel(writer, sheet_name='Transfer Results', index=False)
-            
-            # Get workbook and worksheet
-            workbook = writer.book
-            worksheet = writer.sheets['Transfer Results']
-            
-            # Auto-adjust column widths
-            for column in worksheet.columns:
-                max_length = 0
-                column = [cell for cell in column]
-                for cell in column:
-                    try:
-                        if len(str(cell.value)) > max_length:
-                            max_length = len(cell.value)
-                    except:
-                        pass
-                adjusted_width = min(max_length + 2, 50)
-                worksheet.column_dimensions[column[0].column_letter].width = adjusted_width
+        # Save results to Excel with formatting
+        write_excel_report(result['results'], report_path, 'Transfer Results')
         
         # Calculate summary
         total_transfers = len(result['results'])
@@ -1103,41 +1890,3838 @@ def transfer_file():
         return jsonify({'error': str(e)}), 500
 
 
-def open_browser():
-    """Open the browser after a short delay"""
-    import time
-    time.sleep(1.5)
-    webbrowser.open('http://127.0.0.1:5001')
+# ===== PRIORITY LANES =====
+# Store operations (connect, stat, listing, copy) of all jobs share STORE_IO_SLOTS
+# slots, and STORE_IO_SLOTS_PER_HOST on each store. Work runs in one of three lanes:
+# interactive (connection tests, small checks), bulk (transfers, large checks,
+# bulk tests, snapshots) and scheduled. Bulk and scheduled work leave the reserved
+# slots free, so a quick check never queues behind a big distribution. When lanes
+# compete, freed slots go to the lanes in proportion to LANE_WEIGHTS, and within a
+# lane the jobs take turns. The sharded and agent engines run their stores in other
+# processes, outside these slots.
 
+class SlotTicket:
+    """
+    One request for a store I/O slot, granted through its future
+    """
 
-if __name__ == '__main__':
+    def __init__(self, lane, job, host):
+        self.lane = lane
+        self.job = job
+        self.host = host
+        self.future = Future()
+        self.granted = False
+
+
+class StoreSlotScheduler:
+    """
+    Hands out the store I/O slots by lane (weighted turns) and by job within a lane
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_use = 0
+        self.host_in_use = Counter()
+        self.lane_in_use = Counter()
+        self.waiting = {lane: OrderedDict() for lane in PRIORITY_LANES}  # lane -> job -> tickets
+        self.passes = {lane: 0.0 for lane in PRIORITY_LANES}  # Slots granted / weight
+
+    @staticmethod
+    def limits(lane):
+        """
+        Slots a lane may fill in total and on one store
+        """
+        if lane == 'interactive':
+            return STORE_IO_SLOTS, STORE_IO_SLOTS_PER_HOST
+        return (max(STORE_IO_SLOTS - INTERACTIVE_RESERVED_SLOTS, 1),
+                max(STORE_IO_SLOTS_PER_HOST - INTERACTIVE_RESERVED_HOST_SLOTS, 1))
+
+    def request(self, lane, job, host):
+        ticket = SlotTicket(lane, job, host)
+        with self.lock:
+            jobs = self.waiting[lane]
+            if not jobs:
+                # A lane coming back does not get the turns it missed while idle
+                competing = [self.passes[other] for other in PRIORITY_LANES if self.waiting[other]]
+                if competing:
+                    self.passes[lane] = max(self.passes[lane], min(competing))
+            jobs.setdefault(job, deque()).append(ticket)
+            self.dispatch()
+        return ticket
+
+    def release(self, ticket):
+        """
+        Give back a granted slot, or withdraw a ticket still waiting
+        """
+        with self.lock:
+            if ticket.granted:
+                self.in_use -= 1
+                self.host_in_use[ticket.host] -= 1
+                if not self.host_in_use[ticket.host]:
+                    del self.host_in_use[ticket.host]
+                self.lane_in_use[ticket.lane] -= 1
+            else:
+                tickets = self.waiting[ticket.lane].get(ticket.job)
+                if tickets is not None and ticket in tickets:
+                    tickets.remove(ticket)
+                    if not tickets:
+                        del self.waiting[ticket.lane][ticket.job]
+            self.dispatch()
+
+    def dispatch(self):
+        """
+        Grant waiting tickets while slots are free (called with the lock held)
+        """
+        while self.in_use < STORE_IO_SLOTS:
+            lanes = sorted((lane for lane in PRIORITY_LANES if self.waiting[lane]), key=self.passes.get)
+            if not any(self.grant_next(lane) for lane in lanes):
+                return
+
+    def grant_next(self, lane):
+        """
+        Grant the first ticket that fits, taking the jobs of the lane in turn
+        """
+        slots, host_slots = self.limits(lane)
+        if self.in_use >= slots:
+            return False
+        jobs = self.waiting[lane]
+        for job in list(jobs):
+            tickets = jobs[job]
+            for ticket in list(tickets):
+                if self.host_in_use[ticket.host] >= host_slots:
+                    continue
+                tickets.remove(ticket)
+                if not ticket.future.set_running_or_notify_cancel():
+                    continue  # Waiter gave up (cancelled async task)
+                if tickets:
+                    jobs.move_to_end(job)
+                else:
+                    del jobs[job]
+                ticket.granted = True
+                self.in_use += 1
+                self.host_in_use[ticket.host] += 1
+                self.lane_in_use[lane] += 1
+                self.passes[lane] += 1 / LANE_WEIGHTS[lane]
+                ticket.future.set_result(True)
+                return True
+            if not tickets:
+                del jobs[job]
+        return False
+
+    def status(self):
+        with self.lock:
+            return {
+                'slots': STORE_IO_SLOTS,
+                'slots_per_host': STORE_IO_SLOTS_PER_HOST,
+                'reserved_interactive': INTERACTIVE_RESERVED_SLOTS,
+                'in_use': self.in_use,
+                'lanes': {
+                    lane: {
+                        'weight': LANE_WEIGHTS[lane],
+                        'running': self.lane_in_use[lane],
+                        'waiting': sum(len(tickets) for tickets in self.waiting[lane].values()),
+                        'jobs_waiting': len(self.waiting[lane])
+                    }
+                    for lane in PRIORITY_LANES
+                }
+            }
+
+
+store_slots = StoreSlotScheduler()
+
+
+def request_store_slot(host):
+    """
+    Queue a slot request for host in the lane and job of the current context
+    """
+    timings = current_job_timings.get()
+    return store_slots.request(current_lane.get(), timings.job_id if timings else None, host)
+
+
+def record_slot_wait(ticket, started):
+    waited = time.perf_counter() - started
+    metrics.observe('filechecker_slot_wait_seconds', waited, lane=ticket.lane)
+    timings = current_job_timings.get()
+    if timings is not None and waited >= 0.001:
+        timings.record('queue', waited)
+
+
+@contextmanager
+def store_slot(host):
+    """
+    Hold a store I/O slot for host while the enclosed operation runs
+    """
+    started = time.perf_counter()
+    ticket = request_store_slot(host)
     try:
-        print("=" * 60)
-        print("File Checker Application")
-        print("=" * 60)
-        print(f"Python version: {sys.version}")
-        print(f"Flask app: {app}")
-        print(f"Template folder: {app.template_folder}")
-        print(f"Upload folder: {app.config['UPLOAD_FOLDER']}")
-        print(f"Report folder: {app.config['REPORT_FOLDER']}")
-        print(f"Default credentials enabled: {USE_DEFAULT_CREDENTIALS}")
-        if USE_DEFAULT_CREDENTIALS:
-            print(f"Default username: {DEFAULT_USERNAME}")
-        print("=" * 60)
-        
-        # Open browser in a separate thread
-        threading.Thread(target=open_browser, daemon=True).start()
+        ticket.future.result()
+        record_slot_wait(ticket, started)
+        yield
+    finally:
+        store_slots.release(ticket)
+
+
+@asynccontextmanager
+async def store_slot_async(host):
+    """
+    store_slot for the async engine (waits without holding a thread)
+    """
+    started = time.perf_counter()
+    ticket = request_store_slot(host)
+    try:
+        await asyncio.wrap_future(ticket.future)
+        record_slot_wait(ticket, started)
+        yield
+    finally:
+        store_slots.release(ticket)
+
+
+def demote_large_job(store_count):
+    """
+    Move interactive work covering more than INTERACTIVE_MAX_STORES stores to the bulk lane
+    Returns: token for current_lane.reset, or None
+    """
+    if current_lane.get() == 'interactive' and store_count > INTERACTIVE_MAX_STORES:
+        return current_lane.set('bulk')
+    return None
+
+
+@app.route('/lanes', methods=['GET'])
+def get_lanes():
+    """Store I/O slots in use and waiting, by priority lane"""
+    return jsonify({'success': True, **store_slots.status()})
+
+
+# ===== SHARE BACKENDS =====
+# How the stores' shares are reached (SHARE_BACKEND). The 'netuse' backend maps
+# each store with net use and then uses the regular file functions through the
+# Windows redirector. The 'smb' backend opens SMB sessions from this process with
+# smbprotocol: no subprocess per store, credentials never on a command line, one
+# session per store reused by every job, and a stat sent as a single compound
+# request. The 'local' backend maps \\<ip>\<path> to <root>\<ip>\<path>, so the
+# whole application can be exercised without stores (a store is reachable when
+# its folder exists). All take and return the UNC paths built by get_network_path.
+
+def is_share_path(path):
+    return path.startswith('\\\\')
+
+
+def get_share_server(network_path):
+    return network_path.replace('/', '\\').lstrip('\\').split('\\')[0]
+
+
+class NetUseShareBackend:
+    """
+    Shares mapped with net use, files read and written through the OS
+    """
+    name = 'netuse'
+
+    def connect(self, network_path, username=None, password=None):
+        """
+        Returns: tuple (returncode, stdout, stderr)
+        """
+        # Disconnect first if there's an existing connection (without credentials)
+        self.disconnect(network_path)
+        command = ['net', 'use', network_path]
+        if username and password:
+            command += [f'/user:{username}', password]
+        result = subprocess.run(command, capture_output=True, text=True, timeout=10)
+        return result.returncode, result.stdout, result.stderr
+
+    def disconnect(self, network_path):
+        subprocess.run(['net', 'use', network_path, '/delete', '/y'], capture_output=True, text=True)
+
+    def stat(self, path):
+        return os.stat(path)
+
+    def stat_or_none(self, path):
+        """
+        stat of a file, or None if it does not exist
+        """
+        try:
+            return self.stat(path)
+        except OSError as e:
+            if e.errno in (errno.ENOENT, errno.ENOTDIR):
+                return None
+            raise
+
+    def makedirs(self, path):
+        os.makedirs(path, exist_ok=True)
+
+    def open(self, path, mode='rb'):
+        return open(path, mode)
+
+    def scandir(self, path):
+        return os.scandir(path)
+
+    def copy(self, source_path, dest_path):
+        shutil.copy2(source_path, dest_path)
+
+    def copy_times(self, source_path, dest_path):
+        shutil.copystat(source_path, dest_path)
+
+
+class LocalShareBackend(NetUseShareBackend):
+    """
+    Stand-in for the stores: \\<ip>\<path> is <root>\<ip>\<path>
+    """
+    name = 'local'
+
+    def __init__(self):
+        self.root = os.path.abspath(SHARE_LOCAL_ROOT or os.path.join(base_path, 'shares'))
+        self.latency = SHARE_LOCAL_LATENCY_MS / 1000
+
+    def round_trip(self):
+        # Stands in for the WAN round trip of a real store (load tests)
+        if self.latency:
+            time.sleep(self.latency)
+
+    def resolve(self, path):
+        if not is_share_path(path):
+            return path
+        parts = [part for part in path.replace('/', '\\').split('\\') if part]
+        return os.path.join(self.root, *parts)
+
+    def connect(self, network_path, username=None, password=None):
+        self.round_trip()
+        if os.path.isdir(self.resolve(network_path)):
+            return 0, '', ''
+        return 2, '', f"Le chemin réseau est introuvable ({self.resolve(network_path)})"
+
+    def disconnect(self, network_path):
+        pass
+
+    def stat(self, path):
+        self.round_trip()
+        return os.stat(self.resolve(path))
+
+    def makedirs(self, path):
+        self.round_trip()
+        os.makedirs(self.resolve(path), exist_ok=True)
+
+    def open(self, path, mode='rb'):
+        self.round_trip()
+        return open(self.resolve(path), mode)
+
+    def scandir(self, path):
+        self.round_trip()
+        return os.scandir(self.resolve(path))
+
+    def copy(self, source_path, dest_path):
+        self.round_trip()
+        shutil.copy2(self.resolve(source_path), self.resolve(dest_path))
+
+    def copy_times(self, source_path, dest_path):
+        shutil.copystat(self.resolve(source_path), self.resolve(dest_path))
+
+
+class SmbShareBackend(NetUseShareBackend):
+    """
+    SMB sessions held by this process (smbprotocol's smbclient)
+    """
+    name = 'smb'
+
+    def __init__(self):
+        try:
+            self.client = importlib.import_module('smbclient')
+        except ImportError:
+            raise RuntimeError("Le backend 'smb' nécessite le paquet smbprotocol (pip install smbprotocol)")
+
+    def connect(self, network_path, username=None, password=None):
+        try:
+            # Sessions are cached by smbclient and reused until disconnect
+            self.client.register_session(get_share_server(network_path), username=username, password=password,
+                                         connection_timeout=SMB_CONNECTION_TIMEOUT)
+            return 0, '', ''
+        except Exception as e:
+            return 1, '', str(e)
+
+    def disconnect(self, network_path):
+        try:
+            self.client.delete_session(get_share_server(network_path))
+        except Exception as e:
+            logger.debug(f"No SMB session to close for {network_path}: {str(e)}")
+
+    def stat(self, path):
+        return self.client.stat(path) if is_share_path(path) else os.stat(path)
+
+    def makedirs(self, path):
+        self.client.makedirs(path, exist_ok=True)
+
+    def open(self, path, mode='rb'):
+        return self.client.open_file(path, mode=mode) if is_share_path(path) else open(path, mode)
+
+    def scandir(self, path):
+        return self.client.scandir(path)
+
+    def copy(self, source_path, dest_path):
+        with self.open(source_path, 'rb') as src, self.open(dest_path, 'wb') as dst:
+            shutil.copyfileobj(src, dst, SMB_COPY_CHUNK_SIZE)
+        self.copy_times(source_path, dest_path)
+
+    def copy_times(self, source_path, dest_path):
+        stat = self.stat(source_path)
+        if is_share_path(dest_path):
+            self.client.utime(dest_path, times=(stat.st_atime, stat.st_mtime))
+        else:
+            os.utime(dest_path, times=(stat.st_atime, stat.st_mtime))
+
+
+SHARE_BACKEND_CLASSES = {'netuse': NetUseShareBackend, 'smb': SmbShareBackend, 'local': LocalShareBackend}
+share_backends = {}
+
+
+def get_share_backend():
+    """
+    The backend selected by SHARE_BACKEND (created on first use)
+    """
+    backend = share_backends.get(SHARE_BACKEND)
+    if backend is None:
+        backend = share_backends[SHARE_BACKEND] = SHARE_BACKEND_CLASSES[SHARE_BACKEND]()
+    return backend
+
+
+# ===== BANDWIDTH LIMITS =====
+# Copies are throttled with token buckets: one shared by every transfer and one
+# per store, so concurrent distributions never exceed the caps on the WAN links.
+# The caps are read again for every chunk, so a change through /bandwidth or the
+# start of a profile period also applies to the copies in progress.
+
+class TokenBucket:
+    """
+    Thread-safe token bucket; rate in bytes per second, 0 means unlimited
+    """
+
+    def __init__(self, rate=0):
+        self.rate = rate
+        self.tokens = rate
+        self.last_refill = time.monotonic()
+        self.lock = threading.Lock()
+
+    def set_rate(self, rate):
+        with self.lock:
+            if rate != self.rate:
+                self.rate = rate
+                self.tokens = min(self.tokens, rate)
+
+    def consume(self, amount):
+        """
+        Take amount tokens, sleeping as long as needed to stay under the rate
+        """
+        with self.lock:
+            if self.rate <= 0:
+                return
+            now = time.monotonic()
+            self.tokens = min(self.rate, self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
+            # Reserve the tokens now (possibly going into debt) so that
+            # concurrent consumers queue up behind each other
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+
+
+global_bandwidth_bucket = TokenBucket()
+host_bandwidth_buckets = {}
+host_bandwidth_buckets_lock = threading.Lock()
+
+COPY_CHUNK_SIZE = 64 * 1024
+
+
+def get_bandwidth_limits(now=None):
+    """
+    Current (global, per-host) caps in KB/s, taking the time-of-day profile into account
+    """
+    current = (now or datetime.now()).strftime('%H:%M')
+    for period in BANDWIDTH_PROFILE:
+        start, end = period['start'], period['end']
+        in_period = start <= current < end if start <= end else (current >= start or current < end)
+        if in_period:
+            return period.get('global_kbps', 0), period.get('per_host_kbps', 0)
+    return BANDWIDTH_GLOBAL_KBPS, BANDWIDTH_PER_HOST_KBPS
+
+
+def get_host_bandwidth_bucket(host):
+    with host_bandwidth_buckets_lock:
+        if host not in host_bandwidth_buckets:
+            host_bandwidth_buckets[host] = TokenBucket()
+        return host_bandwidth_buckets[host]
+
+
+def copy_file_with_limits(source_path, dest_path, host):
+    """
+    Copy a file like shutil.copy2, rate limited by the global and per-host caps
+    """
+    backend = get_share_backend()
+    with store_slot(host), timed_stage('copy', host):
+        copy_file_throttled(backend, source_path, dest_path, host)
+    metrics.inc('filechecker_bytes_copied_total', backend.stat(source_path).st_size)
+
+
+def copy_file_throttled(backend, source_path, dest_path, host):
+    """
+    Copy in chunks through the token buckets, unless no cap and no profile is set
+    when the copy starts (the backend's own copy is faster, but cannot be throttled
+    afterwards)
+    """
+    global_kbps, host_kbps = get_bandwidth_limits()
+    if global_kbps <= 0 and host_kbps <= 0 and not BANDWIDTH_PROFILE:
+        backend.copy(source_path, dest_path)
+        return
+
+    host_bucket = get_host_bandwidth_bucket(host)
+    with backend.open(source_path, 'rb') as src, backend.open(dest_path, 'wb') as dst:
+        while True:
+            chunk = src.read(COPY_CHUNK_SIZE)
+            if not chunk:
+                break
+            global_kbps, host_kbps = get_bandwidth_limits()
+            global_bandwidth_bucket.set_rate(global_kbps * 1024)
+            host_bucket.set_rate(host_kbps * 1024)
+            host_bucket.consume(len(chunk))
+            global_bandwidth_bucket.consume(len(chunk))
+            dst.write(chunk)
+    backend.copy_times(source_path, dest_path)
+
+
+@app.route('/bandwidth', methods=['GET'])
+def get_bandwidth_settings():
+    """Current bandwidth caps and time-of-day profile"""
+    global_kbps, host_kbps = get_bandwidth_limits()
+    return jsonify({
+        'success': True,
+        'global_kbps': BANDWIDTH_GLOBAL_KBPS,
+        'per_host_kbps': BANDWIDTH_PER_HOST_KBPS,
+        'profile': BANDWIDTH_PROFILE,
+        'active': {'global_kbps': global_kbps, 'per_host_kbps': host_kbps}
+    })
+
+
+@app.route('/bandwidth', methods=['POST'])
+def update_bandwidth_settings():
+    """
+    Change bandwidth caps at runtime
+    Applies to the chunked copies in progress in this process; copies started with no
+    cap and no profile run unthrottled to the end, shard workers keep the caps their run started with
+    """
+    global BANDWIDTH_GLOBAL_KBPS, BANDWIDTH_PER_HOST_KBPS, BANDWIDTH_PROFILE
+    try:
+        data = request.get_json()
+        global_kbps = int(data.get('global_kbps', BANDWIDTH_GLOBAL_KBPS))
+        host_kbps = int(data.get('per_host_kbps', BANDWIDTH_PER_HOST_KBPS))
+        profile = data.get('profile', BANDWIDTH_PROFILE)
+
+        if global_kbps < 0 or host_kbps < 0:
+            return jsonify({'error': 'Bandwidth caps must be positive'}), 400
+
+        for period in profile:
+            for key in ('start', 'end'):
+                datetime.strptime(period[key], '%H:%M')
+
+        BANDWIDTH_GLOBAL_KBPS = global_kbps
+        BANDWIDTH_PER_HOST_KBPS = host_kbps
+        BANDWIDTH_PROFILE = profile
+        return get_bandwidth_settings()
+
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'error': f'Invalid bandwidth settings: {str(e)}'}), 400
+    except Exception as e:
+        logger.error(f"Update bandwidth error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+# ===== COMPRESSED TRANSFERS =====
+# XML/CSV payloads compress 5-10x. In archive mode the file is gzipped once here
+# and each store receives <dir>\_incoming\<name>.gz plus <name>.gz.json, the
+# extraction manifest (written last, so a manifest always means a complete
+# archive). The extractor (extract_incoming_archives, or "--extract-incoming DIR"
+# on the store) decompresses, verifies the SHA-256 and moves the file into <dir>;
+# until then the store's row reports PENDING_EXTRACTION_STATUS, not Success. Files
+# sent raw (other extensions, or too little gain) count in the stats with a ratio of 1.
+
+def compress_for_transfer(file_path, filename):
+    """
+    Gzip a file next to it and build its extraction manifest
+    Returns: dict with archive_path, manifest_path, original_size, compressed_size
+    """
+    archive_path = f"{file_path}.{threading.get_ident()}.gz"
+    with open(file_path, 'rb') as src, gzip.open(archive_path, 'wb', compresslevel=6) as dst:
+        shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+
+    manifest = {
+        'original_name': filename,
+        'size': os.path.getsize(file_path),
+        'sha256': compute_file_hash(file_path),
+        'mtime': os.path.getmtime(file_path),
+        'algorithm': 'gzip',
+        'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    }
+    manifest_path = f"{archive_path}.json"
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f)
+
+    return {
+        'archive_path': archive_path,
+        'manifest_path': manifest_path,
+        'original_size': manifest['size'],
+        'compressed_size': os.path.getsize(archive_path)
+    }
+
+
+def transfer_file_compressed(file_path, stores, directory_path, filename, username=None, password=None):
+    """
+    Send a compressed copy of a file and its manifest to every store
+    Falls back to a raw transfer when the file does not compress well
+    """
+    archive = compress_for_transfer(file_path, filename)
+    try:
+        ratio = archive['original_size'] / archive['compressed_size'] if archive['compressed_size'] else 1
+        if ratio < COMPRESSION_MIN_RATIO:
+            logger.info(f"{filename} only compresses {ratio:.2f}x, sending it raw")
+            results = RawTransferCounter([], archive['original_size'])
+            for store in stores:
+                results.append(transfer_file_to_store(file_path, store['CodeMag'], store['ipaddress'],
+                                                      directory_path, filename, username, password))
+            return {'success': True, 'results': results.rows, 'compression': results.stats()}
+
+        incoming_path = os.path.join(directory_path, INCOMING_FOLDER_NAME)
+        archive_name = f"{filename}.gz"
+        results = []
+        sent = 0
+
+        for store in stores:
+            result = transfer_file_to_store(archive['archive_path'], store['CodeMag'], store['ipaddress'],
+                                            incoming_path, archive_name, username, password)
+            if result['Status'] == 'Success':
+                manifest = transfer_file_to_store(archive['manifest_path'], store['CodeMag'], store['ipaddress'],
+                                                  incoming_path, f"{archive_name}.json", username, password)
+                if manifest['Status'] != 'Success':
+                    result['Status'] = 'Failed'
+                    result['Error'] = f"Manifest: {manifest['Error']}"
+                else:
+                    # The file is only in place once extracted on the store (--extract-incoming)
+                    result['Status'] = PENDING_EXTRACTION_STATUS
+                    sent += 1
+            result['FileName'] = filename
+            result['CompressionRatio'] = round(ratio, 2)
+            results.append(result)
+
+        logger.info(f"Sent {filename} compressed {ratio:.2f}x to {sent}/{len(stores)} store(s)")
+        return {
+            'success': True,
+            'results': results,
+            'compression': {
+                'original_bytes': archive['original_size'] * sent,
+                'sent_bytes': archive['compressed_size'] * sent
+            }
+        }
+    finally:
+        for path in (archive['archive_path'], archive['manifest_path']):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+
+class RawTransferCounter:
+    """
+    Sink of the rows of a file sent raw in archive mode (not worth compressing),
+    counting its bytes in the compression stats with a ratio of 1
+    """
+
+    def __init__(self, rows, size):
+        self.rows = rows
+        self.size = size
+        self.sent = 0
+
+    def append(self, row):
+        if row['Status'] == 'Success':
+            self.sent += 1
+        self.rows.append(row)
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def stats(self):
+        return {'original_bytes': self.size * self.sent, 'sent_bytes': self.size * self.sent}
+
+
+def merge_compression_stats(total, stats):
+    """
+    Add the compression stats of one file transfer to a running total
+    """
+    if stats:
+        total['original_bytes'] += stats['original_bytes']
+        total['sent_bytes'] += stats['sent_bytes']
+        total['ratio'] = round(total['original_bytes'] / total['sent_bytes'], 2) if total['sent_bytes'] else None
+    return total
+
+
+def extract_incoming_archives(directory):
+    """
+    Decompress the archives waiting in <directory>\\_incoming into <directory>
+    Run on (or close to) the store
+    Returns: list of dicts with the name, status and error of each archive
+    """
+    incoming = os.path.join(directory, INCOMING_FOLDER_NAME)
+    results = []
+    if not os.path.isdir(incoming):
+        return results
+
+    for name in sorted(os.listdir(incoming)):
+        if not name.endswith('.gz.json'):
+            continue
+        manifest_path = os.path.join(incoming, name)
+        archive_path = manifest_path[:-len('.json')]
+        try:
+            with open(manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+
+            target_path = os.path.join(directory, os.path.basename(manifest['original_name']))
+            part_path = f"{target_path}.part"
+            sha256 = hashlib.sha256()
+            with gzip.open(archive_path, 'rb') as src, open(part_path, 'wb') as dst:
+                for chunk in iter(lambda: src.read(COPY_CHUNK_SIZE), b''):
+                    sha256.update(chunk)
+                    dst.write(chunk)
+
+            if sha256.hexdigest() != manifest['sha256']:
+                os.remove(part_path)
+                raise ValueError('SHA-256 mismatch after extraction')
+
+            os.utime(part_path, (manifest['mtime'], manifest['mtime']))
+            os.replace(part_path, target_path)
+            os.remove(archive_path)
+            os.remove(manifest_path)
+            results.append({'name': manifest['original_name'], 'status': 'Extracted', 'error': None})
+            logger.info(f"Extracted {manifest['original_name']} in {directory}")
+
+        except Exception as e:
+            logger.error(f"Error extracting {archive_path}: {str(e)}")
+            results.append({'name': name, 'status': 'Failed', 'error': str(e)})
+
+    return results
+
+
+# ===== RELAY DISTRIBUTION =====
+# Instead of pushing every byte from this workstation to every store, the file
+# is pushed once to the seed stores of each region (inventory columns Region and
+# Seed), then the agent serving the region (see AGENT MODE) copies it from a seed's
+# share to each remaining store of the region, over the region's own network.
+# Stores whose region has no live agent, no reachable seed, or no region at all
+# get the file directly from the central copy: relaying them from this workstation
+# would cost two WAN transfers (seed to here, here to the store) instead of one.
+
+def relay_shard(stores, source_path, directory_path, filename, username=None, password=None):
+    """
+    Relay task (SHARD_TASKS): copy a file from each store's seed (SeedCode, SeedIP) to the store
+    Run by the region's agent with source_path None; run here (no agent, or task taken back)
+    the stores get the central copy at source_path instead
+    """
+    if source_path is not None:
+        return transfer_shard(stores, source_path, directory_path, filename, username, password)
+
+    # Agents get no credentials for the default account and use their own defaults
+    username, password = get_credentials(username, password)
+    results = []
+    connected_seeds = set()
+    for store in stores:
+        seed_ip = store['SeedIP']
+        if username and password and seed_ip not in connected_seeds:
+            connect_to_network_share(seed_ip, username, password)
+            connected_seeds.add(seed_ip)
+        seed_path = get_network_path(seed_ip, directory_path, filename)
+        result = transfer_file_to_store(seed_path, store['CodeMag'], store['ipaddress'], directory_path, filename,
+                                        username, password, source=f"Seed {store['SeedCode']}")
+        results.append(result)
+        if result['Status'] == 'Success':
+            logger.info("Relayed %s from %s to %s", filename, store['SeedCode'], store['CodeMag'],
+                        extra={'store': store['ipaddress']})
+    return results
+
+
+def transfer_file_relay(file_path, stores, directory_path, filename, username=None, password=None):
+    """
+    Distribute a file through regional seed stores
+    Returns: list of transfer result rows (Source tells where each copy came from)
+    """
+    results = []
+    relay_stores = []
+    direct_stores = []
+    regions = {}
+
+    for store in stores:
+        if store['Region']:
+            regions.setdefault(store['Region'], []).append(store)
+        else:
+            direct_stores.append(store)
+
+    # Stage 1: central copy to the seeds of each region, each other store of the
+    # region is then assigned a seed round-robin
+    for region, region_stores in regions.items():
+        seeds = [store for store in region_stores if store['Seed']]
+        others = [store for store in region_stores if not store['Seed']]
+
+        ready_seeds = []
+        for seed in seeds:
+            result = transfer_file_to_store(file_path, seed['CodeMag'], seed['ipaddress'], directory_path,
+                                            filename, username, password)
+            results.append(result)
+            if result['Status'] == 'Success':
+                ready_seeds.append(seed)
+
+        if not ready_seeds:
+            if others:
+                logger.warning(f"No seed available for region {region}, sending directly")
+            direct_stores.extend(others)
+            continue
+        for index, store in enumerate(others):
+            seed = ready_seeds[index % len(ready_seeds)]
+            relay_stores.append(dict(store, SeedCode=seed['CodeMag'], SeedIP=seed['ipaddress']))
+
+    # Stage 2: the region agents feed the neighbours from the seeds
+    if relay_stores:
+        def failed_row(store, error):
+            return {
+                'CodeMag': store['CodeMag'],
+                'IPAddress': store['ipaddress'],
+                'FileName': filename,
+                'Status': 'Failed',
+                'DestinationPath': get_network_path(store['ipaddress'], directory_path, filename),
+                'Source': f"Seed {store['SeedCode']}",
+                'Error': error
+            }
+
+        locations = [(store['ipaddress'], store['Region']) for store in relay_stores]
+        args = (file_path, directory_path, filename, username, password)
+        agent_args = [None, directory_path, filename, *get_agent_credentials(username, password)]
+        results.extend(run_on_agents('relay', relay_stores, locations, args, agent_args, failed_row))
+
+    # Stores without a usable seed get the central copy
+    for store in direct_stores:
+        results.append(transfer_file_to_store(file_path, store['CodeMag'], store['ipaddress'], directory_path,
+                                              filename, username, password))
+
+    return results
+
+
+# ===== WAVE ROLLOUT =====
+# A bad file should not reach every store before anyone notices. The waves
+# distribution sends it to a few canary stores first, then to waves growing
+# ROLLOUT_WAVE_GROWTH times, each wave copied concurrently. As soon as more than
+# ROLLOUT_MAX_FAILURE_RATE of a wave has failed, the stores of the wave not started
+# yet and all later waves are skipped (Status 'Halted').
+
+def plan_rollout_waves(stores):
+    """
+    Split the stores into the canary wave and the following waves
+    Returns: list of lists of stores, canaries first
+    """
+    canaries = [store for store in stores if store.get('Canary')]
+    if not canaries:
+        # Take the canaries from different regions, round-robin
+        by_region = OrderedDict()
+        for store in stores:
+            by_region.setdefault(store.get('Region'), deque()).append(store)
+        while len(canaries) < min(ROLLOUT_CANARY_STORES, len(stores)):
+            for region_stores in by_region.values():
+                if region_stores and len(canaries) < ROLLOUT_CANARY_STORES:
+                    canaries.append(region_stores.popleft())
+
+    canary_ids = {id(store) for store in canaries}
+    remaining = [store for store in stores if id(store) not in canary_ids]
+    waves = [canaries] if canaries else []
+    size = max(len(canaries), 1)
+    while remaining:
+        size *= ROLLOUT_WAVE_GROWTH
+        waves.append(remaining[:size])
+        remaining = remaining[size:]
+    return waves
+
+
+def transfer_file_waves(file_path, stores, directory_path, filename, username=None, password=None):
+    """
+    Roll a file out wave by wave, halting when a wave fails too often
+    Returns: tuple (transfer result rows with their Wave number, 0 for the canaries,
+    rollout dict with the per-wave counts and why it halted)
+    """
+    waves = plan_rollout_waves(stores)
+    rollout = {'waves': [], 'halted': False, 'halted_at_wave': None, 'reason': None}
+    results = []
+
+    for number, wave in enumerate(waves):
+        if rollout['halted']:
+            results.extend(build_halted_row(store, directory_path, filename, number, rollout['reason'])
+                           for store in wave)
+            continue
+
+        halt = threading.Event()
+        failures = 0
+        allowed_failures = ROLLOUT_MAX_FAILURE_RATE * len(wave)
+        counts_lock = threading.Lock()
+
+        def send(store, number=number, halt=halt):
+            nonlocal failures
+            if halt.is_set():
+                return None
+            result = transfer_file_to_store(file_path, store['CodeMag'], store['ipaddress'], directory_path,
+                                            filename, username, password)
+            if result['Status'] != 'Success':
+                with counts_lock:
+                    failures += 1
+                    if failures > allowed_failures:
+                        halt.set()
+            return result
+
+        label = 'canary wave' if number == 0 else f'wave {number}'
+        logger.info(f"Rollout of {filename}: {label}, {len(wave)} store(s)")
+        with ThreadPoolExecutor(max_workers=min(ROLLOUT_WAVE_WORKERS, len(wave))) as executor:
+            futures = [submit_with_context(executor, send, store) for store in wave]
+            wave_results = [future.result() for future in futures]
+
+        if halt.is_set():
+            rollout['halted'] = True
+            rollout['halted_at_wave'] = number
+            rollout['reason'] = (f"Déploiement arrêté : {failures} échec(s) sur {len(wave)} magasin(s) "
+                                 f"de la vague {number} (seuil {ROLLOUT_MAX_FAILURE_RATE:.0%})")
+            logger.warning(f"Rollout of {filename} halted at {label}: {failures} failure(s)")
+
+        sent = 0
+        for store, result in zip(wave, wave_results):
+            if result is None:
+                result = build_halted_row(store, directory_path, filename, number, rollout['reason'])
+            else:
+                result['Wave'] = number
+                sent += 1
+            results.append(result)
+        rollout['waves'].append({'wave': number, 'stores': len(wave), 'sent': sent, 'failed': failures})
+
+        if not rollout['halted'] and ROLLOUT_WAVE_PAUSE_SECONDS and number < len(waves) - 1:
+            time.sleep(ROLLOUT_WAVE_PAUSE_SECONDS)
+
+    return results, rollout
+
+
+def build_halted_row(store, directory_path, filename, number, reason):
+    return {
+        'CodeMag': store['CodeMag'],
+        'IPAddress': store['ipaddress'],
+        'FileName': filename,
+        'Status': 'Halted',
+        'DestinationPath': get_network_path(store['ipaddress'], directory_path, filename),
+        'Source': 'Central',
+        'Error': reason,
+        'Wave': number
+    }
+
+
+# ===== UPLOAD STAGING =====
+# Uploads are stored once under their SHA-256 in STAGING_FOLDER. Jobs take a
+# reference on the staged copies they use; unreferenced copies stay available
+# for later pushes of the same content and are evicted least-recently-used
+# first when the staging area grows beyond STAGING_MAX_BYTES.
+
+staging_index = None  # sha256 -> {'size', 'refcount', 'last_used'}
+staging_lock = threading.Lock()
+
+
+def get_staged_path(sha256):
+    return os.path.join(app.config['STAGING_FOLDER'], sha256)
+
+
+def is_valid_sha256(value):
+    return len(value) == 64 and all(c in '0123456789abcdef' for c in value)
+
+
+def load_staging_index():
+    """
+    Build the staging index from disk (caller holds staging_lock)
+    """
+    global staging_index
+    if staging_index is not None:
+        return staging_index
+
+    staging_index = {}
+    for name in os.listdir(app.config['STAGING_FOLDER']):
+        path = get_staged_path(name)
+        if is_valid_sha256(name) and os.path.isfile(path):
+            staging_index[name] = {
+                'size': os.path.getsize(path),
+                'refcount': 0,
+                'last_used': os.path.getmtime(path)
+            }
+        elif name.startswith('tmp_') and datetime.now().timestamp() - os.path.getmtime(path) > 24 * 3600:
+            # Leftover of an interrupted upload
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+    return staging_index
+
+
+def evict_staged_files():
+    """
+    Remove unreferenced staged files, least recently used first, until the
+    staging area fits in STAGING_MAX_BYTES (caller holds staging_lock)
+    """
+    index = load_staging_index()
+    total_size = sum(entry['size'] for entry in index.values())
+    max_bytes = app.config['STAGING_MAX_BYTES']
+
+    for sha256, entry in sorted(index.items(), key=lambda item: item[1]['last_used']):
+        if total_size <= max_bytes:
+            break
+        if entry['refcount'] > 0:
+            continue
+        try:
+            os.remove(get_staged_path(sha256))
+        except OSError as e:
+            logger.error(f"Error evicting staged file {sha256}: {str(e)}")
+            continue
+        total_size -= entry['size']
+        del index[sha256]
+        logger.info(f"Evicted staged file {sha256}")
+
+
+def stage_upload_stream(stream):
+    """
+    Stream an upload into the staging area, deduplicated by content
+    The caller gets a reference on the staged file and must release it
+    Returns: tuple (sha256, size)
+    """
+    temp_path = os.path.join(app.config['STAGING_FOLDER'], f"tmp_{threading.get_ident()}_{datetime.now().strftime('%H%M%S%f')}")
+    try:
+        size, sha256 = save_upload_stream(stream, temp_path)
+
+        with staging_lock:
+            index = load_staging_index()
+            if sha256 in index:
+                os.remove(temp_path)
+                logger.info(f"Upload {sha256} already staged, reusing it")
+            else:
+                os.replace(temp_path, get_staged_path(sha256))
+                index[sha256] = {'size': size, 'refcount': 0, 'last_used': 0}
+            index[sha256]['refcount'] += 1
+            index[sha256]['last_used'] = datetime.now().timestamp()
+            evict_staged_files()
+
+        return sha256, size
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def acquire_staged_file(sha256):
+    """
+    Take a reference on a staged file, returns False if it is not staged
+    """
+    with staging_lock:
+        entry = load_staging_index().get(sha256)
+        if entry is None:
+            return False
+        entry['refcount'] += 1
+        entry['last_used'] = datetime.now().timestamp()
+        try:
+            os.utime(get_staged_path(sha256))
+        except OSError:
+            pass
+        return True
+
+
+def release_staged_file(sha256):
+    with staging_lock:
+        entry = load_staging_index().get(sha256)
+        if entry is not None:
+            entry['refcount'] = max(entry['refcount'] - 1, 0)
+        evict_staged_files()
+
+
+@app.route('/staging/<sha256>')
+def get_staged_file_info(sha256):
+    """Tell whether content with this SHA-256 is already staged"""
+    sha256 = sha256.lower()
+    if not is_valid_sha256(sha256):
+        return jsonify({'error': 'Invalid SHA-256'}), 400
+    with staging_lock:
+        entry = load_staging_index().get(sha256)
+    if entry is None:
+        return jsonify({'success': True, 'staged': False})
+    return jsonify({'success': True, 'staged': True, 'size': entry['size']})
+
+
+# ===== STREAMED TRANSFERS =====
+# Files are streamed one by one into a transfer session and copied to the staging
+# folder in chunks while being hashed. Under waitress the body is first spooled by
+# the server (in memory, then in a temporary file of the system temp folder) before
+# the route reads it, so large uploads need room there too. As soon as a file is
+# fully received its transfer to the servers starts in the background, so file 1
+# is being pushed while file 2 is still uploading. Sessions left open (browser
+# closed before completing) are closed after TRANSFER_SESSION_TTL_SECONDS idle by
+# their own thread, started with the first session.
+
+def save_upload_stream(stream, dest_path, chunk_size=None):
+    """
+    Copy an input stream to disk in chunks, hashing on the fly
+    Returns: tuple (size, sha256)
+    """
+    chunk_size = chunk_size or app.config['UPLOAD_CHUNK_SIZE']
+    sha256 = hashlib.sha256()
+    size = 0
+    with open(dest_path, 'wb') as f:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            f.write(chunk)
+            sha256.update(chunk)
+            size += len(chunk)
+    return size, sha256.hexdigest()
+
+
+@contextmanager
+def session_activity(session_id):
+    """
+    Look up a session and mark it in use (an upload in progress is never expired)
+    Yields: the session, or None if it does not exist
+    """
+    with transfer_sessions_lock:
+        session = transfer_sessions.get(session_id)
+        if session is not None:
+            with session['lock']:
+                session['active'] += 1
+    if session is None:
+        yield None
+        return
+    try:
+        yield session
+    finally:
+        with session['lock']:
+            session['active'] -= 1
+            session['last_activity'] = time.monotonic()
+
+
+def expire_transfer_sessions():
+    """
+    Close the sessions idle for TRANSFER_SESSION_TTL_SECONDS: their staged files are
+    released and their rows kept as a closed run
+    """
+    deadline = time.monotonic() - TRANSFER_SESSION_TTL_SECONDS
+    expired = []
+    with transfer_sessions_lock:
+        for session_id, session in list(transfer_sessions.items()):
+            with session['lock']:
+                idle = (not session['active'] and session['last_activity'] < deadline
+                        and not any(thread.is_alive() for thread in session['threads']))
+            if idle:
+                expired.append((session_id, transfer_sessions.pop(session_id)))
+
+    for session_id, session in expired:
+        logger.warning(f"Transfer session {session_id} was never completed, closing it")
+        for sha256 in session['staged']:
+            release_staged_file(sha256)
+        session['stream'].close()
+
+
+def session_expiry_loop():
+    while True:
+        time.sleep(TRANSFER_SESSION_EXPIRY_CHECK_SECONDS)
+        try:
+            expire_transfer_sessions()
+        except Exception as e:
+            logger.error(f"Error expiring transfer sessions: {str(e)}")
+
+
+def start_session_expiry():
+    """
+    Start the thread closing abandoned sessions, once
+    """
+    global session_expiry_thread
+    with transfer_sessions_lock:
+        if session_expiry_thread is not None:
+            return
+        session_expiry_thread = threading.Thread(target=session_expiry_loop, daemon=True, name='session-expiry')
+    session_expiry_thread.start()
+
+
+def run_session_transfer(session, sha256, filename):
+    """
+    Transfer one staged file of a session and collect its results
+    """
+    current_job_timings.set(session['timings'])
+    current_lane.set(session['lane'])
+    if session['compare']:
+        result = check_and_transfer_file(get_staged_path(sha256), session['excel_path'], session['directory_path'],
+                                         dest_filename=filename, compare=session['compare'])
+    else:
+        result = transfer_files_to_servers(get_staged_path(sha256), session['excel_path'],
+                                           session['directory_path'], dest_filename=filename,
+                                           distribution=session['distribution'],
+                                           compression=session['compression'], engine=session['engine'])
+    with session['lock']:
+        if 'error' not in result:
+            session['stream'].extend(result['results'])
+            merge_compression_stats(session['compression_stats'], result.get('compression'))
+            if 'rollout' in result:
+                session['rollouts'].append({'file': filename, **result['rollout']})
+        else:
+            logger.error(f"Error transferring file {filename}: {result['error']}")
+            session['errors'].append(f"{filename}: {result['error']}")
+
+
+def start_session_transfer(session, sha256, filename):
+    """
+    Start the background transfer of a staged file (the caller already holds a
+    reference on it, the session takes its own)
+    """
+    acquire_staged_file(sha256)
+    thread = threading.Thread(target=run_session_transfer, args=(session, sha256, filename), daemon=True)
+    with session['lock']:
+        session['staged'].append(sha256)
+        session['threads'].append(thread)
+    thread.start()
+
+
+@app.route('/transfer-sessions', methods=['POST'])
+def create_transfer_session():
+    """Open a streamed transfer session for an inventory and directory"""
+    try:
+        data = request.get_json()
+        excel_filename = data.get('excel_file')
+        directory_path = data.get('directory_path')
+        distribution = data.get('distribution', 'direct')
+        compression = data.get('compression', 'none')
+        engine = data.get('engine', STORE_IO_ENGINE)
+        compare = data.get('compare') or None  # Only transfer where missing/different (see CHECK AND TRANSFER)
+
+        if not excel_filename:
+            return jsonify({'error': 'Please select an Excel file'}), 400
+
+        if not directory_path:
+            return jsonify({'error': 'Please specify the directory path'}), 400
+
+        if engine not in STORE_IO_ENGINES:
+            return jsonify({'error': f'Unknown engine: {engine}'}), 400
+
+        options_error = get_transfer_options_error(distribution, compression, engine)
+        if options_error:
+            return jsonify({'error': options_error}), 400
+
+        if compare is not None and compare not in PIPELINE_COMPARE_MODES:
+            return jsonify({'error': f'Unknown compare mode: {compare}'}), 400
+
+        # The check-and-transfer pipeline copies directly with its own threads
+        if compare is not None and (distribution, compression, engine) != ('direct', 'none', STORE_IO_ENGINE):
+            return jsonify({'error': 'Compare mode only supports direct distribution, '
+                                     'no compression and the default engine'}), 400
+
+        excel_path = os.path.join(app.config['DATA_FOLDER'], excel_filename)
+
+        if not os.path.exists(excel_path):
+            return jsonify({'error': f'Excel file not found: {excel_filename}'}), 400
+
+        start_session_expiry()
+        expire_transfer_sessions()
+        session_id = f"session_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+        with transfer_sessions_lock:
+            transfer_sessions[session_id] = {
+                'excel_path': excel_path,
+                'directory_path': directory_path,
+                'distribution': distribution,
+                'compression': compression,
+                'engine': engine,
+                'compare': compare,
+                'compression_stats': {'original_bytes': 0, 'sent_bytes': 0, 'ratio': None},
+                'rollouts': [],
+                'staged': [],
+                'timings': JobTimings('transfer'),
+                'lane': get_priority_lane() or JOB_LANES.get('transfer', 'bulk'),
+                'threads': [],
+                'stream': ResultStream.create('check_transfer' if compare else 'transfer', 'Status',
+                                              ('Action',) if compare else ()),
+                'errors': [],
+                'active': 0,
+                'last_activity': time.monotonic(),
+                'lock': threading.Lock()
+            }
+
+        return jsonify({'success': True, 'session_id': session_id})
+
+    except Exception as e:
+        logger.error(f"Create transfer session error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/transfer-sessions/<session_id>/files', methods=['PUT', 'POST'])
+def upload_session_file(session_id):
+    """Stream one file (raw request body) into a session and start its transfer"""
+    try:
+        filename = secure_filename(request.args.get('filename', ''))
+        if not filename:
+            return jsonify({'error': 'No file selected'}), 400
+
+        with session_activity(session_id) as session:
+            if session is None:
+                return jsonify({'error': 'Transfer session not found'}), 404
+
+            sha256, size = stage_upload_stream(request.stream)
+            logger.info(f"Received {filename} ({size} bytes) for {session_id}")
+
+            try:
+                start_session_transfer(session, sha256, filename)
+            finally:
+                # start_session_transfer took its own reference
+                release_staged_file(sha256)
+        return jsonify({'success': True, 'filename': filename, 'size': size, 'sha256': sha256})
+
+    except Exception as e:
+        logger.error(f"Session upload error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/transfer-sessions/<session_id>/staged', methods=['POST'])
+def transfer_staged_session_file(session_id):
+    """Add an already staged file (by SHA-256) to a session without uploading it again"""
+    try:
+        data = request.get_json()
+        sha256 = str(data.get('sha256', '')).lower()
+        filename = secure_filename(data.get('filename', ''))
+        if not filename:
+            return jsonify({'error': 'No file selected'}), 400
+
+        with session_activity(session_id) as session:
+            if session is None:
+                return jsonify({'error': 'Transfer session not found'}), 404
+
+            if not acquire_staged_file(sha256):
+                return jsonify({'error': 'File is not staged'}), 404
+
+            try:
+                start_session_transfer(session, sha256, filename)
+            finally:
+                # start_session_transfer took its own reference
+                release_staged_file(sha256)
+        return jsonify({'success': True, 'filename': filename, 'sha256': sha256})
+
+    except Exception as e:
+        logger.error(f"Staged session file error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/transfer-sessions/<session_id>/complete', methods=['POST'])
+def complete_transfer_session(session_id):
+    """Wait for the session's transfers, write the report and close the session"""
+    try:
+        with transfer_sessions_lock:
+            session = transfer_sessions.pop(session_id, None)
+        if session is None:
+            return jsonify({'error': 'Transfer session not found'}), 404
+
+        for thread in list(session['threads']):
+            thread.join()
+
+        # Release staged files (kept for reuse until evicted)
+        for sha256 in session['staged']:
+            release_staged_file(sha256)
+
+        stream = session['stream']
+        stream.close()
+        compression_stats = session['compression_stats']
+        if not len(stream) and session['errors']:
+            stream.discard()
+            return jsonify({'error': '; '.join(session['errors'])}), 400
+
+        # Generate report
+        report_filename = f"transfer_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+        report_path = os.path.join(app.config['REPORT_FOLDER'], report_filename)
+        with track_job('transfer', session['timings']) as timings:
+            write_stream_report(stream, report_path, 'Transfer Results')
+
+        # Calculate summary
+        total_transfers = len(stream)
+        successful = stream.count('Status', 'Success')
+        halted = stream.count('Status', 'Halted')
+        pending = stream.count('Status', PENDING_EXTRACTION_STATUS)
+        failed = total_transfers - successful - halted - pending
+
+        run_id = stream.run_id
+
+        return jsonify({
+            'success': True,
+            'timings': timings.summary(),
+            'report_file': report_filename,
+            'run_id': run_id,
+            'summary': {
+                'total': total_transfers,
+                'successful': successful,
+                'failed': failed,
+                'halted': halted,
+                'pending_extraction': pending
+            },
+            'compression': compression_stats,
+            'rollouts': session['rollouts']
+        })
+
+    except Exception as e:
+        logger.error(f"Complete transfer session error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+# ===== RUN RESULTS =====
+# Results of each check/transfer run are appended, row by row, to a JSON Lines
+# file in RESULTS_FOLDER (first line: kind, status field and columns, then one
+# JSON array of values per row). Runs keep only their counters in memory; the
+# Excel report and the paginated /results API read the rows back from the file,
+# so memory stays flat whatever the number of stores and files. Rows read back
+# are compact typed records (namedtuples of the run's columns).
+
+RESULT_COLUMNS = {
+    'check': ['CodeMag', 'IPAddress', 'FileName', 'Exists', 'FilePath', 'FileSize', 'LastModified', 'Error'],
+    'transfer': ['CodeMag', 'IPAddress', 'FileName', 'Status', 'DestinationPath', 'Source', 'Error',
+                 'CompressionRatio', 'Wave'],
+    'check_transfer': ['CodeMag', 'IPAddress', 'FileName', 'CheckStatus', 'RemoteSize', 'RemoteModified', 'Action',
+                       'Status', 'DestinationPath', 'Error']
+}
+# Left out of the report when no row has a value
+OPTIONAL_RESULT_COLUMNS = {'CompressionRatio', 'Wave'}
+
+RESULT_RECORDS = {
+    kind: namedtuple(f"{kind.title().replace('_', '')}Record", columns + ['ErrorClass'])
+    for kind, columns in RESULT_COLUMNS.items()
+}
+
+ERROR_CLASSES = ['connection', 'timeout', 'not_found', 'permission', 'other']
+
+
+def classify_error(error):
+    """
+    Map an error message to a coarse error class used for filtering
+    """
+    if not error:
+        return None
+    message = str(error).lower()
+    if 'délai' in message or 'timeout' in message or 'timed out' in message:
+        return 'timeout'
+    if 'connexion' in message or 'network' in message or 'réseau' in message:
+        return 'connection'
+    if 'not found' in message or 'introuvable' in message or 'cannot find' in message:
+        return 'not_found'
+    if 'denied' in message or 'refusé' in message or 'permission' in message:
+        return 'permission'
+    return 'other'
+
+
+def get_result_stream_path(run_id):
+    return os.path.join(app.config['RESULTS_FOLDER'], f"{secure_filename(run_id)}.jsonl")
+
+
+class ResultStream:
+    """
+    Append-only result file of one run
+    Counts the values of count_fields (the status field and e.g. Action) as rows are added
+    """
+    # Run ids of the streams still being written, never evicted
+    open_run_ids = set()
+    open_lock = threading.Lock()
+
+    def __init__(self, run_id, kind, status_field, count_fields=()):
+        self.run_id = run_id
+        self.kind = kind
+        self.status_field = status_field
+        self.columns = RESULT_COLUMNS[kind]
+        self.record_type = RESULT_RECORDS[kind]
+        self.path = get_result_stream_path(run_id)
+        self.count_fields = (status_field,) + tuple(count_fields)
+        self.counts = Counter()
+        self.total = 0
+        self.lock = threading.Lock()
+        self.file = None
+
+    @classmethod
+    def create(cls, kind, status_field, count_fields=()):
+        run_id = f"{kind}_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+        stream = cls(run_id, kind, status_field, count_fields)
+        with cls.open_lock:
+            cls.open_run_ids.add(run_id)
+        stream.file = open(stream.path, 'w', encoding='utf-8')
+        stream.file.write(json.dumps({'kind': kind, 'status_field': status_field,
+                                      'columns': stream.columns + ['ErrorClass']}) + '\n')
+        return stream
+
+    @classmethod
+    def load(cls, run_id):
+        """
+        Stream of a finished run, or None if it does not exist (anymore)
+        """
+        path = get_result_stream_path(run_id)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'r', encoding='utf-8') as f:
+            header = json.loads(f.readline())
+        return cls(run_id, header['kind'], header['status_field'])
+
+    def append(self, row):
+        values = [row.get(column) for column in self.columns]
+        values.append(classify_error(row.get('Error')))
+        line = json.dumps(values, ensure_ascii=False, default=str) + '\n'
+        with self.lock:
+            self.file.write(line)
+            self.total += 1
+            for field in self.count_fields:
+                self.counts[(field, row.get(field))] += 1
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def __len__(self):
+        return self.total
+
+    def count(self, field, value):
+        return self.counts[(field, value)]
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+        with ResultStream.open_lock:
+            ResultStream.open_run_ids.discard(self.run_id)
+        evict_result_streams()
+
+    def discard(self):
+        self.close()
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def records(self):
+        """
+        Iterate over the rows as typed records (re-reads the file on each call)
+        """
+        with open(self.path, 'r', encoding='utf-8') as f:
+            f.readline()
+            for line in f:
+                if line.strip():
+                    yield self.record_type(*json.loads(line))
+
+
+def evict_result_streams():
+    """
+    Keep the result files of the MAX_STORED_RUNS most recent runs
+    Runs still being written are kept and not counted
+    """
+    folder = app.config['RESULTS_FOLDER']
+    with ResultStream.open_lock:
+        open_paths = {get_result_stream_path(run_id) for run_id in ResultStream.open_run_ids}
+    try:
+        files = [os.path.join(folder, name) for name in os.listdir(folder) if name.endswith('.jsonl')]
+    except OSError as e:
+        logger.warning(f"Could not evict old results: {str(e)}")
+        return
+    closed = []
+    for path in files:
+        try:
+            if path not in open_paths:
+                closed.append((os.path.getmtime(path), path))
+        except OSError:
+            pass  # Removed by a concurrent eviction
+    closed.sort(reverse=True)
+    for _, path in closed[MAX_STORED_RUNS:]:
+        try:
+            os.remove(path)
+        except OSError as e:
+            logger.warning(f"Could not evict old results {path}: {str(e)}")
+
+
+def write_stream_report(stream, report_path, sheet_name):
+    """
+    Write the rows of a result stream to an Excel report with auto-adjusted column
+    widths, without loading them in memory (openpyxl write-only mode)
+    """
+    with timed_stage('report_write'):
+        # First pass: column widths, and optional columns actually used
+        widths = [len(column) for column in stream.columns]
+        used = [column not in OPTIONAL_RESULT_COLUMNS for column in stream.columns]
+        for record in stream.records():
+            for position in range(len(stream.columns)):
+                value = record[position]
+                if value is not None:
+                    used[position] = True
+                    widths[position] = max(widths[position], len(str(value)))
+        positions = [position for position in range(len(stream.columns)) if used[position]]
+
+        workbook = openpyxl.Workbook(write_only=True)
+        worksheet = workbook.create_sheet(sheet_name)
+        for index, position in enumerate(positions, start=1):
+            worksheet.column_dimensions[openpyxl.utils.get_column_letter(index)].width = min(widths[position] + 2, 50)
+
+        header = []
+        for position in positions:
+            cell = openpyxl.cell.WriteOnlyCell(worksheet, value=stream.columns[position])
+            cell.font = openpyxl.styles.Font(bold=True)
+            header.append(cell)
+        worksheet.append(header)
+
+        # Second pass: the rows
+        for record in stream.records():
+            worksheet.append([record[position] for position in positions])
+        workbook.save(report_path)
+
+
+def sort_key(value):
+    if value is None:
+        return (1, 0, '')
+    if isinstance(value, (int, float)):
+        return (0, value, '')
+    return (0, 0, str(value).lower())
+
+
+@app.route('/results/<run_id>')
+def get_run_results(run_id):
+    """Paginated, filterable and sortable results of a run"""
+    try:
+        stream = ResultStream.load(run_id)
+        if stream is None:
+            return jsonify({'error': 'Résultats introuvables ou expirés'}), 404
+
+        page = max(int(request.args.get('page', 1)), 1)
+        page_size = min(max(int(request.args.get('page_size', 50)), 1), 500)
+        status = request.args.get('status')
+        code_mag = request.args.get('code_mag', '').strip().lower()
+        error_class = request.args.get('error_class')
+        sort = request.args.get('sort')
+        order = request.args.get('order', 'asc')
+
+        if sort not in stream.record_type._fields:
+            sort = None
+
+        def matches(record):
+            if status and getattr(record, stream.status_field) != status:
+                return False
+            if code_mag and code_mag not in str(record.CodeMag or '').lower():
+                return False
+            if error_class and record.ErrorClass != error_class:
+                return False
+            return True
+
+        # Only the rows up to the requested page are kept while reading the stream
+        start = (page - 1) * page_size
+        end = start + page_size
+        total = 0
+        if sort:
+            def keyed_records():
+                nonlocal total
+                for sequence, record in enumerate(stream.records()):
+                    if matches(record):
+                        total += 1
+                        yield sort_key(getattr(record, sort)), sequence, record
+
+            if order == 'desc':
+                best = heapq.nlargest(end, keyed_records(), key=lambda item: (item[0], -item[1]))
+            else:
+                best = heapq.nsmallest(end, keyed_records(), key=lambda item: (item[0], item[1]))
+            page_records = [record for _, _, record in best[start:end]]
+        else:
+            page_records = []
+            for record in stream.records():
+                if matches(record):
+                    if start <= total < end:
+                        page_records.append(record)
+                    total += 1
+
+        return jsonify({
+            'success': True,
+            'total': total,
+            'page': page,
+            'page_size': page_size,
+            'pages': max((total + page_size - 1) // page_size, 1),
+            'results': [record._asdict() for record in page_records]
+        })
+
+    except ValueError:
+        return jsonify({'error': 'Invalid pagination parameters'}), 400
+    except Exception as e:
+        logger.error(f"Get run results error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+# ===== INVENTORY SNAPSHOTS =====
+# A snapshot records the files present in one directory on every store of an
+# inventory, so that two runs can be compared instead of re-reading full tables.
+
+def load_stores_from_excel(excel_path):
+    """
+    Read the store inventory from an Excel file
+    The optional Region and Seed columns are used by the relay distribution,
+    the optional Canary column by the wave rollout
+    Returns: dict with the list of stores (CodeMag, ipaddress, Region, Seed, Canary) or an error
+    """
+    try:
+        with timed_stage('inventory_load'):
+            df = pd.read_excel(excel_path)
+
+        if 'CodeMag' not in df.columns or 'ipaddress' not in df.columns:
+            return {'error': 'Excel must contain "CodeMag" and "ipaddress" columns'}
+
+        has_region = 'Region' in df.columns
+        has_seed = 'Seed' in df.columns
+        has_canary = 'Canary' in df.columns
+
+        stores = []
+        for _, row in df.iterrows():
+            region = row['Region'] if has_region else None
+            stores.append({
+                'CodeMag': str(row['CodeMag']),
+                'ipaddress': str(row['ipaddress']),
+                'Region': str(region).strip() if region is not None and not pd.isna(region) else None,
+                'Seed': has_seed and str(row['Seed']).strip().lower() in SEED_VALUES,
+                'Canary': has_canary and str(row['Canary']).strip().lower() in SEED_VALUES
+            })
+
+        return {'success': True, 'stores': stores}
+
+    except Exception as e:
+        logger.error(f"Error reading inventory {excel_path}: {str(e)}")
+        return {'error': str(e)}
+
+
+def compute_file_hash(file_path, chunk_size=1024 * 1024, opener=open):
+    """
+    Compute the SHA-256 of a file, reading it in chunks
+    opener opens the file (get_share_backend().open for files on the stores)
+    """
+    sha256 = hashlib.sha256()
+    with opener(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def list_remote_directory(ip_address, directory_path, include_hash=False, previous_files=None,
+                          username=None, password=None):
+    """
+    List the files of a directory on a store with their metadata
+    Hashes are reused from previous_files when size and mtime did not change
+    Returns: dict with files ({name: {size, mtime, hash}}) and error
+    """
+    try:
+        username, password = get_credentials(username, password)
+
+        if username and password:
+            connection_result = connect_to_network_share(ip_address, username, password)
+
+            if not connection_result['success']:
+                return {'files': {}, 'error': f"Échec de connexion: {connection_result['message']}"}
+
+        network_path = get_network_path(ip_address, directory_path)
+        previous_files = previous_files or {}
+        files = {}
+        backend = get_share_backend()
+
+        with store_slot(ip_address), timed_stage('list', ip_address), \
+                closing(backend.scandir(network_path)) as entries:
+            for entry in entries:
+                if not entry.is_file():
+                    continue
+
+                stat = entry.stat()
+                file_info = {
+                    'size': stat.st_size,
+                    'mtime': datetime.fromtimestamp(stat.st_mtime).strftime('%Y-%m-%d %H:%M:%S'),
+                    'hash': None
+                }
+
+                if include_hash:
+                    previous = previous_files.get(entry.name)
+                    if (previous and previous.get('hash')
+                            and previous['size'] == file_info['size']
+                            and previous['mtime'] == file_info['mtime']):
+                        file_info['hash'] = previous['hash']
+                    else:
+                        file_info['hash'] = compute_file_hash(get_network_path(ip_address, directory_path, entry.name),
+                                                              opener=backend.open)
+
+                files[entry.name] = file_info
+
+        return {'files': files, 'error': None}
+
+    except Exception as e:
+        logger.error("Error listing %s/%s: %s", ip_address, directory_path, e,
+                     extra={'store': ip_address, 'stage': 'list'})
+        return {'files': {}, 'error': str(e)}
+
+
+def get_snapshot_path(snapshot_id):
+    return os.path.join(app.config['SNAPSHOT_FOLDER'], f"{secure_filename(snapshot_id)}.json")
+
+
+def save_snapshot(snapshot):
+    with open(get_snapshot_path(snapshot['id']), 'w', encoding='utf-8') as f:
+        json.dump(snapshot, f, ensure_ascii=False, indent=1)
+
+
+def load_snapshot(snapshot_id):
+    """
+    Load a snapshot by id, returns None if it does not exist
+    """
+    snapshot_path = get_snapshot_path(snapshot_id)
+    if not os.path.exists(snapshot_path):
+        return None
+    with open(snapshot_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def list_snapshots():
+    """
+    List snapshot metadata, most recent first
+    """
+    snapshots = []
+    for file in os.listdir(app.config['SNAPSHOT_FOLDER']):
+        if not file.endswith('.json'):
+            continue
+        try:
+            snapshot = load_snapshot(file[:-len('.json')])
+            snapshots.append({
+                'id': snapshot['id'],
+                'created_at': snapshot['created_at'],
+                'excel_file': snapshot['excel_file'],
+                'directory_path': snapshot['directory_path'],
+                'include_hash': snapshot['include_hash'],
+                'store_count': len(snapshot['stores'])
+            })
+        except Exception as e:
+            logger.error(f"Error reading snapshot {file}: {str(e)}")
+    snapshots.sort(key=lambda s: s['created_at'], reverse=True)
+    return snapshots
+
+
+def find_latest_snapshot(excel_filename, directory_path):
+    """
+    Find the most recent snapshot taken for the same inventory and directory
+    """
+    for meta in list_snapshots():
+        if meta['excel_file'] == excel_filename and meta['directory_path'] == directory_path:
+            return load_snapshot(meta['id'])
+    return None
+
+
+def take_inventory_snapshot(excel_filename, directory_path, include_hash=False, username=None, password=None):
+    """
+    Record the files of a directory on every store of an inventory
+    Hashes are only recomputed for files that changed since the previous snapshot
+    """
+    try:
+        excel_path = os.path.join(app.config['DATA_FOLDER'], excel_filename)
+        inventory = load_stores_from_excel(excel_path)
+
+        if 'error' in inventory:
+            return {'error': inventory['error']}
+
+        previous = find_latest_snapshot(excel_filename, directory_path)
+        previous_stores = previous['stores'] if previous else {}
+
+        now = datetime.now()
+        snapshot = {
+            'id': f"snapshot_{now.strftime('%Y%m%d_%H%M%S_%f')}",
+            'created_at': now.strftime('%Y-%m-%d %H:%M:%S'),
+            'excel_file': excel_filename,
+            'directory_path': directory_path,
+            'include_hash': include_hash,
+            'stores': {}
+        }
+
+        total = len(inventory['stores'])
+        for index, store in enumerate(inventory['stores']):
+            code_mag = store['CodeMag']
+            previous_files = previous_stores.get(code_mag, {}).get('files')
+            listing = list_remote_directory(store['ipaddress'], directory_path, include_hash,
+                                            previous_files, username, password)
+
+            snapshot['stores'][code_mag] = {
+                'ip': store['ipaddress'],
+                'files': listing['files'],
+                'error': listing['error']
+            }
+
+            logger.info("Snapshot %d/%d: %s - %d file(s)", index + 1, total, code_mag, len(listing['files']),
+                        extra={'store': store['ipaddress']})
+
+        save_snapshot(snapshot)
+        return {'success': True, 'snapshot': snapshot, 'previous': previous}
+
+    except Exception as e:
+        logger.error(f"Error taking snapshot: {str(e)}")
+        return {'error': str(e)}
+
+
+def diff_snapshots(old, new):
+    """
+    Compare two snapshots store by store
+    Returns: dict with a summary and the list of stores that changed
+    """
+    old_stores = old['stores'] if old else {}
+    new_stores = new['stores']
+    compare_hash = bool(old and old['include_hash'] and new['include_hash'])
+
+    changes = []
+    summary = {'stores_changed': 0, 'added': 0, 'removed': 0, 'modified': 0, 'errors': 0}
+
+    for code_mag in sorted(set(old_stores) | set(new_stores)):
+        old_store = old_stores.get(code_mag)
+        new_store = new_stores.get(code_mag)
+
+        if new_store is None:
+            changes.append({'CodeMag': code_mag, 'IPAddress': old_store['ip'], 'Status': 'Store removed',
+                            'Added': [], 'Removed': [], 'Modified': [], 'Error': None})
+            summary['stores_changed'] += 1
+            continue
+
+        if new_store['error']:
+            changes.append({'CodeMag': code_mag, 'IPAddress': new_store['ip'], 'Status': 'Error',
+                            'Added': [], 'Removed': [], 'Modified': [], 'Error': new_store['error']})
+            summary['errors'] += 1
+            summary['stores_changed'] += 1
+            continue
+
+        old_files = old_store['files'] if old_store and not old_store['error'] else {}
+        new_files = new_store['files']
+
+        added = sorted(set(new_files) - set(old_files))
+        removed = sorted(set(old_files) - set(new_files))
+        modified = []
+        for name in sorted(set(old_files) & set(new_files)):
+            before, after = old_files[name], new_files[name]
+            if compare_hash:
+                if before['hash'] != after['hash']:
+                    modified.append(name)
+            elif before['size'] != after['size'] or before['mtime'] != after['mtime']:
+                modified.append(name)
+
+        if old_store is None:
+            status = 'New store'
+        elif added or removed or modified:
+            status = 'Changed'
+        else:
+            continue
+
+        changes.append({'CodeMag': code_mag, 'IPAddress': new_store['ip'], 'Status': status,
+                        'Added': added, 'Removed': removed, 'Modified': modified, 'Error': None})
+        summary['stores_changed'] += 1
+        summary['added'] += len(added)
+        summary['removed'] += len(removed)
+        summary['modified'] += len(modified)
+
+    return {'summary': summary, 'changes': changes}
+
+
+@app.route('/snapshots', methods=['GET'])
+def get_snapshots():
+    """List stored inventory snapshots"""
+    try:
+        return jsonify({'success': True, 'snapshots': list_snapshots()})
+    except Exception as e:
+        logger.error(f"List snapshots error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/snapshots', methods=['POST'])
+@job_route('snapshot')
+def create_snapshot():
+    """Take a new snapshot and diff it against the previous one for the same inventory and directory"""
+    try:
+        data = request.get_json()
+        excel_filename = data.get('excel_file')
+        directory_path = data.get('directory_path')
+        include_hash = bool(data.get('include_hash', False))
+
+        if not excel_filename:
+            return jsonify({'error': 'Veuillez sélectionner un fichier Excel'}), 400
+
+        if not directory_path:
+            return jsonify({'error': 'Veuillez spécifier le chemin du répertoire'}), 400
+
+        if not os.path.exists(os.path.join(app.config['DATA_FOLDER'], excel_filename)):
+            return jsonify({'error': f'Fichier Excel non trouvé: {excel_filename}'}), 400
+
+        result = take_inventory_snapshot(excel_filename, directory_path, include_hash)
+
+        if 'error' in result:
+            return jsonify({'error': result['error']}), 400
+
+        previous = result['previous']
+        diff = diff_snapshots(previous, result['snapshot'])
+
+        return jsonify({
+            'success': True,
+            'timings': current_job_timings.get().summary(),
+            'snapshot_id': result['snapshot']['id'],
+            'previous_snapshot_id': previous['id'] if previous else None,
+            'summary': diff['summary'],
+            'changes': diff['changes']
+        })
+
+    except Exception as e:
+        logger.error(f"Create snapshot error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/snapshots/diff')
+def get_snapshot_diff():
+    """Diff two stored snapshots"""
+    try:
+        old_id = request.args.get('old')
+        new_id = request.args.get('new')
+
+        if not old_id or not new_id:
+            return jsonify({'error': 'Parameters "old" and "new" are required'}), 400
+
+        old = load_snapshot(old_id)
+        new = load_snapshot(new_id)
+
+        if old is None or new is None:
+            return jsonify({'error': 'Snapshot not found'}), 404
+
+        diff = diff_snapshots(old, new)
+        return jsonify({'success': True, 'summary': diff['summary'], 'changes': diff['changes']})
+
+    except Exception as e:
+        logger.error(f"Snapshot diff error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+# ===== SCHEDULED CHECKS =====
+# Recurring check jobs run in a background thread. On each run only the stores
+# whose last result is older than the freshness window, or that failed last
+# time, are checked again; the others keep their previous result.
+
+scheduled_jobs = {}
+running_scheduled_jobs = set()  # Ids of the jobs being run, by the scheduler or on demand
+scheduled_jobs_lock = threading.Lock()
+scheduler_stop_event = threading.Event()
+
+
+def get_scheduled_jobs_path():
+    return os.path.join(app.config['SCHEDULE_FOLDER'], 'jobs.json')
+
+
+def get_job_history_path(job_id):
+    return os.path.join(app.config['SCHEDULE_FOLDER'], f"{secure_filename(job_id)}_history.jsonl")
+
+
+def save_scheduled_jobs():
+    """
+    Persist job definitions and per-store state (caller holds scheduled_jobs_lock)
+    """
+    with open(get_scheduled_jobs_path(), 'w', encoding='utf-8') as f:
+        json.dump(scheduled_jobs, f, ensure_ascii=False, indent=1)
+
+
+def load_scheduled_jobs():
+    """
+    Load persisted jobs at startup
+    """
+    jobs_path = get_scheduled_jobs_path()
+    if not os.path.exists(jobs_path):
+        return
+    try:
+        with open(jobs_path, 'r', encoding='utf-8') as f:
+            jobs = json.load(f)
+        with scheduled_jobs_lock:
+            scheduled_jobs.update(jobs)
+        logger.info(f"Loaded {len(jobs)} scheduled job(s)")
+    except Exception as e:
+        logger.error(f"Error loading scheduled jobs: {str(e)}")
+
+
+def is_store_result_stale(state, freshness_minutes, now):
+    """
+    A store/file result must be re-checked if it is missing, failed or too old
+    """
+    if state is None or not state['exists'] or state['error']:
+        return True
+    checked_at = datetime.strptime(state['checked_at'], '%Y-%m-%d %H:%M:%S')
+    return (now - checked_at).total_seconds() > freshness_minutes * 60
+
+
+def run_scheduled_job(job_id, claimed=False):
+    """
+    Re-check the stale stores of a job and append a trend entry to its history
+    claimed: the caller already added job_id to running_scheduled_jobs
+    A job is never run twice at once
+    """
+    with scheduled_jobs_lock:
+        job = scheduled_jobs.get(job_id)
+        if not claimed:
+            if job is None:
+                return {'error': 'Job not found'}
+            if job_id in running_scheduled_jobs:
+                return {'error': 'Job already running'}
+            running_scheduled_jobs.add(job_id)
+        if job is None:
+            running_scheduled_jobs.discard(job_id)
+            return {'error': 'Job not found'}
+        job = json.loads(json.dumps(job))
+
+    try:
+        with track_job('scheduled_check') as timings:
+            excel_path = os.path.join(app.config['DATA_FOLDER'], job['excel_file'])
+            inventory = load_stores_from_excel(excel_path)
+
+            if 'error' in inventory:
+                return {'error': inventory['error']}
+
+            now = datetime.now()
+            store_state = job['store_state']
+            checked = 0
+            skipped = 0
+
+            for store in inventory['stores']:
+                code_mag = store['CodeMag']
+                file_states = store_state.setdefault(code_mag, {})
+
+                for filename in job['filenames']:
+                    if not is_store_result_stale(file_states.get(filename), job['freshness_minutes'], now):
+                        skipped += 1
+                        continue
+
+                    result = check_file_exists(store['ipaddress'], job['directory_path'], filename)
+                    file_states[filename] = {
+                        'ip': store['ipaddress'],
+                        'exists': result['exists'],
+                        'size': result['size'],
+                        'modified': result['modified'],
+                        'error': result['error'],
+                        'checked_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+                    }
+                    checked += 1
+
+            # Drop stores that are no longer in the inventory
+            current_codes = {store['CodeMag'] for store in inventory['stores']}
+            for code_mag in list(store_state):
+                if code_mag not in current_codes:
+                    del store_state[code_mag]
+
+            states = [state for file_states in store_state.values() for state in file_states.values()]
+            found = sum(1 for state in states if state['exists'])
+            entry = {
+                'run_at': now.strftime('%Y-%m-%d %H:%M:%S'),
+                'total': len(states),
+                'found': found,
+                'not_found': len(states) - found,
+                'checked': checked,
+                'skipped': skipped,
+                'seconds': round(time.perf_counter() - timings.started, 3)
+            }
+
+            with open(get_job_history_path(job_id), 'a', encoding='utf-8') as f:
+                f.write(json.dumps(entry) + '\n')
+
+            with scheduled_jobs_lock:
+                if job_id in scheduled_jobs:
+                    scheduled_jobs[job_id]['store_state'] = store_state
+                    scheduled_jobs[job_id]['last_run_at'] = entry['run_at']
+                    save_scheduled_jobs()
+
+            logger.info(f"Scheduled job {job_id}: checked {checked}, skipped {skipped} fresh result(s)")
+            return {'success': True, 'entry': entry}
+
+    except Exception as e:
+        logger.error(f"Error running scheduled job {job_id}: {str(e)}")
+        return {'error': str(e)}
+    finally:
+        with scheduled_jobs_lock:
+            running_scheduled_jobs.discard(job_id)
+
+
+def scheduler_loop():
+    """
+    Background loop running the jobs that are due
+    """
+    logger.info("Scheduler started")
+    while not scheduler_stop_event.is_set():
+        now = datetime.now()
+        due_jobs = []
+
+        with scheduled_jobs_lock:
+            for job_id, job in scheduled_jobs.items():
+                if not job['enabled'] or job_id in running_scheduled_jobs:
+                    continue
+                last_run = job['last_run_at']
+                if (last_run is None or (now - datetime.strptime(last_run, '%Y-%m-%d %H:%M:%S')).total_seconds()
+                        >= job['interval_minutes'] * 60):
+                    due_jobs.append(job_id)
+
+        for job_id in due_jobs:
+            run_scheduled_job(job_id)
+
+        scheduler_stop_event.wait(SCHEDULER_TICK_SECONDS)
+
+
+def start_scheduler():
+    load_scheduled_jobs()
+    threading.Thread(target=scheduler_loop, daemon=True, name='scheduler').start()
+
+
+def serialize_scheduled_job(job):
+    return {key: value for key, value in job.items() if key != 'store_state'}
+
+
+@app.route('/scheduled-jobs', methods=['GET'])
+def get_scheduled_jobs():
+    """List scheduled check jobs"""
+    try:
+        with scheduled_jobs_lock:
+            jobs = [serialize_scheduled_job(job) for job in scheduled_jobs.values()]
+        return jsonify({'success': True, 'jobs': jobs})
+    except Exception as e:
+        logger.error(f"List scheduled jobs error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/scheduled-jobs', methods=['POST'])
+def create_scheduled_job():
+    """Create a recurring check job"""
+    try:
+        data = request.get_json()
+        excel_filename = data.get('excel_file')
+        directory_path = data.get('directory_path')
+        filenames = data.get('filenames') or []
+        if isinstance(filenames, str):
+            filenames = [name.strip() for name in filenames.split(',')]
+        filenames = [name for name in filenames if name]
+
+        if not excel_filename:
+            return jsonify({'error': 'Veuillez sélectionner un fichier Excel'}), 400
+
+        if not directory_path:
+            return jsonify({'error': 'Veuillez spécifier le chemin du répertoire'}), 400
+
+        if not filenames:
+            return jsonify({'error': 'Veuillez spécifier au moins un fichier à vérifier'}), 400
+
+        if not os.path.exists(os.path.join(app.config['DATA_FOLDER'], excel_filename)):
+            return jsonify({'error': f'Fichier Excel non trouvé: {excel_filename}'}), 400
+
+        interval_minutes = float(data.get('interval_minutes', 60))
+        freshness_minutes = float(data.get('freshness_minutes', interval_minutes))
+
+        if interval_minutes <= 0 or freshness_minutes < 0:
+            return jsonify({'error': 'Invalid interval or freshness window'}), 400
+
+        now = datetime.now()
+        job = {
+            'id': f"job_{now.strftime('%Y%m%d_%H%M%S_%f')}",
+            'excel_file': excel_filename,
+            'directory_path': directory_path,
+            'filenames': filenames,
+            'interval_minutes': interval_minutes,
+            'freshness_minutes': freshness_minutes,
+            'enabled': True,
+            'created_at': now.strftime('%Y-%m-%d %H:%M:%S'),
+            'last_run_at': None,
+            'store_state': {}
+        }
+
+        with scheduled_jobs_lock:
+            scheduled_jobs[job['id']] = job
+            save_scheduled_jobs()
+
+        return jsonify({'success': True, 'job': serialize_scheduled_job(job)})
+
+    except Exception as e:
+        logger.error(f"Create scheduled job error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/scheduled-jobs/<job_id>', methods=['DELETE'])
+def delete_scheduled_job(job_id):
+    """Delete a scheduled job"""
+    try:
+        with scheduled_jobs_lock:
+            if job_id not in scheduled_jobs:
+                return jsonify({'error': 'Job not found'}), 404
+            del scheduled_jobs[job_id]
+            save_scheduled_jobs()
+        return jsonify({'success': True})
+    except Exception as e:
+        logger.error(f"Delete scheduled job error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/scheduled-jobs/<job_id>/run', methods=['POST'])
+def run_scheduled_job_now(job_id):
+    """Run a scheduled job immediately in the background"""
+    with scheduled_jobs_lock:
+        if job_id not in scheduled_jobs:
+            return jsonify({'error': 'Job not found'}), 404
+        if job_id in running_scheduled_jobs:
+            return jsonify({'error': 'Job already running'}), 409
+        running_scheduled_jobs.add(job_id)
+    threading.Thread(target=run_scheduled_job, args=(job_id, True), daemon=True).start()
+    return jsonify({'success': True, 'message': 'Job started'})
+
+
+@app.route('/scheduled-jobs/<job_id>/history')
+def get_scheduled_job_history(job_id):
+    """Trend entries and latest per-store results of a scheduled job"""
+    try:
+        with scheduled_jobs_lock:
+            job = scheduled_jobs.get(job_id)
+            if job is None:
+                return jsonify({'error': 'Job not found'}), 404
+            store_state = json.loads(json.dumps(job['store_state']))
+
+        history = []
+        history_path = get_job_history_path(job_id)
+        if os.path.exists(history_path):
+            with open(history_path, 'r', encoding='utf-8') as f:
+                history = [json.loads(line) for line in f if line.strip()]
+
+        return jsonify({'success': True, 'history': history, 'stores': store_state})
+
+    except Exception as e:
+        logger.error(f"Scheduled job history error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+# ===== CHECK AND TRANSFER =====
+# One pass instead of a check followed by a transfer to every store: check threads
+# stream the stores where the file is missing or different into a queue that
+# transfer threads consume as results arrive, so copies start with the first
+# finding and stores already up to date are never copied to. The share connection
+# opened by the check is reused by the copy. compare='size' treats a file of the
+# same size as up to date, compare='hash' also compares SHA-256 (reads the remote
+# file when the sizes match). Each store gets one combined row.
+
+def build_pipeline_row(store, filename, check_result, check_status, action, transfer_result=None):
+    """
+    Combined check + transfer report row for one store
+    """
+    error = None
+    if transfer_result is not None:
+        error = transfer_result['Error']
+    elif check_status == 'Error':
+        error = check_result['error']
+    
+    return {
+        'CodeMag': store['CodeMag'],
+        'IPAddress': store['ipaddress'],
+        'FileName': filename,
+        'CheckStatus': check_status,
+        'RemoteSize': check_result['size'],
+        'RemoteModified': check_result['modified'],
+        'Action': action,
+        'Status': 'Success' if action in ('Up to date', 'Transferred') else 'Failed',
+        'DestinationPath': transfer_result['DestinationPath'] if transfer_result else check_result['path'],
+        'Error': error
+    }
+
+
+def get_check_status(check_result, local_size, local_hash, ip_address):
+    """
+    'Present', 'Missing', 'Different' or 'Error' for a store's copy of the file
+    """
+    if check_result['exists']:
+        if check_result['size'] != local_size:
+            return 'Different'
+        if local_hash:
+            # Reads the whole remote file: takes a store slot like any other store I/O
+            with store_slot(ip_address), timed_stage('hash', ip_address):
+                remote_hash = compute_file_hash(check_result['path'], opener=get_share_backend().open)
+            if remote_hash != local_hash:
+                return 'Different'
+        return 'Present'
+    if check_result['error'] == 'File not found':
+        return 'Missing'
+    return 'Error'
+
+
+def check_and_transfer_file(file_path, servers_excel, directory_path, username=None, password=None,
+                            dest_filename=None, compare='size'):
+    """
+    Check every store and transfer the file only where it is missing or different
+    Uses default credentials if none provided
+    Returns: dict with one combined row per store
+    """
+    try:
+        username, password = get_credentials(username, password)
+        
+        inventory = load_stores_from_excel(servers_excel)
+        if 'error' in inventory:
+            return {'error': inventory['error']}
+        
+        stores = inventory['stores']
+        filename = dest_filename or os.path.basename(file_path)
+        local_size = os.path.getsize(file_path)
+        local_hash = compute_file_hash(file_path) if compare == 'hash' else None
+        
+        rows = [None] * len(stores)
+        to_transfer = queue.Queue(maxsize=PIPELINE_TRANSFER_WORKERS * 4)
+        
+        def check_store(index, store):
+            try:
+                check_result = check_file_exists(store['ipaddress'], directory_path, filename, username, password)
+            except Exception as e:
+                # One failing store must not lose the rows of the others
+                logger.error(f"Check of {store['ipaddress']} failed: {str(e)}", extra={'store': store['ipaddress']})
+                check_result = {
+                    'exists': False,
+                    'path': get_network_path(store['ipaddress'], directory_path, filename),
+                    'size': None,
+                    'modified': None,
+                    'error': str(e)
+                }
+            try:
+                check_status = get_check_status(check_result, local_size, local_hash, store['ipaddress'])
+            except Exception as e:
+                check_result = dict(check_result, error=str(e))
+                check_status = 'Error'
+            
+            if check_status in ('Missing', 'Different'):
+                to_transfer.put((index, store, check_result, check_status))
+            elif check_status == 'Present':
+                rows[index] = build_pipeline_row(store, filename, check_result, check_status, 'Up to date')
+            else:
+                rows[index] = build_pipeline_row(store, filename, check_result, check_status, 'Not attempted')
+        
+        def transfer_worker():
+            while True:
+                item = to_transfer.get()
+                if item is None:
+                    return
+                index, store, check_result, check_status = item
+                try:
+                    transfer_result = transfer_file_to_store(file_path, store['CodeMag'], store['ipaddress'],
+                                                             directory_path, filename, username, password)
+                except Exception as e:
+                    # A dead worker would leave the queue full and the check threads blocked
+                    logger.error(f"Transfer to {store['ipaddress']} failed: {str(e)}",
+                                 extra={'store': store['ipaddress']})
+                    transfer_result = {'Status': 'Failed', 'Error': str(e),
+                                       'DestinationPath': check_result['path']}
+                action = 'Transferred' if transfer_result['Status'] == 'Success' else 'Failed'
+                rows[index] = build_pipeline_row(store, filename, check_result, check_status, action,
+                                                 transfer_result)
+                logger.info("%s %s to %s - %s (%s)", action, filename, store['CodeMag'], store['ipaddress'],
+                            check_status.lower(), extra={'store': store['ipaddress']})
+        
+        transfer_threads = [threading.Thread(target=contextvars.copy_context().run, args=(transfer_worker,),
+                                             daemon=True)
+                            for _ in range(PIPELINE_TRANSFER_WORKERS)]
+        for thread in transfer_threads:
+            thread.start()
+        
+        try:
+            with ThreadPoolExecutor(max_workers=PIPELINE_CHECK_WORKERS) as executor:
+                futures = [submit_with_context(executor, check_store, index, store)
+                           for index, store in enumerate(stores)]
+                for future in futures:
+                    future.result()
+        finally:
+            for _ in transfer_threads:
+                to_transfer.put(None)
+            for thread in transfer_threads:
+                thread.join()
+        
+        return {'success': True, 'results': rows}
+    
+    except Exception as e:
+        logger.error(f"Error in check and transfer: {str(e)}")
+        return {'error': str(e)}
+
+
+@app.route('/check-and-transfer', methods=['POST'])
+@job_route('check_transfer')
+def check_and_transfer():
+    """Check every store and transfer the uploaded files only where missing or different"""
+    try:
+        if 'files_to_transfer' not in request.files:
+            return jsonify({'error': 'No files uploaded'}), 400
+        
+        files = [file for file in request.files.getlist('files_to_transfer') if file.filename != '']
+        excel_filename = request.form.get('excel_file')
+        directory_path = request.form.get('directory_path')
+        compare = request.form.get('compare', 'size')
+        
+        if len(files) == 0:
+            return jsonify({'error': 'No files selected'}), 400
+        
+        if not excel_filename:
+            return jsonify({'error': 'Please select an Excel file'}), 400
+        
+        if not directory_path:
+            return jsonify({'error': 'Please specify the directory path'}), 400
+        
+        if compare not in PIPELINE_COMPARE_MODES:
+            return jsonify({'error': f'Unknown compare mode: {compare}'}), 400
+        
+        excel_path = os.path.join(app.config['DATA_FOLDER'], excel_filename)
+        
+        if not os.path.exists(excel_path):
+            return jsonify({'error': f'Excel file not found: {excel_filename}'}), 400
+        
+        staged_files = []
+        stream = None
+        try:
+            # A failed upload releases the files staged before it
+            for file in files:
+                sha256, size = stage_upload_stream(file.stream)
+                staged_files.append((sha256, secure_filename(file.filename)))
+            
+            stream = ResultStream.create('check_transfer', 'Status', ('Action',))
+            for sha256, filename in staged_files:
+                result = check_and_transfer_file(get_staged_path(sha256), excel_path, directory_path,
+                                                 dest_filename=filename, compare=compare)
+                if 'error' not in result:
+                    stream.extend(result['results'])
+                else:
+                    logger.error(f"Error checking/transferring file {filename}: {result['error']}")
+        finally:
+            if stream is not None:
+                stream.close()
+            for sha256, filename in staged_files:
+                release_staged_file(sha256)
+        
+        report_filename = f"check_transfer_report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.xlsx"
+        report_path = os.path.join(app.config['REPORT_FOLDER'], report_filename)
+        write_stream_report(stream, report_path, 'Check and Transfer')
+        
+        return jsonify({
+            'success': True,
+            'timings': current_job_timings.get().summary(),
+            'report_file': report_filename,
+            'run_id': stream.run_id,
+            'summary': {
+                'total': len(stream),
+                'up_to_date': stream.count('Action', 'Up to date'),
+                'transferred': stream.count('Action', 'Transferred'),
+                'failed': stream.count('Status', 'Failed')
+            }
+        })
+    
+    except Exception as e:
+        logger.error(f"Check and transfer error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+# ===== METADATA CACHE =====
+# Operators re-run the same check while waiting for a deployment to land. With a
+# cache mode other than 'off', existence checks keep their result per (host, path)
+# in an LRU of METADATA_CACHE_MAX_ENTRIES entries:
+#   on      - reuse any result younger than METADATA_CACHE_TTL_SECONDS
+#   missing - only re-check stores where the file was not there yet (files found
+#             are trusted for METADATA_CACHE_FOUND_TTL_SECONDS)
+#   refresh - ignore cached results but store the new ones
+# Cache hits skip both the connection and the stat calls. Errors are never cached.
+# The cache lives in this process (sync and async engines).
+
+metadata_cache = OrderedDict()  # (host, path) -> (stored at, result)
+metadata_cache_lock = threading.Lock()
+current_cache_mode = contextvars.ContextVar('metadata_cache_mode', default='off')
+
+metrics.describe('filechecker_metadata_cache_total', 'counter', 'Metadata cache lookups, by result')
+
+
+def get_metadata_cache_key(ip_address, directory_path, filename):
+    # Windows paths are case-insensitive
+    return ip_address.lower(), os.path.normpath(os.path.join(directory_path, filename)).lower()
+
+
+def get_cached_file_metadata(ip_address, directory_path, filename):
+    """
+    Cached check result to reuse under the current cache mode, else None
+    """
+    mode = current_cache_mode.get()
+    if mode in ('off', 'refresh'):
+        return None
+    
+    key = get_metadata_cache_key(ip_address, directory_path, filename)
+    with metadata_cache_lock:
+        entry = metadata_cache.get(key)
+        if entry is not None:
+            metadata_cache.move_to_end(key)
+    
+    result = None
+    if entry is not None:
+        stored_at, cached = entry
+        age = time.monotonic() - stored_at
+        if mode == 'on' and age <= METADATA_CACHE_TTL_SECONDS:
+            result = cached
+        elif mode == 'missing' and cached['exists'] and age <= METADATA_CACHE_FOUND_TTL_SECONDS:
+            result = cached
+    
+    metrics.inc('filechecker_metadata_cache_total', result='hit' if result else 'miss')
+    if result is None:
+        return None
+    
+    timings = current_job_timings.get()
+    if timings is not None:
+        timings.record('cache_hit', 0.0)
+    return dict(result)
+
+
+def cache_file_metadata(ip_address, directory_path, filename, result):
+    """
+    Remember a check result when the cache is enabled
+    """
+    if current_cache_mode.get() == 'off':
+        return
+    
+    key = get_metadata_cache_key(ip_address, directory_path, filename)
+    with metadata_cache_lock:
+        metadata_cache[key] = (time.monotonic(), dict(result))
+        metadata_cache.move_to_end(key)
+        while len(metadata_cache) > METADATA_CACHE_MAX_ENTRIES:
+            metadata_cache.popitem(last=False)
+
+
+@app.route('/metadata-cache', methods=['GET'])
+def get_metadata_cache_info():
+    """Size and settings of the metadata cache"""
+    with metadata_cache_lock:
+        entries = len(metadata_cache)
+    return jsonify({
+        'success': True,
+        'entries': entries,
+        'max_entries': METADATA_CACHE_MAX_ENTRIES,
+        'ttl_seconds': METADATA_CACHE_TTL_SECONDS,
+        'found_ttl_seconds': METADATA_CACHE_FOUND_TTL_SECONDS,
+        'default_mode': METADATA_CACHE_MODE
+    })
+
+
+@app.route('/metadata-cache', methods=['DELETE'])
+def clear_metadata_cache():
+    """Forget every cached check result"""
+    with metadata_cache_lock:
+        cleared = len(metadata_cache)
+        metadata_cache.clear()
+    logger.info(f"Metadata cache cleared ({cleared} entries)")
+    return jsonify({'success': True, 'cleared': cleared})
+
+
+# ===== ASYNC STORE ENGINE =====
+# With the sync engine every in-flight store holds an OS thread while net use and
+# the share calls block. The async engine runs net use as asyncio subprocesses and
+# hands the blocking filesystem calls (stat, makedirs, copy) to a bounded thread
+# pool, so thousands of stores can be in flight with ASYNC_FS_WORKERS threads.
+# Each call to run_async_engine runs its own event loop in the calling thread.
+
+def run_async_engine(coroutine):
+    """
+    Run an async engine coroutine to completion from synchronous code
+    """
+    async def runner():
+        loop = asyncio.get_running_loop()
+        executor = ThreadPoolExecutor(max_workers=ASYNC_FS_WORKERS, thread_name_prefix='store-io')
+        loop.set_default_executor(executor)
+        return await coroutine
+
+    # asyncio.run copies the current context, so stages still land in the job timings
+    return asyncio.run(runner())
+
+
+async def run_blocking(fn, *args):
+    """
+    Run a blocking call on the engine's filesystem pool (keeps the job timings)
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(None, contextvars.copy_context().run, fn, *args)
+
+
+async def run_net_use(*args, timeout=None):
+    """
+    Run net use without a shell
+    Returns: tuple (returncode, stdout, stderr)
+    """
+    process = await asyncio.create_subprocess_exec(
+        'net', 'use', *args,
+        stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE
+    )
+    try:
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        process.kill()
+        await process.wait()
+        raise
+    return process.returncode, stdout.decode(errors='replace'), stderr.decode(errors='replace')
+
+
+async def connect_to_network_share_async(ip_address, username=None, password=None):
+    """
+    Async version of connect_to_network_share
+    Returns: dict with success status and message
+    """
+    if get_share_backend().name != 'netuse':
+        # The other backends have no subprocess to wait for
+        return await run_blocking(connect_to_network_share, ip_address, username, password)
+    
+    try:
+        username, password = get_credentials(username, password)
+        network_path = get_network_path(ip_address)
+        
+        connection_key = f"{ip_address}_{username}" if username else ip_address
+        if connection_key in active_connections:
+            logger.debug("Already connected to %s", network_path, extra={'store': ip_address, 'stage': 'connect'})
+            return {'success': True, 'message': 'Déjà connecté'}
+        
+        async with store_slot_async(ip_address):
+            with timed_stage('connect', ip_address):
+                await run_net_use(network_path, '/delete', '/y')
+                
+                if username and password:
+                    logger.info("Connecting to %s with user: %s", network_path, username,
+                                extra={'store': ip_address, 'stage': 'connect'})
+                    returncode, stdout, stderr = await run_net_use(network_path, f'/user:{username}', password,
+                                                                   timeout=10)
+                else:
+                    logger.info("Connecting to %s without credentials", network_path,
+                                extra={'store': ip_address, 'stage': 'connect'})
+                    returncode, stdout, stderr = await run_net_use(network_path, timeout=10)
+        
+        return record_connection_result(ip_address, username, connection_key, network_path,
+                                        returncode, stdout, stderr)
+    
+    except asyncio.TimeoutError:
+        logger.error("Connection timeout for %s", ip_address, extra={'store': ip_address, 'stage': 'connect'})
+        return {'success': False, 'message': 'Délai de connexion dépassé'}
+    except Exception as e:
+        logger.error("Error connecting to %s: %s", ip_address, e, extra={'store': ip_address, 'stage': 'connect'})
+        return {'success': False, 'message': str(e)}
+
+
+async def gather_bounded(coroutines):
+    """
+    Await coroutines with at most ASYNC_MAX_IN_FLIGHT running, results in input order
+    """
+    semaphore = asyncio.Semaphore(ASYNC_MAX_IN_FLIGHT)
+    
+    async def bounded(coroutine):
+        async with semaphore:
+            return await coroutine
+    
+    return await asyncio.gather(*(bounded(coroutine) for coroutine in coroutines))
+
+
+async def connect_stores_async(ip_addresses, username=None, password=None):
+    """
+    Connect to many stores concurrently
+    Returns: list of connect results in the order of ip_addresses
+    """
+    return await gather_bounded(connect_to_network_share_async(ip_address, username, password)
+                                for ip_address in ip_addresses)
+
+
+async def check_stores_async(stores, directory_path, filename, username=None, password=None):
+    """
+    Async counterpart of the process_excel loop
+    stores: list of (CodeMag, ipaddress) tuples
+    Returns: list of check report rows
+    """
+    username, password = get_credentials(username, password)
+    total = len(stores)
+    done = 0
+    
+    async def look_up_store(code_mag, ip_address):
+        cached = get_cached_file_metadata(ip_address, directory_path, filename)
+        if cached is not None:
+            return build_check_row(code_mag, ip_address, filename, cached)
+        
+        if username and password:
+            connection_result = await connect_to_network_share_async(ip_address, username, password)
+            if not connection_result['success']:
+                result = {
+                    'exists': False,
+                    'path': f'\\\\{ip_address}\\{directory_path}\\{filename}',
+                    'size': None,
+                    'modified': None,
+                    'error': f"Échec de connexion: {connection_result['message']}"
+                }
+                return build_check_row(code_mag, ip_address, filename, result)
+        
+        result = await run_blocking(stat_network_file, ip_address, directory_path, filename)
+        return build_check_row(code_mag, ip_address, filename, result)
+    
+    async def check_store(code_mag, ip_address):
+        # Every store counts, cache hits and connection failures included (as in process_excel)
+        nonlocal done
+        try:
+            return await look_up_store(code_mag, ip_address)
+        finally:
+            done += 1
+            logger.info("Processed %d/%d: %s - %s", done, total, code_mag, ip_address, extra={'store': ip_address})
+    
+    return await gather_bounded(check_store(code_mag, ip_address) for code_mag, ip_address in stores)
+
+
+async def transfer_stores_async(source_path, stores, directory_path, filename, username=None, password=None):
+    """
+    Async counterpart of the direct transfer loop of transfer_files_to_servers
+    Credentials must already be resolved (see get_credentials)
+    Returns: list of transfer result rows
+    """
+    async def transfer_store(store):
+        code_mag, ip_address = store['CodeMag'], store['ipaddress']
+        if username and password:
+            connection_result = await connect_to_network_share_async(ip_address, username, password)
+            if not connection_result['success']:
+                return {
+                    'CodeMag': code_mag,
+                    'IPAddress': ip_address,
+                    'FileName': filename,
+                    'Status': 'Failed',
+                    'DestinationPath': f'\\\\{ip_address}\\{directory_path}\\{filename}',
+                    'Source': 'Central',
+                    'Error': f"Échec de connexion: {connection_result['message']}"
+                }
+        
+        result = await run_blocking(copy_file_to_store, source_path, code_mag, ip_address, directory_path, filename)
+        if result['Status'] == 'Success':
+            logger.info("Transferred %s - %s - %s", code_mag, ip_address, filename, extra={'store': ip_address})
+        return result
+    
+    return await gather_bounded(transfer_store(store) for store in stores)
+
+
+# ===== SHARDED EXECUTION =====
+# For inventories of thousands of stores one process becomes GIL and memory bound.
+# The sharded engine cuts the inventory into shards of SHARD_SIZE stores handled by
+# a pool of SHARD_WORKERS processes (each running SHARD_ENGINE on its shard). Results
+# come back shard by shard and are merged, in inventory order, into a single report.
+# A shard that raises only fails its own stores; shards lost because a worker process
+# died are retried in a fresh pool. Workers send their log records to this process,
+# which stays the only writer of the rotating log files.
+
+SHARD_CONTEXT = multiprocessing.get_context('spawn')
+
+
+class ShardLogForwarder(logging.Handler):
+    """
+    Hand log records received from worker processes to this process's pipeline
+    """
+
+    def emit(self, record):
+        logging.getLogger(record.name).handle(record)
+
+
+def init_shard_worker(log_queue, level, bandwidth):
+    """
+    Set up a worker process: log to the coordinator, apply its share of the bandwidth caps
+    """
+    global BANDWIDTH_GLOBAL_KBPS, BANDWIDTH_PER_HOST_KBPS, BANDWIDTH_PROFILE
+
+    # The import of this module started a local listener, the coordinator writes the logs
+    log_listener.stop()
+    atexit.unregister(log_listener.stop)
+    for handler in log_listener.handlers:
+        handler.close()
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.addFilter(JobContextFilter())
+    root_logger = logging.getLogger()
+    root_logger.handlers = [queue_handler]
+    root_logger.setLevel(level)
+
+    BANDWIDTH_GLOBAL_KBPS, BANDWIDTH_PER_HOST_KBPS = bandwidth
+    BANDWIDTH_PROFILE = []
+
+
+def check_shard(stores, directory_path, filename, username=None, password=None):
+    if SHARD_ENGINE == 'async':
+        return run_async_engine(check_stores_async(stores, directory_path, filename, username, password))
+    return [build_check_row(code_mag, ip_address, filename,
+                            check_file_exists(ip_address, directory_path, filename, username, password))
+            for code_mag, ip_address in stores]
+
+
+def transfer_shard(stores, source_path, directory_path, filename, username=None, password=None):
+    # Agents get no credentials and use their own defaults
+    username, password = get_credentials(username, password)
+    if SHARD_ENGINE == 'async':
+        return run_async_engine(transfer_stores_async(source_path, stores, directory_path, filename,
+                                                      username, password))
+    return [transfer_file_to_store(source_path, store['CodeMag'], store['ipaddress'], directory_path, filename,
+                                   username, password)
+            for store in stores]
+
+
+def connect_shard(ip_addresses, username=None, password=None):
+    if SHARD_ENGINE == 'async':
+        return run_async_engine(connect_stores_async(ip_addresses, username, password))
+    return [connect_to_network_share(ip_address, username, password) for ip_address in ip_addresses]
+
+
+SHARD_TASKS = {
+    'check': check_shard,
+    'transfer': transfer_shard,
+    'relay': relay_shard,
+    'connect': connect_shard
+}
+
+
+def run_shard(kind, job_id, task, stores, args):
+    """
+    Worker process entry point: run one shard under the coordinator's job id
+    Returns: tuple (result rows, exported stage timings)
+    """
+    timings = JobTimings(kind)
+    timings.job_id = job_id or timings.job_id
+    current_job_timings.set(timings)
+    rows = SHARD_TASKS[task](stores, *args)
+    return rows, timings.export()
+
+
+def run_sharded(task, stores, args, failed_row, on_shard=None):
+    """
+    Run a SHARD_TASKS task over stores with a pool of worker processes
+    args: extra arguments of the task, failed_row(store, error): row for a store of a failed shard
+    on_shard(index, rows) is called as each shard completes
+    Bandwidth caps in effect when the run starts are split between the workers
+    Returns: list of rows in the order of stores
+    """
+    shards = [stores[start:start + SHARD_SIZE] for start in range(0, len(stores), SHARD_SIZE)]
+    if not shards:
+        return []
+    
+    timings = current_job_timings.get()
+    kind = timings.kind if timings else task
+    job_id = timings.job_id if timings else None
+    workers = min(SHARD_WORKERS, len(shards))
+    global_kbps, host_kbps = get_bandwidth_limits()
+    bandwidth = (max(1, global_kbps // workers) if global_kbps else 0, host_kbps)
+    
+    log_queue = SHARD_CONTEXT.Queue()
+    log_forwarder = QueueListener(log_queue, ShardLogForwarder())
+    log_forwarder.start()
+    
+    logger.info(f"Running {task} on {len(stores)} stores in {len(shards)} shards with {workers} processes")
+    results = {}
+    pending = set(range(len(shards)))
+    try:
+        for attempt in range(1, SHARD_MAX_ATTEMPTS + 1):
+            if not pending:
+                break
+            
+            with ProcessPoolExecutor(max_workers=min(workers, len(pending)), mp_context=SHARD_CONTEXT,
+                                     initializer=init_shard_worker,
+                                     initargs=(log_queue, logging.getLogger().level, bandwidth)) as executor:
+                futures = {executor.submit(run_shard, kind, job_id, task, shards[index], args): index
+                           for index in sorted(pending)}
+                
+                for future in as_completed(futures):
+                    index = futures[future]
+                    try:
+                        rows, shard_timings = future.result()
+                        if timings is not None:
+                            timings.merge(shard_timings)
+                    except BrokenProcessPool as e:
+                        if attempt < SHARD_MAX_ATTEMPTS:
+                            logger.warning(f"Shard {index + 1}/{len(shards)} lost with its worker process, retrying")
+                            continue
+                        rows = [failed_row(store, f"Processus de travail interrompu: {e}") for store in shards[index]]
+                    except Exception as e:
+                        logger.error(f"Shard {index + 1}/{len(shards)} failed: {str(e)}")
+                        rows = [failed_row(store, str(e)) for store in shards[index]]
+                    
+                    pending.discard(index)
+                    results[index] = rows
+                    logger.info(f"Shard {index + 1}/{len(shards)} done ({len(rows)} stores)")
+                    if on_shard:
+                        on_shard(index, rows)
+    finally:
+        log_forwarder.stop()
+    
+    return [row for index in range(len(shards)) for row in results[index]]
+
+
+# ===== AGENT MODE =====
+# The same program started with --agent <url of the main instance> becomes a worker
+# agent: it registers the regions and subnets it serves, polls for tasks, runs the
+# store operations locally (with SHARD_ENGINE) and posts the result rows back, so
+# the SMB round-trips stay close to the stores. With engine='agents' the main
+# instance queues one task per SHARD_SIZE stores for the live agent(s) serving them
+# and runs the other stores itself, as well as tasks no agent picked up in time or
+# whose agent went silent. Transfer tasks carry the SHA-256 of the file, which the
+# agent downloads once from /agents/files/<sha256>.
+
+agents = {}        # agent_id -> registered agent
+agent_tasks = {}   # task_id -> task queued for an agent
+agent_files = {}   # sha256 -> local path of a file being transferred by agents
+agents_lock = threading.Lock()
+agent_files_lock = threading.Lock()
+
+
+def uses_default_credentials(username, password):
+    """
+    True when a job runs under the default account, the only one agents can use
+    """
+    return not username or (username, password) == (DEFAULT_USERNAME, DEFAULT_PASSWORD)
+
+
+def get_agent_credentials(username, password):
+    """
+    Credentials to send with agent tasks: never the operator's (the agent channel is
+    plain HTTP and any registered agent gets them), agents use their own defaults
+    Routes refuse engine='agents' with other credentials (see uses_default_credentials)
+    """
+    if not uses_default_credentials(username, password):
+        logger.warning(f"Agents connect with their own credentials, not {username}'s")
+    return None, None
+
+
+# Fields every result row of an agent task must have
+AGENT_ROW_FIELDS = {
+    'check': ('CodeMag', 'IPAddress', 'Exists'),
+    'transfer': ('CodeMag', 'IPAddress', 'Status'),
+    'relay': ('CodeMag', 'IPAddress', 'Status'),
+    'connect': ('success', 'message')
+}
+
+
+def is_valid_agent_row(task, store, row):
+    """
+    True when a row posted by an agent is a result of its task for that store
+    store: as queued (IP address for connect, (CodeMag, IP) for check, store dict otherwise)
+    """
+    if not isinstance(row, dict) or any(field not in row for field in AGENT_ROW_FIELDS[task]):
+        return False
+    if task == 'connect':
+        return isinstance(row['success'], bool)
+    code_mag, ip_address = (store['CodeMag'], store['ipaddress']) if isinstance(store, dict) else store
+    return str(row['CodeMag']) == str(code_mag) and str(row['IPAddress']) == str(ip_address)
+
+
+def is_agent_alive(agent, now=None):
+    return (now or time.time()) - agent['last_seen'] <= AGENT_STALE_SECONDS
+
+
+def find_agents_for_store(ip_address, region, now=None):
+    """
+    Ids of the live agents serving a store's region or subnet
+    """
+    try:
+        address = ipaddress.ip_address(str(ip_address).lstrip('\\'))
+    except ValueError:
+        address = None
+    
+    region = str(region).strip() if region is not None and not pd.isna(region) else None
+    matches = []
+    for agent_id, agent in sorted(agents.items()):
+        if not is_agent_alive(agent, now):
+            continue
+        if region and region in agent['regions']:
+            matches.append(agent_id)
+        elif address is not None and any(address in network for network in agent['networks']):
+            matches.append(agent_id)
+    return matches
+
+
+def run_on_agents(task, stores, locations, args, agent_args, failed_row):
+    """
+    Run a SHARD_TASKS task with the stores spread over the agents serving them
+    locations: (ip address, region) of each store, used to pick the agents
+    args: task arguments when run locally, agent_args: the JSON version sent to agents
+    Returns: list of rows in the order of stores
+    """
+    timings = current_job_timings.get()
+    now = time.time()
+    
+    # Round-robin the stores of each region/subnet over the agents serving it
+    assigned = {}
+    local_indexes = []
+    with agents_lock:
+        for index, (ip_address, region) in enumerate(locations):
+            matches = find_agents_for_store(ip_address, region, now)
+            if matches:
+                assigned.setdefault(matches[index % len(matches)], []).append(index)
+            else:
+                local_indexes.append(index)
+        
+        queued = []
+        for agent_id, indexes in assigned.items():
+            for start in range(0, len(indexes), SHARD_SIZE):
+                chunk = indexes[start:start + SHARD_SIZE]
+                task_id = f"task_{uuid.uuid4().hex[:12]}"
+                agent_tasks[task_id] = {
+                    'task_id': task_id,
+                    'agent_id': agent_id,
+                    'task': task,
+                    'kind': timings.kind if timings else task,
+                    'job_id': timings.job_id if timings else None,
+                    'timings': timings,
+                    'indexes': chunk,
+                    'stores': [stores[index] for index in chunk],
+                    'args': agent_args,
+                    'status': 'queued',
+                    'created': now,
+                    'claimed': None,
+                    'rows': None,
+                    'error': None,
+                    'done': threading.Event()
+                }
+                queued.append(agent_tasks[task_id])
+    
+    logger.info(f"Running {task} on {len(stores)} stores: {len(stores) - len(local_indexes)} on "
+                f"{len(assigned)} agents ({len(queued)} tasks), {len(local_indexes)} locally")
+    
+    rows = [None] * len(stores)
+    if local_indexes:
+        local_rows = SHARD_TASKS[task]([stores[index] for index in local_indexes], *args)
+        for index, row in zip(local_indexes, local_rows):
+            rows[index] = row
+    
+    try:
+        for agent_task in queued:
+            task_stores = agent_task['stores']
+            task_rows = wait_for_agent_task(agent_task)
+            if task_rows is None:
+                logger.warning(f"Agent task {agent_task['task_id']} taken back, running it locally")
+                task_rows = SHARD_TASKS[task](task_stores, *args)
+            elif agent_task['error']:
+                task_rows = [failed_row(store, f"Agent: {agent_task['error']}") for store in task_stores]
+            for index, row in zip(agent_task['indexes'], task_rows):
+                rows[index] = row
+    finally:
+        with agents_lock:
+            for agent_task in queued:
+                agent_tasks.pop(agent_task['task_id'], None)
+    
+    return rows
+
+
+def wait_for_agent_task(agent_task):
+    """
+    Wait for an agent to post the results of a task
+    Returns: the result rows, or None when the task was taken back to run locally
+    """
+    while not agent_task['done'].wait(1):
+        now = time.time()
+        with agents_lock:
+            agent = agents.get(agent_task['agent_id'])
+            agent_lost = agent is None or not is_agent_alive(agent, now)
+            status = agent_task['status']
+            if status == 'queued' and (agent_lost or now - agent_task['created'] > AGENT_CLAIM_TIMEOUT):
+                agent_task['status'] = 'taken_back'
+            elif status == 'running' and (agent_lost or now - agent_task['claimed'] > AGENT_TASK_TIMEOUT):
+                agent_task['status'] = 'taken_back'
+            if agent_task['status'] == 'taken_back':
+                return None
+    return agent_task['rows']
+
+
+def check_agent_token():
+    """
+    Error response when the request does not carry the agent token, else None
+    Without AGENT_TOKEN only requests from this machine are accepted
+    """
+    if not AGENT_TOKEN:
+        try:
+            is_local = ipaddress.ip_address(request.remote_addr or '').is_loopback
+        except ValueError:
+            is_local = False
+        if not is_local:
+            return jsonify({'error': 'Agent token required: start the main instance with --agent-token'}), 403
+        return None
+    if not hmac.compare_digest(request.headers.get('X-Agent-Token', ''), AGENT_TOKEN):
+        return jsonify({'error': 'Invalid agent token'}), 403
+    return None
+
+
+@app.route('/agents', methods=['GET'])
+def get_agents():
+    """List registered agents"""
+    now = time.time()
+    with agents_lock:
+        return jsonify({
+            'success': True,
+            'agents': [{
+                'agent_id': agent['agent_id'],
+                'name': agent['name'],
+                'regions': agent['regions'],
+                'subnets': agent['subnets'],
+                'alive': is_agent_alive(agent, now),
+                'last_seen_seconds': round(now - agent['last_seen'], 1),
+                'tasks_done': agent['tasks_done']
+            } for agent in agents.values()]
+        })
+
+
+@app.route('/agents/register', methods=['POST'])
+def register_agent():
+    """Register an agent with the regions and subnets it serves"""
+    error = check_agent_token()
+    if error:
+        return error
+    try:
+        data = request.get_json() or {}
+        name = str(data.get('name') or request.remote_addr)
+        regions = [str(region).strip() for region in data.get('regions', []) if str(region).strip()]
+        subnets = [str(subnet).strip() for subnet in data.get('subnets', []) if str(subnet).strip()]
+        
+        try:
+            networks = [ipaddress.ip_network(subnet, strict=False) for subnet in subnets]
+        except ValueError as e:
+            return jsonify({'error': f'Invalid subnet: {str(e)}'}), 400
+        
+        if not regions and not networks:
+            return jsonify({'error': 'An agent must serve at least one region or subnet'}), 400
+        
+        agent_id = f"agent_{uuid.uuid4().hex[:12]}"
+        with agents_lock:
+            agents[agent_id] = {
+                'agent_id': agent_id,
+                'name': name,
+                'regions': regions,
+                'subnets': subnets,
+                'networks': networks,
+                'registered_at': datetime.now().isoformat(),
+                'last_seen': time.time(),
+                'tasks_done': 0
+            }
+        
+        logger.info(f"Agent {name} registered as {agent_id} (regions: {regions}, subnets: {subnets})")
+        return jsonify({'success': True, 'agent_id': agent_id, 'poll_seconds': AGENT_POLL_SECONDS,
+                        'heartbeat_seconds': AGENT_HEARTBEAT_SECONDS})
+    
+    except Exception as e:
+        logger.error(f"Agent registration error: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+
+
+@app.route('/agents/<agent_id>/heartbeat', methods=['POST'])
+def agent_heartbeat(agent_id):
+    """Keep an agent alive while it runs a task"""
+    error = check_agent_token()
+    if error:
+        return error
+    with agents_lock:
+        agent = agents.get(agent_id)
+        if agent is None:
+            return jsonify({'error': 'Unknown agent'}), 404
+        agent['last_seen'] = time.time()
+    return jsonify({'success': True})
+
+
+@app.route('/agents/<agent_id>/poll', methods=['POST'])
+def poll_agent_task(agent_id):
+    """Hand the next queued task of an agent, if any"""
+    error = check_agent_token()
+    if error:
+        return error
+    with agents_lock:
+        agent = agents.get(agent_id)
+        if agent is None:
+            return jsonify({'error': 'Unknown agent'}), 404
+        agent['last_seen'] = time.time()
+        
+        for agent_task in agent_tasks.values():
+            if agent_task['agent_id'] == agent_id and agent_task['status'] == 'queued':
+                agent_task['status'] = 'running'
+                agent_task['claimed'] = time.time()
+                return jsonify({
+                    'success': True,
+                    'task_id': agent_task['task_id'],
+                    'task': agent_task['task'],
+                    'kind': agent_task['kind'],
+                    'job_id': agent_task['job_id'],
+                    'stores': agent_task['stores'],
+                    'args': agent_task['args']
+                })
+    
+    return jsonify({'success': True, 'task': None})
+
+
+@app.route('/agents/<agent_id>/tasks/<task_id>/results', methods=['POST'])
+def post_agent_task_results(agent_id, task_id):
+    """Receive the result rows (or error) of an agent task"""
+    error = check_agent_token()
+    if error:
+        return error
+    data = request.get_json() or {}
+    with agents_lock:
+        agent = agents.get(agent_id)
+        agent_task = agent_tasks.get(task_id)
+        if agent is None or agent_task is None or agent_task['agent_id'] != agent_id:
+            return jsonify({'error': 'Unknown task'}), 404
+        agent['last_seen'] = time.time()
+        if agent_task['status'] != 'running':
+            return jsonify({'error': f"Task is {agent_task['status']}"}), 409
+        
+        rows = data.get('rows')
+        if data.get('error'):
+            agent_task['error'] = str(data['error'])
+        elif (not isinstance(rows, list) or len(rows) != len(agent_task['stores'])
+              or not all(is_valid_agent_row(agent_task['task'], store, row)
+                         for store, row in zip(agent_task['stores'], rows))):
+            logger.warning(f"Agent {agent['name']} posted invalid rows for task {task_id}")
+            agent_task['error'] = 'Invalid result rows'
+        else:
+            for row in rows:
+                if isinstance(row, dict) and 'Source' in row:
+                    # Relayed rows keep the seed they were copied from
+                    row['Source'] = (f"{row['Source']} via agent {agent['name']}" if agent_task['task'] == 'relay'
+                                     else f"Agent {agent['name']}")
+            agent_task['rows'] = rows
+        agent_task['status'] = 'done'
+        agent['tasks_done'] += 1
+    
+    if data.get('timings') and agent_task['timings'] is not None:
+        agent_task['timings'].merge(data['timings'])
+    agent_task['done'].set()
+    return jsonify({'success': True})
+
+
+@app.route('/agents/files/<sha256>')
+def get_agent_file(sha256):
+    """Content of a file being transferred by agents"""
+    error = check_agent_token()
+    if error:
+        return error
+    with agent_files_lock:
+        file_path = agent_files.get(sha256.lower())
+    if file_path is None:
+        return jsonify({'error': 'Unknown file'}), 404
+    return send_file(file_path, as_attachment=True, download_name=sha256)
+
+
+def agent_request(coordinator_url, path, payload=None, token=''):
+    """
+    POST JSON to the main instance (GET without payload)
+    Returns: decoded JSON response
+    """
+    data = json.dumps(payload).encode('utf-8') if payload is not None else None
+    req = urllib.request.Request(coordinator_url + path, data=data, method='POST' if data is not None else 'GET',
+                                 headers={'Content-Type': 'application/json', 'X-Agent-Token': token})
+    with urllib.request.urlopen(req, timeout=60) as response:
+        return json.loads(response.read().decode('utf-8'))
+
+
+def fetch_agent_file(coordinator_url, sha256, cache_folder, token=''):
+    """
+    Local copy of a file to transfer, downloaded once per content hash
+    """
+    os.makedirs(cache_folder, exist_ok=True)
+    file_path = os.path.join(cache_folder, sha256)
+    if os.path.exists(file_path):
+        return file_path
+    
+    tmp_path = os.path.join(cache_folder, f"tmp_{uuid.uuid4().hex}")
+    req = urllib.request.Request(f"{coordinator_url}/agents/files/{sha256}", headers={'X-Agent-Token': token})
+    try:
+        with timed_stage('fetch'):
+            with urllib.request.urlopen(req, timeout=60) as response:
+                save_upload_stream(response, tmp_path)
+        if compute_file_hash(tmp_path) != sha256:
+            raise ValueError(f"Downloaded file does not match {sha256}")
+        os.replace(tmp_path, file_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return file_path
+
+
+def execute_agent_task(coordinator_url, agent_task, cache_folder, token=''):
+    """
+    Run a task received from the main instance
+    Returns: results payload (rows and timings, or error)
+    """
+    try:
+        args = list(agent_task['args'])
+        if agent_task['task'] == 'transfer':
+            args[0] = fetch_agent_file(coordinator_url, args[0], cache_folder, token)
+        rows, timings = run_shard(agent_task['kind'], agent_task['job_id'], agent_task['task'],
+                                  agent_task['stores'], args)
+        return {'rows': rows, 'timings': timings}
+    except Exception as e:
+        logger.error(f"Agent task {agent_task['task_id']} failed: {str(e)}")
+        return {'error': str(e)}
+
+
+def run_agent(coordinator_url, name, regions, subnets, token=''):
+    """
+    Agent mode main loop: register, then run tasks until interrupted
+    Registers again when the main instance no longer knows this agent (restart)
+    """
+    coordinator_url = coordinator_url.rstrip('/')
+    cache_folder = os.path.join(app.config['UPLOAD_FOLDER'], 'agent_cache', secure_filename(name))
+    state = {'agent_id': None}
+    
+    def heartbeat():
+        while True:
+            time.sleep(AGENT_HEARTBEAT_SECONDS)
+            agent_id = state['agent_id']
+            if agent_id:
+                try:
+                    agent_request(coordinator_url, f'/agents/{agent_id}/heartbeat', {}, token)
+                except Exception as e:
+                    logger.debug(f"Heartbeat failed: {str(e)}")
+    
+    threading.Thread(target=heartbeat, daemon=True).start()
+    
+    while True:
+        try:
+            if state['agent_id'] is None:
+                response = agent_request(coordinator_url, '/agents/register',
+                                         {'name': name, 'regions': regions, 'subnets': subnets}, token)
+                state['agent_id'] = response['agent_id']
+                logger.info(f"Registered with {coordinator_url} as {state['agent_id']}")
+            
+            agent_id = state['agent_id']
+            agent_task = agent_request(coordinator_url, f'/agents/{agent_id}/poll', {}, token)
+            if not agent_task.get('task'):
+                time.sleep(AGENT_POLL_SECONDS)
+                continue
+            
+            logger.info(f"Running {agent_task['task']} task {agent_task['task_id']} "
+                        f"on {len(agent_task['stores'])} stores")
+            results = execute_agent_task(coordinator_url, agent_task, cache_folder, token)
+            agent_request(coordinator_url, f"/agents/{agent_id}/tasks/{agent_task['task_id']}/results",
+                          results, token)
+        
+        except urllib.error.HTTPError as e:
+            if e.code == 404:
+                state['agent_id'] = None
+            logger.error(f"Main instance answered {e.code}: {e.reason}")
+            time.sleep(AGENT_POLL_SECONDS)
+        except Exception as e:
+            logger.error(f"Agent error: {str(e)}")
+            time.sleep(AGENT_POLL_SECONDS)
+
+
+def wait_for_server(host, port, timeout=15):
+    """
+    Wait until the server accepts connections
+    Returns: True when it is listening, False after timeout seconds
+    """
+    if host in ('0.0.0.0', '::', ''):
+        host = '127.0.0.1'
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            with socket.create_connection((host, port), timeout=0.5):
+                return True
+        except OSError:
+            time.sleep(0.05)
+    return False
+
+
+def open_browser(url, host, port):
+    """Open the browser as soon as the server is listening"""
+    wait_for_server(host, port)
+    webbrowser.open(url)
+
+
+def run_server(host, port, mode, threads, connection_limit, channel_timeout):
+    """
+    Serve the app with waitress in production mode, or the Werkzeug development server
+    Falls back to the threaded development server if waitress is not installed
+    """
+    if mode == 'production':
+        try:
+            from waitress import serve
+        except ImportError:
+            logger.warning("waitress is not installed, falling back to the development server")
+        else:
+            logger.info(f"Serving with waitress: {threads} thread(s), "
+                        f"connection limit {connection_limit}, channel timeout {channel_timeout}s")
+            serve(
+                app,
+                host=host,
+                port=port,
+                threads=threads,
+                connection_limit=connection_limit,
+                channel_timeout=channel_timeout,
+                # waitress answers 413 from this size on, whatever Flask allows
+                max_request_body_size=app.config['MAX_CONTENT_LENGTH'] or SERVER_UNLIMITED_BODY_SIZE,
+                ident='FileChecker'
+            )
+            return
+
+    app.run(host=host, port=port, debug=False, use_reloader=False, threaded=True)
+
+
+# ===== HEADLESS CLI =====
+# "FileChecker check|transfer|bulk-test ..." runs one job with the same functions
+# as the web routes (process_excel, transfer_files_to_servers, check_and_transfer_file,
+# test_connections), without starting the server or the browser, e.g. for nightly
+# audits. Each result row is printed on stdout as a JSON line as soon as it is
+# known, then a summary line; logs go to stderr. The rows are also kept as a run
+# (see RUN RESULTS), so they can be browsed in the web interface or saved with --report.
+
+CLI_EXIT_OK = 0        # Every store checked, transferred or connected
+CLI_EXIT_FAILURES = 1  # Some stores failed, or miss the checked file
+CLI_EXIT_ERROR = 2     # The job could not run (arguments, inventory...)
+CLI_EXIT_HALTED = 3    # A wave rollout halted
+CLI_ENGINES = ('sync', 'async', 'sharded')  # The agents engine needs the web server
+CLI_EXIT_HELP = ('exit codes: 0 all stores OK, 1 some stores failed or miss the file, '
+                 '2 the job could not run, 3 a wave rollout halted')
+
+cli_output_lock = threading.Lock()
+
+
+def attach_cli_stdio():
+    """
+    Give a CLI run a stdout/stderr when the EXE is built without a console
+    (console=False leaves them None): the console of the calling command prompt
+    on Windows, else the null device. Redirected output (> results.jsonl) is
+    already a valid stdout and is kept
+    """
+    if sys.stdout is not None and sys.stderr is not None:
+        return
+    stream = None
+    if os.name == 'nt':
+        ctypes = importlib.import_module('ctypes')
+        if ctypes.windll.kernel32.AttachConsole(-1):  # ATTACH_PARENT_PROCESS
+            stream = open('CONOUT$', 'w', encoding='utf-8')
+    if stream is None:
+        stream = open(os.devnull, 'w', encoding='utf-8')
+    if sys.stdout is None:
+        sys.stdout = stream
+    if sys.stderr is None:
+        sys.stderr = stream
+        log_listener.handlers += (create_console_log_handler(),)
+
+
+def print_json_line(event, **fields):
+    line = json.dumps({'event': event, **fields}, ensure_ascii=False, default=str)
+    with cli_output_lock:
+        if sys.stdout is None:
+            return
+        sys.stdout.write(line + '\n')
+        sys.stdout.flush()
+
+
+class JsonLinesSink:
+    """
+    Result sink printing each row as a JSON line as soon as it is added, then
+    passing it on to the run's result stream (which keeps the counts)
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+
+    def append(self, row):
+        print_json_line('row', **row)
+        self.stream.append(row)
+
+    def extend(self, rows):
+        for row in rows:
+            self.append(row)
+
+    def __len__(self):
+        return len(self.stream)
+
+
+def resolve_inventory_path(path):
+    """
+    Inventory given on the command line: a path, or the name of a file of the data folder
+    """
+    if os.path.isfile(path):
+        return path
+    data_path = os.path.join(app.config['DATA_FOLDER'], path)
+    return data_path if os.path.isfile(data_path) else None
+
+
+def finish_cli_run(args, stream, sheet_name, summary):
+    """
+    Close the run's result stream and write the --report workbook
+    """
+    stream.close()
+    summary['run_id'] = stream.run_id
+    if args.report:
+        write_stream_report(stream, args.report, sheet_name)
+        summary['report'] = os.path.abspath(args.report)
+    return summary
+
+
+def run_cli_check(args):
+    stream = ResultStream.create('check', 'Exists')
+    sink = JsonLinesSink(stream)
+    result = process_excel(args.inventory, args.filename, args.directory, args.username, args.password,
+                           engine=args.engine, cache_mode=args.cache, sink=sink)
+    if 'error' in result:
+        stream.discard()
+        return {'error': result['error']}, CLI_EXIT_ERROR
+
+    found = stream.count('Exists', 'Yes')
+    summary = {'total': len(stream), 'found': found, 'not_found': len(stream) - found}
+    finish_cli_run(args, stream, 'Results', summary)
+    return summary, CLI_EXIT_OK if summary['not_found'] == 0 else CLI_EXIT_FAILURES
+
+
+def run_cli_transfer(args):
+    if args.compare:
+        stream = ResultStream.create('check_transfer', 'Status', ('Action',))
+    else:
+        stream = ResultStream.create('transfer', 'Status')
+    sink = JsonLinesSink(stream)
+    errors = []
+    rollouts = []
+    compression_stats = {'original_bytes': 0, 'sent_bytes': 0, 'ratio': None}
+
+    for file_path in args.files:
+        filename = os.path.basename(file_path)
+        if not os.path.isfile(file_path):
+            result = {'error': f'File not found: {file_path}'}
+        elif args.compare:
+            result = check_and_transfer_file(file_path, args.inventory, args.directory, args.username,
+                                             args.password, compare=args.compare)
+            if 'error' not in result:
+                sink.extend(result['results'])
+        else:
+            result = transfer_files_to_servers(file_path, args.inventory, args.directory, args.username,
+                                               args.password, distribution=args.distribution,
+                                               compression=args.compression, engine=args.engine, sink=sink)
+        if 'error' in result:
+            print_json_line('error', file=filename, error=result['error'])
+            errors.append(f"{filename}: {result['error']}")
+        else:
+            merge_compression_stats(compression_stats, result.get('compression'))
+            if 'rollout' in result:
+                rollouts.append({'file': filename, **result['rollout']})
+
+    successful = stream.count('Status', 'Success')
+    halted = stream.count('Status', 'Halted')
+    pending = stream.count('Status', PENDING_EXTRACTION_STATUS)
+    summary = {
+        'total': len(stream),
+        'successful': successful,
+        'failed': len(stream) - successful - halted - pending,
+        'halted': halted,
+        'pending_extraction': pending,
+        'errors': errors
+    }
+    if args.compare:
+        summary['up_to_date'] = stream.count('Action', 'Up to date')
+        summary['transferred'] = stream.count('Action', 'Transferred')
+    if args.compression == 'archive':
+        summary['compression'] = compression_stats
+    if rollouts:
+        summary['rollouts'] = rollouts
+    finish_cli_run(args, stream, 'Check and Transfer' if args.compare else 'Transfer Results', summary)
+
+    if errors:
+        return summary, CLI_EXIT_ERROR
+    if halted:
+        return summary, CLI_EXIT_HALTED
+    return summary, CLI_EXIT_OK if summary['failed'] == 0 else CLI_EXIT_FAILURES
+
+
+def run_cli_bulk_test(args):
+    with timed_stage('inventory_load'):
+        df = pd.read_excel(args.inventory)
+    ip_column = find_ip_column(df)
+    if ip_column is None:
+        available_columns = ', '.join(str(col) for col in df.columns)
+        return {'error': f'No "IP Address" column. Available columns: {available_columns}'}, CLI_EXIT_ERROR
+
+    ip_list = get_ip_list(df, ip_column)
+    successful = 0
+    for ip_str, result in zip(ip_list, test_connections(ip_list, args.username, args.password, args.engine)):
+        successful += 1 if result['success'] else 0
+        print_json_line('row', ip_address=ip_str, status='Success' if result['success'] else 'Failed',
+                        message=result['message'])
+
+    summary = {'total': len(ip_list), 'successful': successful, 'failed': len(ip_list) - successful}
+    return summary, CLI_EXIT_OK if summary['failed'] == 0 else CLI_EXIT_FAILURES
+
+
+CLI_COMMANDS = {
+    'check': ('check', run_cli_check),
+    'transfer': ('transfer', run_cli_transfer),
+    'bulk-test': ('bulk_test', run_cli_bulk_test)
+}
+
+
+def run_cli(args):
+    """
+    Run the job of a CLI command
+    Returns: the process exit code
+    """
+    global ASYNC_MAX_IN_FLIGHT, SHARD_WORKERS, STORE_IO_SLOTS
+    if args.max_in_flight:
+        ASYNC_MAX_IN_FLIGHT = args.max_in_flight
+    if args.shard_workers:
+        SHARD_WORKERS = args.shard_workers
+    if args.store_slots:
+        STORE_IO_SLOTS = args.store_slots
+
+    inventory = resolve_inventory_path(args.inventory)
+    if inventory is None:
+        print_json_line('summary', command=args.command, exit_code=CLI_EXIT_ERROR,
+                        error=f'Inventory not found: {args.inventory}')
+        return CLI_EXIT_ERROR
+    args.inventory = inventory
+
+    kind, runner = CLI_COMMANDS[args.command]
+    if getattr(args, 'compare', None):
+        kind = 'check_transfer'
+    try:
+        with track_job(kind, lane=args.priority) as timings:
+            summary, exit_code = runner(args)
+        print_json_line('summary', command=args.command, exit_code=exit_code, timings=timings.summary(), **summary)
+        return exit_code
+    except Exception as e:
+        logger.error(f"{args.command} failed: {str(e)}", exc_info=True)
+        print_json_line('summary', command=args.command, exit_code=CLI_EXIT_ERROR, error=str(e))
+        return CLI_EXIT_ERROR
+
+
+def add_cli_job_arguments(parser):
+    """
+    Options shared by the CLI commands
+    """
+    parser.add_argument('--inventory', required=True,
+                        help='Store inventory (Excel path, or name of a file in the data folder)')
+    parser.add_argument('--username', default=os.environ.get('FILECHECKER_USERNAME'),
+                        help='Share user (default: FILECHECKER_USERNAME, then the default credentials)')
+    parser.add_argument('--password', default=os.environ.get('FILECHECKER_PASSWORD'),
+                        help='Share password (default: FILECHECKER_PASSWORD)')
+    parser.add_argument('--engine', choices=CLI_ENGINES,
+                        default=STORE_IO_ENGINE if STORE_IO_ENGINE in CLI_ENGINES else 'sync',
+                        help='Store I/O engine')
+    parser.add_argument('--max-in-flight', type=int, help='Stores handled concurrently by the async engine')
+    parser.add_argument('--shard-workers', type=int, help='Worker processes of the sharded engine')
+    parser.add_argument('--store-slots', type=int, help='Store operations in progress, all lanes together')
+    parser.add_argument('--priority', choices=PRIORITY_LANES, help='Priority lane of the job')
+
+
+def parse_arguments():
+    parser = argparse.ArgumentParser(description='File Checker Application')
+    parser.add_argument('--host', default=SERVER_HOST, help='Interface to listen on')
+    parser.add_argument('--port', type=int, default=SERVER_PORT, help='Port to listen on')
+    parser.add_argument('--server', choices=['production', 'development'], default=SERVER_MODE,
+                        help='production (waitress) or development (Werkzeug) server')
+    parser.add_argument('--threads', type=int, default=SERVER_THREADS,
+                        help='Number of request threads in production mode')
+    parser.add_argument('--connection-limit', type=int, default=SERVER_CONNECTION_LIMIT,
+                        help='Maximum simultaneous connections in production mode')
+    parser.add_argument('--channel-timeout', type=int, default=SERVER_CHANNEL_TIMEOUT,
+                        help='Seconds before an idle connection is closed in production mode')
+    parser.add_argument('--no-browser', action='store_true', help='Do not open the browser on startup')
+    parser.add_argument('--log-level', type=str.upper, default=LOG_LEVEL.upper(),
+                        choices=['DEBUG', 'INFO', 'WARNING', 'ERROR'], help='Logging level (console and log files)')
+    parser.add_argument('--extract-incoming', metavar='DIR',
+                        help='Extract the compressed transfers waiting in DIR\\_incoming and exit')
+    parser.add_argument('--agent', metavar='URL',
+                        help='Run as an agent of the main instance at URL (e.g. http://10.0.0.5:5001)')
+    parser.add_argument('--agent-name', default=socket.gethostname(), help='Name of this agent')
+    parser.add_argument('--agent-regions', default='',
+                        help='Comma-separated inventory regions served by this agent')
+    parser.add_argument('--agent-subnets', default='',
+                        help='Comma-separated subnets served by this agent (e.g. 10.12.0.0/16)')
+    parser.add_argument('--agent-token', default=AGENT_TOKEN,
+                        help='Shared secret between the main instance and its agents (required for remote agents)')
+    parser.add_argument('--share-backend', choices=SHARE_BACKENDS, default=SHARE_BACKEND,
+                        help='How store shares are reached: netuse, smb (smbprotocol) or local folders')
+    parser.add_argument('--share-root', default=SHARE_LOCAL_ROOT,
+                        help='Folder standing in for the stores with --share-backend local')
+
+    # Headless jobs (see HEADLESS CLI)
+    commands = parser.add_subparsers(dest='command', metavar='command',
+                                     help='Run one job without the web interface, results as JSON Lines on stdout')
+
+    check = commands.add_parser('check', help='Check that a file exists on every store', epilog=CLI_EXIT_HELP)
+    add_cli_job_arguments(check)
+    check.add_argument('--filename', required=True, help='File to look for')
+    check.add_argument('--directory', required=True, help='Directory on the store shares (e.g. partage\\documents)')
+    check.add_argument('--cache', choices=METADATA_CACHE_MODES, default=METADATA_CACHE_MODE,
+                       help='Reuse recent results of the same checks')
+    check.add_argument('--report', help='Also write the results to this Excel file')
+
+    transfer = commands.add_parser('transfer', help='Copy files to every store', epilog=CLI_EXIT_HELP)
+    add_cli_job_arguments(transfer)
+    transfer.add_argument('files', nargs='+', help='Files to transfer')
+    transfer.add_argument('--directory', required=True, help='Destination directory on the store shares')
+    transfer.add_argument('--distribution', choices=('direct', 'relay', 'waves'), default='direct')
+    transfer.add_argument('--compression', choices=('none', 'archive'), default='none')
+    transfer.add_argument('--compare', choices=PIPELINE_COMPARE_MODES,
+                          help='Only transfer to the stores where the file is missing or different')
+    transfer.add_argument('--report', help='Also write the results to this Excel file')
+
+    bulk_test = commands.add_parser('bulk-test', help='Test the connection to every IP of an inventory',
+                                    epilog=CLI_EXIT_HELP)
+    add_cli_job_arguments(bulk_test)
+
+    args = parser.parse_args()
+    if args.command == 'transfer':
+        options_error = get_transfer_options_error(args.distribution, args.compression, args.engine)
+        if options_error:
+            transfer.error(options_error)
+        # The check-and-transfer pipeline copies directly with its own threads
+        if args.compare and (args.distribution, args.compression, args.engine) != (
+                'direct', 'none', transfer.get_default('engine')):
+            transfer.error('--compare cannot be combined with --distribution, --compression or --engine')
+    return args
+
+
+if __name__ == '__main__':
+    # Worker processes of the sharded engine start through the EXE as well
+    multiprocessing.freeze_support()
+    args = None
+    try:
+        # Commands print results and argument errors, even from the EXE without console
+        if set(sys.argv[1:]) & {*CLI_COMMANDS, '--extract-incoming', '-h', '--help'}:
+            attach_cli_stdio()
+        args = parse_arguments()
+
+        if args.extract_incoming:
+            results = extract_incoming_archives(args.extract_incoming)
+            print(json.dumps(results, ensure_ascii=False, indent=1))
+            sys.exit(1 if any(r['status'] == 'Failed' for r in results) else 0)
+
+        url = f"http://{args.host}:{args.port}"
+        logging.getLogger().setLevel(args.log_level)
+
+        # Exported so that the sharded engine's worker processes use the same backend
+        SHARE_BACKEND = os.environ['FILECHECKER_SHARE_BACKEND'] = args.share_backend
+        SHARE_LOCAL_ROOT = os.environ['FILECHECKER_SHARE_ROOT'] = args.share_root
+        get_share_backend()  # Fails now if the backend cannot be used
+
+        AGENT_TOKEN = args.agent_token
+
+        if args.command:
+            sys.exit(run_cli(args))
+
+        if args.agent:
+            logger.info(f"Starting agent {args.agent_name} for {args.agent}")
+            run_agent(args.agent, args.agent_name,
+                      [region for region in args.agent_regions.split(',') if region.strip()],
+                      [subnet for subnet in args.agent_subnets.split(',') if subnet.strip()],
+                      args.agent_token)
+
+        logger.info("File Checker Application")
+        logger.info(f"Python version: {sys.version}")
+        logger.info(f"Template folder: {app.template_folder}")
+        logger.info(f"Upload folder: {app.config['UPLOAD_FOLDER']}")
+        logger.info(f"Report folder: {app.config['REPORT_FOLDER']}")
+        logger.info(f"Default credentials enabled: {USE_DEFAULT_CREDENTIALS}")
+        logger.info(f"Share backend: {SHARE_BACKEND}")
+        if USE_DEFAULT_CREDENTIALS:
+            logger.info(f"Default username: {DEFAULT_USERNAME}")
+        
+        # Start the scheduler for recurring checks
+        start_scheduler()
+
+        # Open browser in a separate thread
+        if not args.no_browser:
+            threading.Thread(target=open_browser, args=(url, args.host, args.port), daemon=True).start()
+
+        # Load pandas/openpyxl while the first page is shown
+        prewarm_heavy_modules()
         
-        # Run Flask app on port 5001 to avoid conflicts
-        print("Starting Flask server on http://127.0.0.1:5001")
-        print("Press CTRL+C to stop the server")
-        print("=" * 60)
-        app.run(host='127.0.0.1', port=5001, debug=False, use_reloader=False)
+        logger.info(f"Starting {args.server} server on {url} (press CTRL+C to stop)")
+        run_server(args.host, args.port, args.server, args.threads,
+                   args.connection_limit, args.channel_timeout)
     except Exception as e:
-        print(f"\n{'='*60}")
-        print("CRITICAL ERROR:")
-        print(f"{'='*60}")
-        print(str(e))
-        print(traceback.format_exc())
-        print(f"{'='*60}")
-        input("Press Enter to exit...")
\ No newline at end of file
+        logger.critical(f"CRITICAL ERROR: {str(e)}", exc_info=True)
+        log_listener.stop()
+        atexit.unregister(log_listener.stop)
+        # Keeps the console open when the server was started by double-click, never for a command
+        if sys.stdin is not None and not (args and (args.command or args.extract_incoming)):
+            input("Press Enter to exit...")
+        sys.exit(CLI_EXIT_ERROR if args and args.command else 1)
@@ -0,0 +1,124 @@
+"""
+Startup benchmark: time from launch until the server listens and serves the
+home page, and (for app.py) the time to import the module.
+
+Usage:
+    python bench_startup.py                      # runs app.py with this Python
+    python bench_startup.py --exe dist\\FileChecker.exe
+    python bench_startup.py --runs 10 --json
+"""
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+
+def find_free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_until(check, timeout):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if check():
+                return True
+        except OSError:
+            pass
+        time.sleep(0.01)
+    return False
+
+
+def is_listening(port):
+    with socket.create_connection(('127.0.0.1', port), timeout=0.5):
+        return True
+
+
+def get_status(url):
+    with urllib.request.urlopen(url, timeout=30) as response:
+        response.read()
+        return response.status == 200
+
+
+def measure_once(command, timeout):
+    """
+    Launch the app once
+    Returns: dict of seconds from launch to listening and to the first page
+    """
+    port = find_free_port()
+    started = time.perf_counter()
+    process = subprocess.Popen(command + ['--no-browser', '--port', str(port)], cwd=ROOT,
+                               stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        result = {}
+        if not wait_until(lambda: is_listening(port), timeout):
+            raise RuntimeError(f"Server not listening after {timeout}s")
+        result['listening'] = time.perf_counter() - started
+
+        base_url = f"http://127.0.0.1:{port}"
+        get_status(base_url + '/')
+        result['first_page'] = time.perf_counter() - started
+        return result
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+def measure_import():
+    """
+    Seconds for a fresh interpreter to import app.py (without serving)
+    """
+    code = ("import time; started = time.perf_counter(); import app; "
+            "print(time.perf_counter() - started)")
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return float(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='File Checker startup benchmark')
+    parser.add_argument('--exe', help='Benchmark a frozen build instead of app.py')
+    parser.add_argument('--runs', type=int, default=5, help='Number of launches')
+    parser.add_argument('--timeout', type=float, default=60, help='Seconds to wait for the server')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args()
+
+    command = [args.exe] if args.exe else [sys.executable, os.path.join(ROOT, 'app.py')]
+    runs = []
+    for _ in range(args.runs):
+        run = measure_once(command, args.timeout)
+        if not args.exe:
+            run['import_app'] = measure_import()
+        runs.append(run)
+
+    summary = {}
+    for metric in runs[0]:
+        values = [run[metric] for run in runs]
+        summary[metric] = {
+            'min': round(min(values), 3),
+            'median': round(statistics.median(values), 3),
+            'max': round(max(values), 3)
+        }
+
+    if args.json:
+        print(json.dumps({'command': command, 'runs': args.runs, 'seconds': summary}, indent=1))
+        return
+
+    print(f"Startup of {' '.join(command)} ({args.runs} runs, seconds)")
+    for metric, stats in summary.items():
+        print(f"  {metric:<24} min {stats['min']:>7.3f}  median {stats['median']:>7.3f}  max {stats['max']:>7.3f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -16,12 +16,20 @@ if not exist "reports" mkdir reports
 
 echo.
 echo [3/4] Building executable with PyInstaller...
+REM Build profile: "build.bat slim" builds a faster-starting folder instead of a single EXE
+if not "%1"=="" set FILECHECKER_BUILD_PROFILE=%1
 python -m PyInstaller --clean FileChecker.spec
 
 echo.
 echo [4/4] Build complete!
 echo.
-echo Your executable is located in: dist\FileChecker.exe
+if /I "%1"=="slim" (
+    echo Your executable is located in: dist\FileChecker\FileChecker.exe
+) else (
+    echo Your executable is located in: dist\FileChecker.exe
+)
+echo Measure startup with: python bench_startup.py --exe dist\FileChecker.exe
+echo Load test the web interface with: python loadtest.py
 echo.
 echo ========================================
 echo Build finished successfully!
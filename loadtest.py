@@ -0,0 +1,447 @@
+"""
+Load test: starts app.py against a simulated store fleet (local share backend,
+one folder per store with a simulated WAN round trip) and has several operators
+use the web interface at once: listing the inventories, checking a file,
+transferring files, while polling /active-connections like auth.html.
+
+Transfers follow transfer.html by default: open a transfer session, ask
+/staging/<sha256> whether each file is already on the server, reuse it or
+upload it, then complete the session (--upload-mode multipart posts to
+/transfer-files instead). Part of the files are sent again so that staged
+content gets reused, as when operators push the same file to several inventories.
+
+Reports the latency percentiles and error rate of each endpoint, and the memory
+and thread count of the server during the run.
+
+Usage:
+    python loadtest.py                                  # 5 operators for 60s, 200 stores
+    python loadtest.py --operators 20 --stores 1000 --engine async
+    python loadtest.py --duration 30 --json --max-error-rate 0.01
+    python loadtest.py --upload-mode multipart          # the former /transfer-files form post
+"""
+import argparse
+import hashlib
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+
+from bench_startup import ROOT, find_free_port, is_listening, wait_until
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+INVENTORY_NAME = 'loadtest_fleet.xlsx'
+CHECKED_FILE = 'config.xml'
+STORE_DIRECTORY = 'partage\\loadtest'
+
+# Operator scenario: weight of each action, picked at random after each think time
+ACTIONS = {
+    'get_excel_files': 3,
+    'check_files': 4,
+    'transfer_files': 2
+}
+
+
+def build_fleet(work_dir, stores, unreachable, seed):
+    """
+    One folder per store under work_dir/shares (missing for the unreachable stores),
+    half of them already holding CHECKED_FILE, and the inventory in work_dir/data
+    Returns: the folder standing in for the shares
+    """
+    import pandas as pd
+
+    rng = random.Random(seed)
+    share_root = os.path.join(work_dir, 'shares')
+    rows = []
+    for index in range(stores):
+        ip_address = f"10.{100 + index // 65536}.{index // 256 % 256}.{index % 256 + 1}"
+        rows.append({'CodeMag': f"M{index:05d}", 'ipaddress': ip_address})
+        if rng.random() < unreachable:
+            continue
+        store_dir = os.path.join(share_root, ip_address, *STORE_DIRECTORY.split('\\'))
+        os.makedirs(store_dir)
+        if rng.random() < 0.5:
+            with open(os.path.join(store_dir, CHECKED_FILE), 'w') as f:
+                f.write('<config/>')
+
+    data_folder = os.path.join(work_dir, 'data')
+    os.makedirs(data_folder, exist_ok=True)
+    pd.DataFrame(rows).to_excel(os.path.join(data_folder, INVENTORY_NAME), index=False)
+    return share_root
+
+
+def copy_app(work_dir):
+    """
+    Run a copy of app.py from the work folder so its uploads, reports and runs stay there
+    """
+    shutil.copy2(os.path.join(ROOT, 'app.py'), work_dir)
+    for folder in ('templates', 'assets'):
+        if os.path.isdir(os.path.join(ROOT, folder)):
+            shutil.copytree(os.path.join(ROOT, folder), os.path.join(work_dir, folder))
+    return os.path.join(work_dir, 'app.py')
+
+
+def encode_multipart(fields, files):
+    """
+    Body and content type of a multipart/form-data request
+    files: list of (field, filename, bytes)
+    """
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, filename, content in files:
+        parts.append(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                     f'Content-Type: application/octet-stream\r\n\r\n'.encode() + content + b'\r\n')
+    parts.append(f'--{boundary}--\r\n'.encode())
+    return b''.join(parts), f'multipart/form-data; boundary={boundary}'
+
+
+class Recorder:
+    """
+    Latency and outcome of every request, per endpoint (thread-safe)
+    """
+
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+        self.lock = threading.Lock()
+
+    def record(self, endpoint, seconds, error=None):
+        with self.lock:
+            self.samples.setdefault(endpoint, []).append(seconds)
+            if error:
+                self.errors.setdefault(endpoint, []).append(error)
+
+    def summary(self, duration):
+        result = {}
+        with self.lock:
+            for endpoint, samples in sorted(self.samples.items()):
+                samples = sorted(samples)
+                errors = self.errors.get(endpoint, [])
+                result[endpoint] = {
+                    'requests': len(samples),
+                    'per_second': round(len(samples) / duration, 2),
+                    'errors': len(errors),
+                    'error_rate': round(len(errors) / len(samples), 4),
+                    'p50_ms': percentile_ms(samples, 50),
+                    'p90_ms': percentile_ms(samples, 90),
+                    'p99_ms': percentile_ms(samples, 99),
+                    'max_ms': round(samples[-1] * 1000, 1),
+                    'first_errors': sorted(set(errors))[:3]
+                }
+        return result
+
+
+def percentile_ms(sorted_samples, percent):
+    index = min(len(sorted_samples) - 1, round(percent / 100 * (len(sorted_samples) - 1)))
+    return round(sorted_samples[index] * 1000, 1)
+
+
+def request(recorder, base_url, endpoint, path, body=None, content_type=None, timeout=300, method=None,
+            expected_statuses=()):
+    """
+    Send one request and record it; a non-2xx status (other than expected_statuses),
+    a body without success or a network error counts as an error
+    Returns: the decoded response, or None
+    """
+    http_request = urllib.request.Request(base_url + path, data=body, method=method)
+    if content_type:
+        http_request.add_header('Content-Type', content_type)
+    started = time.perf_counter()
+    payload = None
+    error = None
+    try:
+        with urllib.request.urlopen(http_request, timeout=timeout) as response:
+            payload = json.loads(response.read() or b'{}')
+        if not payload.get('success'):
+            error = payload.get('error', 'no success in the response')
+    except urllib.error.HTTPError as e:
+        if e.code not in expected_statuses:
+            error = f"HTTP {e.code}"
+    except (OSError, ValueError) as e:
+        error = type(e).__name__
+    recorder.record(endpoint, time.perf_counter() - started, error)
+    return payload if error is None else None
+
+
+def request_json(recorder, base_url, endpoint, path, data, **kwargs):
+    return request(recorder, base_url, endpoint, path, json.dumps(data).encode(), 'application/json', **kwargs)
+
+
+def get_excel_files(recorder, base_url, args, rng):
+    request(recorder, base_url, '/get-excel-files', '/get-excel-files')
+
+
+def check_files(recorder, base_url, args, rng):
+    fields = {'excel_file': INVENTORY_NAME, 'filename': CHECKED_FILE, 'directory_path': STORE_DIRECTORY}
+    if args.engine:
+        fields['engine'] = args.engine
+    body, content_type = encode_multipart(fields, [])
+    request(recorder, base_url, '/check-files', '/check-files', body, content_type)
+
+
+sent_contents = []  # Files already transferred, sent again with probability --resend
+sent_contents_lock = threading.Lock()
+
+
+def pick_transfer_files(args, rng):
+    """
+    (filename, content) of the files of one transfer, some of them sent before
+    """
+    files = []
+    for _ in range(args.files_per_transfer):
+        with sent_contents_lock:
+            if sent_contents and rng.random() < args.resend:
+                files.append(rng.choice(sent_contents))
+                continue
+        content = rng.randbytes(args.transfer_kb * 1024)
+        files.append((f"load_{rng.randrange(1000)}.bin", content))
+        with sent_contents_lock:
+            sent_contents.append(files[-1])
+            del sent_contents[:-50]
+    return files
+
+
+def transfer_files_multipart(recorder, base_url, args, rng):
+    fields = {'excel_file': INVENTORY_NAME, 'directory_path': STORE_DIRECTORY + '\\in'}
+    if args.engine:
+        fields['engine'] = args.engine
+    files = [('files_to_transfer', filename, content) for filename, content in pick_transfer_files(args, rng)]
+    body, content_type = encode_multipart(fields, files)
+    request(recorder, base_url, '/transfer-files', '/transfer-files', body, content_type)
+
+
+def transfer_files_session(recorder, base_url, args, rng):
+    # Same requests as the submit handler of transfer.html
+    options = {'excel_file': INVENTORY_NAME, 'directory_path': STORE_DIRECTORY + '\\in'}
+    if args.engine:
+        options['engine'] = args.engine
+    session = request_json(recorder, base_url, '/transfer-sessions', '/transfer-sessions', options)
+    if session is None:
+        return
+    session_path = f"/transfer-sessions/{session['session_id']}"
+
+    for filename, content in pick_transfer_files(args, rng):
+        sha256 = hashlib.sha256(content).hexdigest()
+        staged = request(recorder, base_url, '/staging/<sha256>', f'/staging/{sha256}')
+        if staged and staged.get('staged'):
+            # Evicted since the lookup (404): uploaded again, as the page does
+            reused = request_json(recorder, base_url, '/transfer-sessions/<id>/staged', session_path + '/staged',
+                                  {'sha256': sha256, 'filename': filename}, expected_statuses=(404,))
+            if reused:
+                continue
+        request(recorder, base_url, '/transfer-sessions/<id>/files',
+                f"{session_path}/files?filename={urllib.parse.quote(filename)}",
+                content, 'application/octet-stream', method='PUT')
+
+    if rng.random() < args.abandon:
+        return  # Browser closed before the end: left to the session expiry
+    request(recorder, base_url, '/transfer-sessions/<id>/complete', session_path + '/complete', b'')
+
+
+def transfer_files(recorder, base_url, args, rng):
+    if args.upload_mode == 'multipart':
+        transfer_files_multipart(recorder, base_url, args, rng)
+    else:
+        transfer_files_session(recorder, base_url, args, rng)
+
+
+ACTION_FUNCTIONS = {
+    'get_excel_files': get_excel_files,
+    'check_files': check_files,
+    'transfer_files': transfer_files
+}
+
+
+def run_operator(recorder, base_url, args, seed, stop):
+    rng = random.Random(seed)
+    actions = list(ACTIONS)
+    weights = [ACTIONS[action] for action in actions]
+    while not stop.is_set():
+        action = rng.choices(actions, weights)[0]
+        ACTION_FUNCTIONS[action](recorder, base_url, args, rng)
+        stop.wait(rng.uniform(0, 2 * args.think_time))
+
+
+def run_poller(recorder, base_url, args, stop):
+    # auth.html refreshes the connection list every 10 seconds
+    while not stop.is_set():
+        request(recorder, base_url, '/active-connections', '/active-connections', timeout=30)
+        stop.wait(args.poll_interval)
+
+
+def read_process_stats(pid):
+    """
+    Resident memory (MB) and thread count of the server process, or None if unknown
+    """
+    if psutil:
+        process = psutil.Process(pid)
+        return {'rss_mb': process.memory_info().rss / 1024 / 1024, 'threads': process.num_threads()}
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            status = dict(line.split(':', 1) for line in f if ':' in line)
+        return {'rss_mb': int(status['VmRSS'].split()[0]) / 1024, 'threads': int(status['Threads'])}
+    except (OSError, KeyError, ValueError):
+        return None
+
+
+def sample_server(pid, samples, stop, interval=0.5):
+    while not stop.is_set():
+        stats = read_process_stats(pid)
+        if stats:
+            samples.append(stats)
+        stop.wait(interval)
+
+
+def summarize_server(samples):
+    if not samples:
+        return None
+    return {
+        'rss_mb': {
+            'start': round(samples[0]['rss_mb'], 1),
+            'peak': round(max(sample['rss_mb'] for sample in samples), 1),
+            'end': round(samples[-1]['rss_mb'], 1)
+        },
+        'threads': {
+            'start': samples[0]['threads'],
+            'peak': max(sample['threads'] for sample in samples),
+            'end': samples[-1]['threads']
+        }
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='File Checker load test against a simulated store fleet')
+    parser.add_argument('--operators', type=int, default=5, help='Operators using the interface at once')
+    parser.add_argument('--duration', type=float, default=60, help='Seconds of load')
+    parser.add_argument('--stores', type=int, default=200, help='Stores in the simulated inventory')
+    parser.add_argument('--unreachable', type=float, default=0.02, help='Share of stores that do not answer')
+    parser.add_argument('--latency-ms', type=float, default=20, help='Simulated round trip per store operation')
+    parser.add_argument('--engine', help='Store I/O engine sent with the checks and transfers (default: the app\'s)')
+    parser.add_argument('--transfer-kb', type=int, default=64, help='Size of each transferred file')
+    parser.add_argument('--files-per-transfer', type=int, default=2, help='Files sent by each transfer')
+    parser.add_argument('--resend', type=float, default=0.3,
+                        help='Share of transferred files that were already sent (staging reuse)')
+    parser.add_argument('--upload-mode', choices=('session', 'multipart'), default='session',
+                        help='Transfer sessions like transfer.html, or a multipart post to /transfer-files')
+    parser.add_argument('--abandon', type=float, default=0.05,
+                        help='Share of transfer sessions never completed (browser closed)')
+    parser.add_argument('--think-time', type=float, default=2, help='Average seconds between two operator actions')
+    parser.add_argument('--poll-interval', type=float, default=10, help='Seconds between /active-connections polls')
+    parser.add_argument('--server', help='Web server of the app (production or development)')
+    parser.add_argument('--threads', type=int, help='Request threads of the waitress server')
+    parser.add_argument('--seed', type=int, default=1, help='Seed of the fleet and of the operators')
+    parser.add_argument('--max-error-rate', type=float,
+                        help='Exit with code 1 if an endpoint has a higher error rate (for CI)')
+    parser.add_argument('--keep', action='store_true', help='Keep the work folder (fleet, reports, logs)')
+    parser.add_argument('--json', action='store_true', help='Print the results as JSON')
+    args = parser.parse_args()
+
+    work_dir = tempfile.mkdtemp(prefix='filechecker_load_')
+    server_log = None
+    process = None
+    try:
+        share_root = build_fleet(work_dir, args.stores, args.unreachable, args.seed)
+        app_path = copy_app(work_dir)
+        port = find_free_port()
+        command = [sys.executable, app_path, '--no-browser', '--port', str(port),
+                   '--share-backend', 'local', '--share-root', share_root, '--log-level', 'WARNING']
+        if args.server:
+            command += ['--server', args.server]
+        if args.threads:
+            command += ['--threads', str(args.threads)]
+        env = dict(os.environ, FILECHECKER_SHARE_LATENCY_MS=str(args.latency_ms))
+
+        server_log = open(os.path.join(work_dir, 'server_output.txt'), 'w')
+        process = subprocess.Popen(command, cwd=work_dir, env=env, stdin=subprocess.DEVNULL,
+                                   stdout=server_log, stderr=subprocess.STDOUT)
+        if not wait_until(lambda: is_listening(port), 60):
+            raise RuntimeError(f"Server not listening after 60s (see {server_log.name})")
+
+        base_url = f"http://127.0.0.1:{port}"
+        recorder = Recorder()
+        stop = threading.Event()
+        server_samples = []
+        threads = [threading.Thread(target=sample_server, args=(process.pid, server_samples, stop), daemon=True)]
+        for operator in range(args.operators):
+            threads.append(threading.Thread(target=run_operator, daemon=True,
+                                            args=(recorder, base_url, args, args.seed + operator, stop)))
+            threads.append(threading.Thread(target=run_poller, args=(recorder, base_url, args, stop), daemon=True))
+
+        started = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        stop.wait(args.duration)
+        stop.set()
+        # Requests in flight are finished and counted
+        for thread in threads:
+            thread.join()
+        duration = time.perf_counter() - started
+    finally:
+        if process:
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+        if server_log:
+            server_log.close()
+        if not args.keep:
+            shutil.rmtree(work_dir, ignore_errors=True)
+
+    endpoints = recorder.summary(duration)
+    server = summarize_server(server_samples)
+    failing = [endpoint for endpoint, stats in endpoints.items()
+               if args.max_error_rate is not None and stats['error_rate'] > args.max_error_rate]
+
+    if args.json:
+        print(json.dumps({
+            'operators': args.operators,
+            'stores': args.stores,
+            'duration_seconds': round(duration, 1),
+            'endpoints': endpoints,
+            'server': server,
+            'failing': failing
+        }, indent=1))
+    else:
+        print(f"{args.operators} operators, {args.stores} stores, {args.latency_ms:g} ms per store operation, "
+              f"{duration:.0f}s")
+        print(f"  {'endpoint':<32} {'requests':>8} {'req/s':>6} {'errors':>7} "
+              f"{'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+        for endpoint, stats in endpoints.items():
+            print(f"  {endpoint:<32} {stats['requests']:>8} {stats['per_second']:>6} "
+                  f"{stats['error_rate']:>7.1%} {stats['p50_ms']:>8} {stats['p90_ms']:>8} "
+                  f"{stats['p99_ms']:>8} {stats['max_ms']:>8}")
+            for error in stats['first_errors']:
+                print(f"      error: {error}")
+        if server:
+            print(f"  server memory (MB)  start {server['rss_mb']['start']}  peak {server['rss_mb']['peak']}  "
+                  f"end {server['rss_mb']['end']}")
+            print(f"  server threads      start {server['threads']['start']}  peak {server['threads']['peak']}  "
+                  f"end {server['threads']['end']}")
+        else:
+            print("  server memory/threads: unavailable (pip install psutil)")
+        if args.keep:
+            print(f"  work folder: {work_dir}")
+        if failing:
+            print(f"  error rate above {args.max_error_rate:.1%}: {', '.join(failing)}")
+
+    if failing:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
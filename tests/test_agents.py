@@ -0,0 +1,106 @@
+"""
+Agent mode: a local agent loop runs the tasks of the main instance against the
+'local' share backend and posts the rows back through /agents/.../results
+"""
+import threading
+import time
+
+import pandas as pd
+import pytest
+from werkzeug.serving import make_server
+
+import app
+
+
+@pytest.fixture
+def stores_root(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'SHARE_BACKEND', 'local')
+    monkeypatch.setattr(app, 'SHARE_LOCAL_ROOT', str(tmp_path / 'stores'))
+    monkeypatch.setattr(app, 'SHARE_LOCAL_LATENCY_MS', 0)
+    monkeypatch.setattr(app, 'share_backends', {})
+    monkeypatch.setattr(app, 'agents', {})
+    monkeypatch.setattr(app, 'agent_tasks', {})
+    monkeypatch.setattr(app, 'AGENT_TOKEN', '')
+    monkeypatch.setattr(app, 'AGENT_POLL_SECONDS', 0.05)
+    for ip_address in ('10.0.0.1', '10.0.0.2', '192.168.1.1'):
+        (tmp_path / 'stores' / ip_address / 'partage').mkdir(parents=True)
+    (tmp_path / 'stores' / '10.0.0.1' / 'partage' / 'prix.xml').write_bytes(b'<prix/>')
+    (tmp_path / 'stores' / '192.168.1.1' / 'partage' / 'prix.xml').write_bytes(b'<prix/>')
+    return tmp_path / 'stores'
+
+
+@pytest.fixture
+def main_instance():
+    server = make_server('127.0.0.1', 0, app.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}'
+    server.shutdown()
+
+
+def wait_for_agents(count, timeout=10):
+    deadline = time.monotonic() + timeout
+    while len(app.agents) < count:
+        assert time.monotonic() < deadline, 'agent did not register'
+        time.sleep(0.05)
+
+
+def test_check_runs_on_local_agent(stores_root, main_instance, tmp_path):
+    inventory = tmp_path / 'inventory.xlsx'
+    pd.DataFrame({'CodeMag': ['A', 'B', 'C'],
+                  'ipaddress': ['10.0.0.1', '10.0.0.2', '192.168.1.1']}).to_excel(inventory, index=False)
+
+    # The agent serves 10.0.0.0/24, store C has no agent and is checked here
+    threading.Thread(target=app.run_agent, args=(main_instance, 'agent-test', [], ['10.0.0.0/24']),
+                     daemon=True).start()
+    wait_for_agents(1)
+
+    result = app.process_excel(str(inventory), 'prix.xml', 'partage', engine='agents')
+
+    assert [row['Exists'] for row in result['results']] == ['Yes', 'No', 'Yes']
+    assert [row['CodeMag'] for row in result['results']] == ['A', 'B', 'C']
+    agent, = app.agents.values()
+    assert agent['tasks_done'] == 1
+    assert app.agent_tasks == {}
+
+
+def queue_running_task(agent_id, task, stores):
+    task_id = 'task_test'
+    app.agent_tasks[task_id] = {
+        'task_id': task_id, 'agent_id': agent_id, 'task': task, 'kind': task, 'job_id': None,
+        'timings': None, 'indexes': list(range(len(stores))), 'stores': stores, 'args': [],
+        'status': 'running', 'created': time.time(), 'claimed': time.time(),
+        'rows': None, 'error': None, 'done': threading.Event()
+    }
+    return app.agent_tasks[task_id]
+
+
+@pytest.mark.parametrize('rows', [
+    [{'CodeMag': 'A', 'IPAddress': '10.0.0.9', 'Exists': 'Yes'}],  # Another store
+    [{'CodeMag': 'A', 'IPAddress': '10.0.0.1'}],                   # Missing field
+    ['Yes'],
+    [],
+])
+def test_invalid_agent_rows_are_refused(stores_root, rows):
+    client = app.app.test_client()
+    agent_id = client.post('/agents/register', json={'name': 'agent-test', 'subnets': ['10.0.0.0/24']}).json['agent_id']
+    agent_task = queue_running_task(agent_id, 'check', [('A', '10.0.0.1')])
+
+    response = client.post(f'/agents/{agent_id}/tasks/task_test/results', json={'rows': rows})
+
+    assert response.status_code == 200
+    assert agent_task['error'] == 'Invalid result rows' and agent_task['rows'] is None
+
+
+def test_agent_routes_need_token_from_remote_hosts(stores_root):
+    client = app.app.test_client()
+    response = client.post('/agents/register', json={'name': 'remote', 'subnets': ['10.0.0.0/24']},
+                           environ_base={'REMOTE_ADDR': '10.1.2.3'})
+    assert response.status_code == 403
+
+
+def test_bulk_test_refuses_agents_with_operator_credentials(stores_root):
+    client = app.app.test_client()
+    response = client.post('/test-bulk-connections', json={'excel_file': 'ips.xlsx', 'engine': 'agents',
+                                                           'username': 'operateur', 'password': 'secret'})
+    assert response.status_code == 400
+    assert 'agents' in response.json['error']
@@ -0,0 +1,164 @@
+"""
+Share backends: the 'local' backend on a temporary folder, and the 'smb' backend
+against a fake smbclient module (smbprotocol is not needed to run these tests)
+"""
+import hashlib
+import os
+import sys
+import types
+
+import pytest
+
+import app
+
+
+@pytest.fixture
+def local_backend(tmp_path, monkeypatch):
+    monkeypatch.setattr(app, 'SHARE_BACKEND', 'local')
+    monkeypatch.setattr(app, 'SHARE_LOCAL_ROOT', str(tmp_path / 'stores'))
+    monkeypatch.setattr(app, 'SHARE_LOCAL_LATENCY_MS', 0)
+    monkeypatch.setattr(app, 'share_backends', {})
+    (tmp_path / 'stores' / '10.0.0.1' / 'partage').mkdir(parents=True)
+    return app.get_share_backend()
+
+
+@pytest.fixture
+def source_file(tmp_path):
+    path = tmp_path / 'prix.xml'
+    path.write_bytes(b'<prix>12.50</prix>\n' * 1000)
+    return str(path)
+
+
+def test_local_connect(local_backend):
+    assert local_backend.connect(app.get_network_path('10.0.0.1', 'partage'))[0] == 0
+    assert local_backend.connect(app.get_network_path('10.0.0.9', 'partage'))[0] != 0
+
+
+def test_local_makedirs_copy_and_stat(local_backend, source_file):
+    directory = app.get_network_path('10.0.0.1', 'partage', 'in', 'today')
+    dest_path = app.get_network_path('10.0.0.1', 'partage', 'in', 'today', 'prix.xml')
+
+    local_backend.makedirs(directory)
+    local_backend.makedirs(directory)  # Already there
+    assert local_backend.stat_or_none(dest_path) is None
+
+    local_backend.copy(source_file, dest_path)
+    stat = local_backend.stat(dest_path)
+    assert stat.st_size == os.path.getsize(source_file)
+    assert int(stat.st_mtime) == int(os.stat(source_file).st_mtime)
+
+
+def test_local_open_and_scandir(local_backend):
+    directory = app.get_network_path('10.0.0.1', 'partage')
+    with local_backend.open(app.get_network_path('10.0.0.1', 'partage', 'a.txt'), 'wb') as f:
+        f.write(b'abc')
+    with local_backend.open(app.get_network_path('10.0.0.1', 'partage', 'a.txt')) as f:
+        assert f.read() == b'abc'
+    with local_backend.scandir(directory) as entries:
+        assert [entry.name for entry in entries] == ['a.txt']
+
+
+def test_local_hash_through_opener(local_backend, source_file):
+    dest_path = app.get_network_path('10.0.0.1', 'partage', 'prix.xml')
+    local_backend.copy(source_file, dest_path)
+    with open(source_file, 'rb') as f:
+        expected = hashlib.sha256(f.read()).hexdigest()
+    assert app.compute_file_hash(dest_path, chunk_size=1024, opener=local_backend.open) == expected
+    assert app.compute_file_hash(source_file) == expected
+
+
+def test_check_file_exists_on_local_backend(local_backend, source_file):
+    local_backend.copy(source_file, app.get_network_path('10.0.0.1', 'partage', 'prix.xml'))
+
+    found = app.check_file_exists('10.0.0.1', 'partage', 'prix.xml', 'user', 'secret')
+    assert found['exists'] and found['size'] == os.path.getsize(source_file)
+    missing = app.check_file_exists('10.0.0.1', 'partage', 'absent.xml', 'user', 'secret')
+    assert not missing['exists'] and missing['error'] == 'File not found'
+    unreachable = app.check_file_exists('10.0.0.9', 'partage', 'prix.xml', 'user', 'secret')
+    assert not unreachable['exists'] and unreachable['error'].startswith('Échec de connexion')
+
+
+class FakeSmbClient(types.ModuleType):
+    """
+    Minimal smbclient: \\\\<server>\\<path> is <root>/<server>/<path>
+    """
+
+    def __init__(self, root):
+        super().__init__('smbclient')
+        self.root = root
+        self.sessions = {}
+
+    def local(self, path):
+        assert path.startswith('\\\\'), f'not a share path: {path}'
+        return os.path.join(self.root, *[part for part in path.split('\\') if part])
+
+    def register_session(self, server, username=None, password=None, connection_timeout=None):
+        if server == '10.0.0.9':
+            raise ConnectionError('Timed out')
+        self.sessions[server] = (username, password, connection_timeout)
+
+    def delete_session(self, server):
+        del self.sessions[server]
+
+    def stat(self, path):
+        return os.stat(self.local(path))
+
+    def makedirs(self, path, exist_ok=False):
+        os.makedirs(self.local(path), exist_ok=exist_ok)
+
+    def open_file(self, path, mode='r'):
+        return open(self.local(path), mode)
+
+    def scandir(self, path):
+        return os.scandir(self.local(path))
+
+    def utime(self, path, times=None):
+        os.utime(self.local(path), times=times)
+
+
+@pytest.fixture
+def smb_backend(tmp_path, monkeypatch):
+    client = FakeSmbClient(str(tmp_path / 'smb'))
+    monkeypatch.setitem(sys.modules, 'smbclient', client)
+    monkeypatch.setattr(app, 'SHARE_BACKEND', 'smb')
+    monkeypatch.setattr(app, 'share_backends', {})
+    (tmp_path / 'smb' / '10.0.0.1' / 'partage').mkdir(parents=True)
+    backend = app.get_share_backend()
+    assert backend.client is client
+    return backend
+
+
+def test_smb_sessions(smb_backend):
+    share = app.get_network_path('10.0.0.1', 'partage')
+    assert smb_backend.connect(share, 'user', 'secret') == (0, '', '')
+    assert smb_backend.client.sessions['10.0.0.1'] == ('user', 'secret', app.SMB_CONNECTION_TIMEOUT)
+
+    smb_backend.disconnect(share)
+    assert smb_backend.client.sessions == {}
+    smb_backend.disconnect(share)  # No session left, only logged
+
+    returncode, stdout, stderr = smb_backend.connect(app.get_network_path('10.0.0.9', 'partage'), 'user', 'secret')
+    assert returncode != 0 and 'Timed out' in stderr
+
+
+def test_smb_copy_stat_and_hash(smb_backend, source_file):
+    directory = app.get_network_path('10.0.0.1', 'partage', 'in')
+    dest_path = app.get_network_path('10.0.0.1', 'partage', 'in', 'prix.xml')
+
+    smb_backend.makedirs(directory)
+    assert smb_backend.stat_or_none(dest_path) is None
+    smb_backend.copy(source_file, dest_path)
+
+    stat = smb_backend.stat(dest_path)
+    assert stat.st_size == os.path.getsize(source_file)
+    assert int(stat.st_mtime) == int(os.stat(source_file).st_mtime)
+    assert smb_backend.stat(source_file).st_size == stat.st_size  # Local paths go through os
+    assert app.compute_file_hash(dest_path, opener=smb_backend.open) == app.compute_file_hash(source_file)
+    with smb_backend.scandir(directory) as entries:
+        assert [entry.name for entry in entries] == ['prix.xml']
+
+
+def test_smb_requires_smbprotocol(monkeypatch):
+    monkeypatch.setitem(sys.modules, 'smbclient', None)
+    with pytest.raises(RuntimeError, match='smbprotocol'):
+        app.SmbShareBackend()